@@ -0,0 +1,171 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
+from pydantic import BaseModel
+
+from utils.retrieval_cache import normalize_query
+
+# Questions answered at the same time by a batch
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+
+class BatchResult(BaseModel):
+    """
+    Answer to one question of a batch, with `index` its position in the input.
+    """
+
+    index: int
+    question: str
+    answer: Optional[str] = None
+    error: Optional[str] = None
+    seconds: float = 0.0
+
+
+def _final_answer(messages: Sequence) -> Optional[str]:
+    for message in reversed(messages):
+        if isinstance(message, AIMessage) and not message.tool_calls:
+            return message.text()
+    return None
+
+
+def _prime_query_embeddings(questions: List[str]):
+    """
+    Embed every question of the batch up front in a few model calls, so the answer
+    cache, the retriever and the graders find their query vectors in memory.
+    """
+    from utils.aws_bedrock import get_embeddings
+
+    embeddings = get_embeddings()
+    if hasattr(embeddings, "embed_queries"):
+        embeddings.embed_queries(questions)
+
+
+async def abatch_answers(
+    questions: Sequence[str],
+    concurrency: int = BATCH_CONCURRENCY,
+    config: Optional[RunnableConfig] = None,
+) -> AsyncIterator[BatchResult]:
+    """
+    Answer many questions, each as a new conversation, and yield their results as
+    they finish rather than in input order. Questions that only differ in case or
+    whitespace run once and share their answer.
+    """
+    import main
+
+    graph = main._graph
+
+    # Positions of the questions asked more than once, answered once for all of them
+    duplicates: Dict[str, List[int]] = {}
+    for index, question in enumerate(questions):
+        duplicates.setdefault(normalize_query(question), []).append(index)
+    groups = list(duplicates.values())
+
+    await asyncio.get_running_loop().run_in_executor(
+        None, _prime_query_embeddings, [questions[group[0]] for group in groups]
+    )
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(group: List[int]) -> List[BatchResult]:
+        question = questions[group[0]]
+        async with semaphore:
+            started = time.perf_counter()
+            text = error = None
+            try:
+                output = await graph.ainvoke(
+                    {"messages": [HumanMessage(content=question)]}, config
+                )
+                text = _final_answer(output.get("messages", []))
+            except Exception as exception:
+                error = repr(exception)
+            seconds = time.perf_counter() - started
+        return [
+            BatchResult(
+                index=index,
+                question=questions[index],
+                answer=text,
+                error=error,
+                seconds=seconds,
+            )
+            for index in group
+        ]
+
+    tasks = [asyncio.ensure_future(answer(group)) for group in groups]
+    try:
+        for task in asyncio.as_completed(tasks):
+            for result in await task:
+                yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def batch_answers(
+    questions: Sequence[str],
+    concurrency: int = BATCH_CONCURRENCY,
+    config: Optional[RunnableConfig] = None,
+) -> Iterator[BatchResult]:
+    """
+    Synchronous variant of `abatch_answers`, for scripts. Results are yielded as the
+    questions finish.
+    """
+    loop = asyncio.new_event_loop()
+    results = abatch_answers(questions, concurrency, config)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(anext(results))
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(results.aclose())
+        loop.close()
+
+
+def load_questions(path: str) -> List[str]:
+    """
+    Read questions from a JSONL file with a `question` field per line, or from a text
+    file with one question per line.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if path.endswith(".jsonl"):
+        return [json.loads(line)["question"] for line in lines]
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Answer a batch of questions, such as an evaluation set, writing "
+        "each answer as a JSON line as soon as it is ready."
+    )
+    parser.add_argument(
+        "questions", help="JSONL file with a `question` per line, or a text file"
+    )
+    parser.add_argument("--output", help="JSONL file to write, instead of stdout")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    output = open(args.output, "w", encoding="utf-8") if args.output else None
+    try:
+        for result in batch_answers(questions, args.concurrency):
+            line = result.model_dump_json()
+            if output is not None:
+                output.write(line + "\n")
+                output.flush()
+            else:
+                print(line, flush=True)
+    finally:
+        if output is not None:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
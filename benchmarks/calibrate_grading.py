@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.grading_cascade import (  # noqa: E402
+    DEFAULT_THRESHOLDS,
+    GRADING_THRESHOLDS_PATH,
+    GradingSignals,
+    compute_signals,
+    local_verdicts,
+)
+
+# Share of the locally settled verdicts that must agree with the labels
+TARGET_PRECISION = 0.97
+
+# Fewest labelled cases a threshold may be based on
+MIN_SUPPORT = 10
+
+# Signals are similarities and overlaps in [-1, 1]; these bounds never trigger
+_NEVER_ACCEPT = 2.0
+_NEVER_REJECT = -1.0
+
+_LABELS = ["grounded", "resolves_question"]
+
+
+def load_cases(path: str) -> List[Dict[str, Any]]:
+    """
+    Read the cases, one JSON object per line with `question`, `answer`, `documents`
+    (a string or a list of chunks) and optionally the `grounded` and
+    `resolves_question` labels.
+    """
+    from utils.context import join_documents
+
+    cases = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            case = json.loads(line)
+            if isinstance(case.get("documents"), list):
+                case["documents"] = join_documents(case["documents"])
+            cases.append(case)
+    return cases
+
+
+def label_with_llm(cases: List[Dict[str, Any]]):
+    """
+    Fill in the missing labels with the verdicts of the LLM graders.
+    """
+    from nodes.grade_answer import _grade_answer_inputs, _grading_chains
+    from models.state import AgentState
+
+    hallucination_chain, answer_chain = _grading_chains()
+    for case in cases:
+        if all(label in case for label in _LABELS):
+            continue
+        state = AgentState(
+            messages=[],
+            original_user_query=case["question"],
+            generated_answer=case["answer"],
+            documents=case["documents"],
+        )
+        inputs = _grade_answer_inputs(state)
+        if "grounded" not in case:
+            case["grounded"] = hallucination_chain.invoke(inputs).grading
+        if "resolves_question" not in case:
+            case["resolves_question"] = answer_chain.invoke(inputs).grading
+
+
+def fit_band(
+    samples: List[Tuple[float, bool]], precision: float, min_support: int
+) -> Dict[str, float]:
+    """
+    Lowest accept threshold above which, and highest reject threshold below which,
+    at least `precision` of the samples carry the matching label.
+    """
+    accept, reject = _NEVER_ACCEPT, _NEVER_REJECT
+
+    ranked = sorted(samples, key=lambda sample: sample[0], reverse=True)
+    positives = 0
+    for seen, (value, label) in enumerate(ranked, start=1):
+        positives += label
+        if seen >= min_support and positives / seen >= precision:
+            accept = value
+
+    negatives = 0
+    for seen, (value, label) in enumerate(reversed(ranked), start=1):
+        # The bands must not overlap, values from the accept band on stay accepted
+        if value >= accept:
+            break
+        negatives += not label
+        if seen >= min_support and negatives / seen >= precision:
+            reject = value
+    return {"accept": accept, "reject": reject}
+
+
+def calibrate(
+    cases: List[Dict[str, Any]],
+    signals: List[GradingSignals],
+    precision: float,
+    min_support: int,
+) -> Dict[str, Any]:
+    thresholds: Dict[str, Any] = {}
+    for label, bands in DEFAULT_THRESHOLDS.items():
+        thresholds[label] = {}
+        for name in bands:
+            samples = [
+                (getattr(signal, name), bool(case[label]))
+                for case, signal in zip(cases, signals)
+                # Answers admitting not knowing are settled without thresholds
+                if not signal.dont_know and getattr(signal, name) is not None
+            ]
+            thresholds[label][name] = fit_band(samples, precision, min_support)
+    return thresholds
+
+
+def evaluate(
+    cases: List[Dict[str, Any]],
+    signals: List[GradingSignals],
+    thresholds: Dict[str, Any],
+) -> Dict[str, Dict[str, Optional[float]]]:
+    """
+    Share of the verdicts settled locally, and how many of those match the labels.
+    """
+    report = {}
+    for position, label in enumerate(_LABELS):
+        settled = agreed = 0
+        for case, signal in zip(cases, signals):
+            verdict = local_verdicts(signal, thresholds)[position]
+            if verdict is None:
+                continue
+            settled += 1
+            agreed += verdict == bool(case[label])
+        report[label] = {
+            "settled_locally": settled / len(cases) if cases else None,
+            "precision": agreed / settled if settled else None,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Calibrate the thresholds of the local answer grading signals "
+        "against labelled answers."
+    )
+    parser.add_argument("cases", help="JSONL file with the labelled answers")
+    parser.add_argument(
+        "--label-with-llm",
+        action="store_true",
+        help="Label the cases missing labels with the LLM graders (calls Bedrock)",
+    )
+    parser.add_argument("--precision", type=float, default=TARGET_PRECISION)
+    parser.add_argument("--min-support", type=int, default=MIN_SUPPORT)
+    parser.add_argument("--output", default=GRADING_THRESHOLDS_PATH)
+    args = parser.parse_args()
+
+    cases = load_cases(args.cases)
+    if args.label_with_llm:
+        label_with_llm(cases)
+    unlabelled = [case for case in cases if not all(label in case for label in _LABELS)]
+    if unlabelled:
+        parser.error(
+            f"{len(unlabelled)} cases lack labels, label them or pass --label-with-llm"
+        )
+
+    from utils.aws_bedrock import get_embeddings
+
+    embeddings = get_embeddings()
+    signals = [
+        compute_signals(case["question"], case["answer"], case["documents"], embeddings)
+        for case in cases
+    ]
+
+    thresholds = calibrate(cases, signals, args.precision, args.min_support)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(thresholds, f, indent=2)
+
+    print(f"Thresholds written to {args.output}")
+    for label, result in evaluate(cases, signals, thresholds).items():
+        settled = result["settled_locally"] or 0.0
+        precision = result["precision"]
+        print(
+            f"{label}: {settled:.0%} settled locally"
+            + (
+                f", {precision:.1%} agreeing with the labels"
+                if precision is not None
+                else ""
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.calibrate_grading import fit_band  # noqa: E402
+from utils.intent import (  # noqa: E402
+    INTENT_SEARCH_MARGIN,
+    INTENT_SEARCH_THRESHOLD,
+    IntentClassifier,
+)
+
+# Share of the questions routed to retrieval by the classifier that the supervisor
+# model would have searched as well
+TARGET_PRECISION = 0.97
+
+# Fewest labelled questions a threshold may be based on
+MIN_SUPPORT = 10
+
+# Leads over the closest example of the other intents that are tried
+MARGINS = (0.2, 0.15, 0.1, 0.05, 0.0)
+
+# Similarities of the normalized embeddings are in [-1, 1]; this bound never triggers
+_NEVER_ROUTE = 2.0
+
+# Similarity to the closest search example, and to the closest other example
+Similarities = Tuple[float, float]
+
+
+def load_questions(path: str) -> List[Dict[str, Any]]:
+    """
+    Read the questions, one JSON object per line with a `question` and optionally a
+    boolean `search` label: whether the question should be searched in the guide.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def label_with_llm(cases: List[Dict[str, Any]]):
+    """
+    Fill in the missing labels with the routing of the supervisor model.
+    """
+    from langchain_core.messages import HumanMessage
+
+    from models.state import AgentState
+    from nodes.supervise import _supervise_chain, _supervise_inputs
+
+    chain = _supervise_chain()
+    for case in cases:
+        if "search" in case:
+            continue
+        state = AgentState(
+            messages=[HumanMessage(content=case["question"])],
+            original_user_query=case["question"],
+        )
+        inputs, _ = _supervise_inputs(state)
+        case["search"] = bool(chain.invoke(inputs).tool_calls)
+
+
+def _routed(
+    cases: List[Dict[str, Any]],
+    similarities: List[Similarities],
+    threshold: float,
+    margin: float,
+) -> List[bool]:
+    """
+    Labels of the questions the classifier routes to retrieval.
+    """
+    return [
+        bool(case["search"])
+        for case, (search, other) in zip(cases, similarities)
+        if search >= threshold and search - other >= margin
+    ]
+
+
+def calibrate(
+    cases: List[Dict[str, Any]],
+    similarities: List[Similarities],
+    precision: float,
+    min_support: int,
+) -> Tuple[float, float]:
+    """
+    The (threshold, margin) routing the most questions to retrieval while keeping at
+    least `precision` of them questions the model would have searched.
+    """
+    best = (_NEVER_ROUTE, MARGINS[0])
+    best_routed = 0
+    for margin in MARGINS:
+        samples = [
+            (search, bool(case["search"]))
+            for case, (search, other) in zip(cases, similarities)
+            if search - other >= margin
+        ]
+        threshold = fit_band(samples, precision, min_support)["accept"]
+        routed = len(_routed(cases, similarities, threshold, margin))
+        # Margins are tried from the largest, which wins ties
+        if routed > best_routed:
+            best, best_routed = (threshold, margin), routed
+    return best
+
+
+def report(
+    name: str,
+    cases: List[Dict[str, Any]],
+    similarities: List[Similarities],
+    threshold: float,
+    margin: float,
+):
+    routed = _routed(cases, similarities, threshold, margin)
+    share = len(routed) / len(cases) if cases else 0.0
+    line = f"{name}: threshold {threshold:.3f}, margin {margin:.2f}, {share:.0%} routed"
+    if routed:
+        line += f", {sum(routed) / len(routed):.1%} of them searched by the model"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Calibrate the intent classifier's similarity threshold and "
+        "margin against labelled first-turn questions."
+    )
+    parser.add_argument("questions", help="JSONL file with the labelled questions")
+    parser.add_argument(
+        "--label-with-llm",
+        action="store_true",
+        help="Label the questions missing labels with the supervisor model "
+        "(calls Bedrock)",
+    )
+    parser.add_argument("--precision", type=float, default=TARGET_PRECISION)
+    parser.add_argument("--min-support", type=int, default=MIN_SUPPORT)
+    args = parser.parse_args()
+
+    cases = load_questions(args.questions)
+    if args.label_with_llm:
+        label_with_llm(cases)
+    unlabelled = [case for case in cases if "search" not in case]
+    if unlabelled:
+        parser.error(
+            f"{len(unlabelled)} questions lack labels, label them or pass "
+            "--label-with-llm"
+        )
+
+    from utils.aws_bedrock import get_embeddings
+
+    classifier = IntentClassifier(get_embeddings())
+    similarities = [classifier.similarities(case["question"]) for case in cases]
+
+    threshold, margin = calibrate(cases, similarities, args.precision, args.min_support)
+    report(
+        "current", cases, similarities, INTENT_SEARCH_THRESHOLD, INTENT_SEARCH_MARGIN
+    )
+    report("calibrated", cases, similarities, threshold, margin)
+    if threshold >= _NEVER_ROUTE:
+        print("No threshold reaches the target precision, keep the classifier off")
+        return
+    print(f'INTENT_SEARCH_THRESHOLD="{threshold:.3f}"')
+    print(f'INTENT_SEARCH_MARGIN="{margin:.2f}"')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import Field
+
+from utils.lexical_index import tokenize
+from utils.tokens import estimate_tokens
+
+# Dimension of the Cohere multilingual v3 embeddings
+EMBEDDING_DIMENSION = 1024
+
+ANSWER = (
+    "Sidechain compression ducks the bass whenever the kick drum hits, so both keep "
+    "their own space in the low end. Route the kick to the compressor's sidechain "
+    "input on the bass channel and tune attack and release to the groove."
+)
+
+
+def _fraction(text: str, salt: str = "") -> float:
+    """
+    Map a text to a stable number in [0, 1), used for deterministic decisions.
+    """
+    digest = hashlib.sha256((salt + text).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
+
+
+class CallCounter:
+    """
+    Thread-safe call counter, shared by the copies `get_chat_model` makes of a fake.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def increment(self):
+        with self._lock:
+            self.calls += 1
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for the Bedrock chat model.
+
+    Tool calls and structured outputs are filled in from the JSON schema of the first
+    bound tool. Booleans are true for `pass_ratio` of the prompts, and the supervisor
+    answers directly instead of searching for `direct_answer_ratio` of them.
+    """
+
+    latency: float = 0.0
+    pass_ratio: float = 0.9
+    direct_answer_ratio: float = 0.1
+    counter: CallCounter = Field(default_factory=CallCounter, exclude=True)
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools: Sequence[Any], tool_choice: Any = None, **kwargs):
+        return self.bind(
+            tools=[convert_to_openai_tool(tool) for tool in tools],
+            tool_choice=tool_choice,
+            **kwargs,
+        )
+
+    def _fill(self, schema: Dict[str, Any], prompt: str, path: str) -> Any:
+        kind = schema.get("type")
+        if kind == "boolean":
+            return _fraction(prompt, path) < self.pass_ratio
+        if kind == "integer":
+            return 0
+        if kind == "number":
+            return 0.0
+        if kind == "string":
+            return f"{prompt.strip().splitlines()[-1][-80:]} ({path})"
+        if kind == "array":
+            if schema.get("items", {}).get("type") == "string":
+                return [
+                    self._fill(schema["items"], prompt, f"{path}{i}") for i in range(3)
+                ]
+            return []
+        if kind == "object":
+            return {
+                name: self._fill(prop, prompt, f"{path}.{name}")
+                for name, prop in schema.get("properties", {}).items()
+            }
+        return None
+
+    def _respond(
+        self,
+        messages: List[BaseMessage],
+        tools: Optional[List[Dict[str, Any]]] = None,
+        tool_choice: Any = None,
+    ) -> AIMessage:
+        self.counter.increment()
+        prompt = "\n".join(message.text() for message in messages)
+        usage = {
+            "input_tokens": estimate_tokens(prompt),
+            "output_tokens": estimate_tokens(ANSWER),
+            "total_tokens": estimate_tokens(prompt) + estimate_tokens(ANSWER),
+        }
+
+        answer_directly = (
+            not tool_choice and _fraction(prompt) < self.direct_answer_ratio
+        )
+        if not tools or answer_directly:
+            return AIMessage(content=ANSWER, usage_metadata=usage)
+
+        function = tools[0]["function"]
+        tool_call = {
+            "name": function["name"],
+            "args": self._fill(function["parameters"], prompt, function["name"]),
+            "id": f"call_{uuid.uuid4().hex}",
+        }
+        return AIMessage(content="", tool_calls=[tool_call], usage_metadata=usage)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.latency)
+        message = self._respond(
+            messages, kwargs.get("tools"), kwargs.get("tool_choice")
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        message = self._respond(
+            messages, kwargs.get("tools"), kwargs.get("tool_choice")
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ):
+        message = self._respond(
+            messages, kwargs.get("tools"), kwargs.get("tool_choice")
+        )
+        if message.tool_calls:
+            time.sleep(self.latency)
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(
+                    content="",
+                    tool_call_chunks=[
+                        {
+                            "name": tool_call["name"],
+                            "args": json.dumps(tool_call["args"]),
+                            "id": tool_call["id"],
+                            "index": 0,
+                        }
+                        for tool_call in message.tool_calls
+                    ],
+                    usage_metadata=message.usage_metadata,
+                )
+            )
+            return
+
+        # Spread the latency over the tokens, so the first one arrives early
+        words = message.content.split(" ")
+        for position, word in enumerate(words):
+            time.sleep(self.latency / len(words))
+            text = word if position == len(words) - 1 else word + " "
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+            if run_manager:
+                run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic stand-in for the Bedrock embeddings: unit vectors seeded by the text.
+    """
+
+    def __init__(self, latency: float = 0.0, dimension: int = EMBEDDING_DIMENSION):
+        self.latency = latency
+        self.dimension = dimension
+
+    def _embed(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._embed(text)
+
+
+class FakeReranker:
+    """
+    Deterministic stand-in for the Bedrock reranker, scoring documents by the share of
+    query terms they contain.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def rerank(
+        self,
+        documents: Sequence[Union[str, Document]],
+        query: str,
+        top_n: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        time.sleep(self.latency)
+        query_terms = set(tokenize(query))
+        results = []
+        for index, document in enumerate(documents):
+            text = document.page_content if isinstance(document, Document) else document
+            overlap = len(query_terms & set(tokenize(text)))
+            score = overlap / len(query_terms) if query_terms else 0.0
+            results.append({"index": index, "relevance_score": score})
+        results.sort(key=lambda result: result["relevance_score"], reverse=True)
+        return results[:top_n]
@@ -0,0 +1,86 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Budget for the project's own share of the cold start: importing `main` once its
+# dependencies are loaded, plus compiling the graph. Importing langgraph and
+# langchain_core alone takes about a second and is outside this repository's control.
+PROJECT_IMPORT_BUDGET_SECONDS = 0.25
+
+# Third-party modules `main` needs at import time, loaded first as the baseline
+DEPENDENCY_MODULES = [
+    "pydantic",
+    "langchain_core.messages",
+    "langchain_core.prompts",
+    "langchain_core.runnables",
+    "langchain_core.tools",
+    "langgraph.graph",
+    "langgraph.prebuilt",
+]
+
+# Modules that must only be loaded once retrieval or a Bedrock call is needed
+DEFERRED_MODULES = ["boto3", "chromadb", "langchain_aws", "langchain_chroma", "pypdf"]
+
+_PROBE = """
+import importlib, json, sys, time
+start = time.perf_counter()
+for name in %r:
+    importlib.import_module(name)
+dependencies = time.perf_counter()
+import main
+imported = time.perf_counter()
+main._graph
+compiled = time.perf_counter()
+print(json.dumps({
+    "dependencies": dependencies - start,
+    "import": imported - dependencies,
+    "compile": compiled - imported,
+    "loaded": [name for name in %r if name in sys.modules],
+}))
+"""
+
+
+def measure() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE % (DEPENDENCY_MODULES, DEFERRED_MODULES)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the project's share of the graph module's cold start "
+        "against a budget."
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=PROJECT_IMPORT_BUDGET_SECONDS)
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    dependency_time = statistics.median(run["dependencies"] for run in runs)
+    import_time = statistics.median(run["import"] for run in runs)
+    compile_time = statistics.median(run["compile"] for run in runs)
+    loaded = sorted({name for run in runs for name in run["loaded"]})
+
+    print(f"dependencies:  {dependency_time * 1000:.1f} ms (median of {args.runs})")
+    print(f"import main:   {import_time * 1000:.1f} ms (median of {args.runs})")
+    print(f"compile graph: {compile_time * 1000:.1f} ms (median of {args.runs})")
+
+    failed = False
+    if import_time + compile_time > args.budget:
+        print(f"Project cold start exceeds the budget of {args.budget * 1000:.0f} ms")
+        failed = True
+    if loaded:
+        print(f"Modules loaded eagerly that should be deferred: {', '.join(loaded)}")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import HumanMessage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeChatModel, FakeEmbeddings, FakeReranker  # noqa: E402
+from nodes.retrieve_documents import CORPUS_PATHS  # noqa: E402
+from utils.aws_bedrock import override_models  # noqa: E402
+
+QUERIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "queries.jsonl")
+
+# Relative increase of a baseline metric that counts as a regression
+REGRESSION_TOLERANCE = 0.2
+
+# Metrics compared against the baseline, all of which get worse as they grow
+_GATED_METRICS = ["p95_seconds", "llm_calls_per_request", "peak_memory_mb"]
+
+
+def load_questions(path: str) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["question"] for line in f if line.strip()]
+
+
+def peak_memory_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, Optional[float]]:
+    if not latencies:
+        return {"p50_seconds": None, "p95_seconds": None, "p99_seconds": None}
+    if len(latencies) == 1:
+        p50 = p95 = p99 = latencies[0]
+    else:
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    return {"p50_seconds": p50, "p95_seconds": p95, "p99_seconds": p99}
+
+
+def benchmark_ingestion(pdf_path: str) -> Dict[str, Any]:
+    """
+    Ingest the PDF into an empty vector store, then again into the unchanged store.
+    """
+    from utils.vector_store import load_vector_store
+
+    started = time.perf_counter()
+    load_vector_store([pdf_path], sync=True)
+    cold = time.perf_counter() - started
+
+    started = time.perf_counter()
+    load_vector_store([pdf_path], sync=True)
+    warm = time.perf_counter() - started
+
+    return {
+        "cold_seconds": cold,
+        "unchanged_seconds": warm,
+        "peak_memory_mb": peak_memory_mb(),
+    }
+
+
+async def benchmark_queries(
+    questions: List[str], concurrency: int, chat_model: FakeChatModel
+) -> Dict[str, Any]:
+    """
+    Replay the questions through the graph, each as a new conversation.
+    """
+    import main
+
+    graph = main._graph
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+
+    async def run(question: str):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await graph.ainvoke({"messages": [HumanMessage(content=question)]})
+            except Exception as error:
+                # e.g. GraphRecursionError when the graders keep rejecting the answer
+                name = type(error).__name__
+                errors[name] = errors.get(name, 0) + 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    calls_before = chat_model.counter.calls
+    started = time.perf_counter()
+    await asyncio.gather(*(run(question) for question in questions))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(questions),
+        "errors": errors,
+        "concurrency": concurrency,
+        "throughput_rps": len(questions) / elapsed,
+        **latency_summary(latencies),
+        "llm_calls_per_request": (chat_model.counter.calls - calls_before)
+        / len(questions),
+        "peak_memory_mb": peak_memory_mb(),
+    }
+
+
+def regressions(
+    report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float
+) -> List[str]:
+    found = []
+    for metric in _GATED_METRICS:
+        current = report["queries"][metric]
+        previous = baseline["queries"][metric]
+        if current is None or previous is None:
+            continue
+        if previous and current > previous * (1 + tolerance):
+            found.append(f"{metric}: {previous:.3f} -> {current:.3f}")
+    return found
+
+
+def print_report(report: Dict[str, Any]):
+    ingestion = report.get("ingestion")
+    if ingestion:
+        print(f"ingestion (cold):      {ingestion['cold_seconds']:.2f} s")
+        print(f"ingestion (unchanged): {ingestion['unchanged_seconds']:.2f} s")
+
+    queries = report["queries"]
+    print(
+        f"requests:              {queries['requests']} "
+        f"(concurrency {queries['concurrency']})"
+    )
+    if queries["errors"]:
+        errors = ", ".join(f"{n} {name}" for name, n in queries["errors"].items())
+        print(f"failed requests:       {errors}")
+    print(f"throughput:            {queries['throughput_rps']:.2f} requests/s")
+    if queries["p50_seconds"] is not None:
+        print(
+            "latency p50/p95/p99:   "
+            f"{queries['p50_seconds'] * 1000:.0f} / "
+            f"{queries['p95_seconds'] * 1000:.0f} / "
+            f"{queries['p99_seconds'] * 1000:.0f} ms"
+        )
+    print(f"LLM calls per request: {queries['llm_calls_per_request']:.2f}")
+    print(f"peak memory:           {queries['peak_memory_mb']:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark ingestion and the graph offline, with local fakes "
+        "standing in for the Bedrock models."
+    )
+    parser.add_argument(
+        "--pdf",
+        default=CORPUS_PATHS[0],
+        help="PDF to ingest before replaying the queries",
+    )
+    parser.add_argument("--queries", default=QUERIES_PATH)
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="Times the query corpus is replayed"
+    )
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--rerank-latency", type=float, default=0.1)
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--baseline", help="Fail on regressions against this report")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args()
+
+    pdf_path = os.path.abspath(args.pdf)
+    if not os.path.exists(pdf_path):
+        parser.error(f"PDF not found: {pdf_path}")
+    questions = load_questions(args.queries) * args.repeat
+    output_path = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    chat_model = FakeChatModel(latency=args.llm_latency)
+    override_models(
+        chat_model=chat_model,
+        embeddings=FakeEmbeddings(latency=args.embedding_latency),
+        compressor=FakeReranker(latency=args.rerank_latency),
+    )
+
+    # The vector store, caches and corpus version all live in the working directory
+    with tempfile.TemporaryDirectory(prefix="agentic-rag-benchmark-") as workdir:
+        os.chdir(workdir)
+        report: Dict[str, Any] = {"ingestion": benchmark_ingestion(pdf_path)}
+        report["queries"] = asyncio.run(
+            benchmark_queries(questions, args.concurrency, chat_model)
+        )
+
+    print_report(report)
+
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    baseline: Optional[Dict[str, Any]] = None
+    if baseline_path:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        found = regressions(report, baseline, args.tolerance)
+        if found:
+            print("Regressions against the baseline:")
+            for regression in found:
+                print(f"  {regression}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
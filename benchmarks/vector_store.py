@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeEmbeddings  # noqa: E402
+
+BACKENDS = ["chroma", "numpy-float32", "numpy-int8"]
+
+_WORDS = (
+    "kick snare bass melody chord harmony groove tempo sample loop synth filter "
+    "envelope reverb delay compressor sidechain arrangement tension release mix "
+    "automation rhythm swing velocity voicing progression texture silence noise"
+).split()
+
+
+def synthetic_texts(count: int, words_per_chunk: int = 150) -> List[str]:
+    rng = random.Random(0)
+    return [
+        f"Chunk {i}: " + " ".join(rng.choices(_WORDS, k=words_per_chunk))
+        for i in range(count)
+    ]
+
+
+def memory_mb() -> Dict[str, float]:
+    """
+    Resident memory from /proc, split into private (anonymous) pages and file-backed
+    pages, which processes mapping the same file share.
+    """
+    fields = {}
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("VmRSS", "RssAnon", "RssFile"):
+                    fields[name] = int(value.split()[0]) / 1024
+    except OSError:
+        import resource
+
+        fields["VmRSS"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return fields
+
+
+def open_store(backend: str, directory: str):
+    embeddings = FakeEmbeddings()
+    if backend == "chroma":
+        from langchain_chroma import Chroma
+
+        return Chroma(
+            embedding_function=embeddings,
+            persist_directory=directory,
+            collection_name="benchmark",
+        )
+
+    from utils.numpy_store import NumpyVectorStore
+
+    return NumpyVectorStore(
+        embeddings, directory, quantization=backend.split("-", 1)[1]
+    )
+
+
+def build(backend: str, directory: str, chunks: int) -> Dict[str, Any]:
+    store = open_store(backend, directory)
+    texts = synthetic_texts(chunks)
+    started = time.perf_counter()
+    for start in range(0, len(texts), 500):
+        batch = texts[start : start + 500]
+        store.add_texts(batch, ids=[f"chunk-{start + i}" for i in range(len(batch))])
+    return {"build_seconds": time.perf_counter() - started}
+
+
+def query(
+    backend: str, directory: str, queries: int, k: int, batch: int
+) -> Dict[str, Any]:
+    before = memory_mb()
+    started = time.perf_counter()
+    store = open_store(backend, directory)
+    questions = [text[:80] for text in synthetic_texts(queries, words_per_chunk=12)]
+    store.similarity_search(questions[0], k=k)
+    first_query = time.perf_counter() - started
+
+    latencies = []
+    for question in questions:
+        started = time.perf_counter()
+        store.similarity_search(question, k=k)
+        latencies.append(time.perf_counter() - started)
+
+    batched = None
+    if hasattr(store, "similarity_search_batch"):
+        started = time.perf_counter()
+        for start in range(0, len(questions), batch):
+            store.similarity_search_batch(questions[start : start + batch], k=k)
+        batched = (time.perf_counter() - started) / len(questions)
+
+    after = memory_mb()
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "open_and_first_query_seconds": first_query,
+        "p50_ms": cuts[49] * 1000,
+        "p95_ms": cuts[94] * 1000,
+        "batched_ms_per_query": batched * 1000 if batched is not None else None,
+        "rss_mb": after.get("VmRSS"),
+        "rss_increase_mb": after.get("VmRSS", 0) - before.get("VmRSS", 0),
+        "rss_shared_file_mb": after.get("RssFile"),
+    }
+
+
+def run_worker(*args: str) -> Dict[str, Any]:
+    # Every backend is measured in a fresh process, so memory numbers do not mix
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", *args],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def print_report(report: Dict[str, Dict[str, Any]]):
+    print(
+        f"{'backend':<15} {'build s':>8} {'open s':>7} {'p50 ms':>7} {'p95 ms':>7} "
+        f"{'batch ms':>9} {'RSS MB':>7} {'+RSS MB':>8}"
+    )
+    for backend, result in report.items():
+        batched = result["batched_ms_per_query"]
+        print(
+            f"{backend:<15} {result['build_seconds']:>8.2f} "
+            f"{result['open_and_first_query_seconds']:>7.2f} "
+            f"{result['p50_ms']:>7.2f} {result['p95_ms']:>7.2f} "
+            f"{(f'{batched:.2f}' if batched is not None else '-'):>9} "
+            f"{result['rss_mb']:>7.0f} {result['rss_increase_mb']:>8.0f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the Chroma and memory-mapped NumPy vector store backends "
+        "on a synthetic corpus, for search latency and resident memory."
+    )
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument(
+        "--batch", type=int, default=4, help="Queries per batched search"
+    )
+    parser.add_argument("--backends", nargs="*", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--worker", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        command, backend, directory = args.worker
+        if command == "build":
+            result = build(backend, directory, args.chunks)
+        else:
+            result = query(backend, directory, args.queries, args.k, args.batch)
+        print(json.dumps(result))
+        return
+
+    report: Dict[str, Dict[str, Any]] = {}
+    with tempfile.TemporaryDirectory(prefix="vector-store-benchmark-") as workdir:
+        for backend in args.backends:
+            directory = os.path.join(workdir, backend)
+            options = [
+                f"--chunks={args.chunks}",
+                f"--queries={args.queries}",
+                f"--k={args.k}",
+                f"--batch={args.batch}",
+            ]
+            report[backend] = {
+                **run_worker("build", backend, directory, *options),
+                **run_worker("query", backend, directory, *options),
+            }
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import argparse
+
+from nodes.retrieve_documents import CORPUS_PATHS
+from utils.shards import DEFAULT_SHARD, load_shards
+from utils.vector_store import document_count, open_vector_store, sync_vector_store
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sync the vector stores of the corpus shards with their PDFs."
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        help="PDF files or directories to ingest into --shard (defaults to the PDFs "
+        "of every configured shard)",
+    )
+    parser.add_argument(
+        "--shard",
+        default=DEFAULT_SHARD,
+        help="Shard to ingest the given paths into",
+    )
+    args = parser.parse_args()
+
+    if args.paths:
+        targets = [(args.shard, args.paths)]
+    else:
+        targets = [(shard.name, shard.paths) for shard in load_shards(CORPUS_PATHS)]
+
+    for name, paths in targets:
+        vector_store = open_vector_store(name)
+        sync_vector_store(vector_store, paths, name)
+        print(f"Shard {name} contains {document_count(vector_store)} documents")
+
+
+if __name__ == "__main__":
+    main()
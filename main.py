@@ -1,42 +1,104 @@
+from functools import lru_cache
+
 from langgraph.graph import StateGraph, START, END
 from langgraph.prebuilt import tools_condition
+from langchain_core.runnables import RunnableLambda
 from langchain_core.runnables.graph import CurveStyle, MermaidDrawMethod
 
 
 from models.state import AgentState, InputAgentState, OutputAgentState
 
-from nodes.supervise import _supervise
+from nodes.check_answer_cache import _check_answer_cache
+from nodes.compact_history import _compact_history, _acompact_history
+from nodes.supervise import _supervise, _asupervise
 from nodes.retrieve_documents import _retrieve_documents
-from nodes.grade_documents import _grade_documents
-from nodes.generate import _generate
-from nodes.rephrase_query import _rephrase_query
-from nodes.grade_answer import _grade_answer, GradingOutcome
+from nodes.grade_documents import _grade_documents, _agrade_documents
+from nodes.generate import _generate, _agenerate
+from nodes.rephrase_query import _rephrase_query, _arephrase_query
+from nodes.fan_out_queries import _fan_out_queries, _afan_out_queries, REPHRASE_MODE
+from nodes.grade_answer import _grade_answer, _agrade_answer, GradingOutcome
 from nodes.express_uncertainty import _express_uncertainty
-from nodes.wrap_up import _wrap_up
+from nodes.wrap_up import _wrap_up, _wrap_up_unverified
+from utils.metrics import instrument_node
+
+# Rephrase rounds of a request after which the answer is generated from whatever was
+# found. A fan-out round searches several variants but counts once
+MAX_REPHRASE_ROUNDS = 3
 
 
 def decide_to_generate(state: AgentState) -> bool:
-    if (state.documents and len(state.documents) > 0) or len(
-        state.rephrased_queries
-    ) >= 3:
+    if state.documents or state.loop_count >= MAX_REPHRASE_ROUNDS:
         return "generate"
     return "rephrase_query"
 
 
+def decide_answer_cache_hit(state: AgentState) -> str:
+    if state.answer_cache_hit:
+        return "hit"
+    return "miss"
+
+
+def _timed(name: str, func, afunc=None) -> RunnableLambda:
+    """
+    Wrap a node, or the answer grading edge, so its latency is recorded under `name`.
+    """
+    if afunc is None:
+        return RunnableLambda(instrument_node(name, func))
+    return RunnableLambda(
+        instrument_node(name, func), afunc=instrument_node(name, afunc)
+    )
+
+
 def get_graph() -> StateGraph:
     workflow = StateGraph(
         AgentState, input_schema=InputAgentState, output_schema=OutputAgentState
     )
 
-    workflow.add_node("supervise", _supervise)
+    workflow.add_node(
+        "check_answer_cache", _timed("check_answer_cache", _check_answer_cache)
+    )
+    # Nodes calling Bedrock get an async variant, used when the graph runs with ainvoke/astream
+    workflow.add_node(
+        "compact_history",
+        _timed("compact_history", _compact_history, _acompact_history),
+    )
+    workflow.add_node("supervise", _timed("supervise", _supervise, _asupervise))
     workflow.add_node("retrieve_documents", _retrieve_documents)
-    workflow.add_node("grade_documents", _grade_documents)
-    workflow.add_node("generate", _generate)
-    workflow.add_node("rephrase_query", _rephrase_query)
-    workflow.add_node("express_uncertainty", _express_uncertainty)
-    workflow.add_node("wrap_up", _wrap_up)
+    workflow.add_node(
+        "grade_documents",
+        _timed("grade_documents", _grade_documents, _agrade_documents),
+    )
+    workflow.add_node("generate", _timed("generate", _generate, _agenerate))
+    if REPHRASE_MODE == "fanout":
+        workflow.add_node(
+            "fan_out_queries",
+            _timed("fan_out_queries", _fan_out_queries, _afan_out_queries),
+        )
+    else:
+        workflow.add_node(
+            "rephrase_query",
+            _timed("rephrase_query", _rephrase_query, _arephrase_query),
+        )
+    workflow.add_node(
+        "express_uncertainty", _timed("express_uncertainty", _express_uncertainty)
+    )
+    workflow.add_node("wrap_up", _timed("wrap_up", _wrap_up))
+    workflow.add_node(
+        "wrap_up_unverified", _timed("wrap_up_unverified", _wrap_up_unverified)
+    )
 
-    workflow.add_edge(START, "supervise")
+    workflow.add_edge(START, "check_answer_cache")
+
+    workflow.add_conditional_edges(
+        "check_answer_cache",
+        decide_answer_cache_hit,
+        {
+            "hit": END,
+            "miss": "compact_history",
+        },
+    )
+
+    workflow.add_edge("compact_history", "supervise")
 
     workflow.add_conditional_edges(
         "supervise",
@@ -49,37 +111,69 @@ def get_graph() -> StateGraph:
 
     workflow.add_edge("retrieve_documents", "grade_documents")
 
+    # Rephrased queries are searched directly, without going back through supervise
+    rephrase_node = "fan_out_queries" if REPHRASE_MODE == "fanout" else "rephrase_query"
+
     workflow.add_conditional_edges(
         "grade_documents",
         decide_to_generate,
-        ["generate", "rephrase_query"],
+        {
+            "generate": "generate",
+            "rephrase_query": rephrase_node,
+        },
     )
 
-    workflow.add_edge("rephrase_query", "supervise")
+    if REPHRASE_MODE == "fanout":
+        workflow.add_edge("fan_out_queries", "grade_documents")
+    else:
+        workflow.add_edge("rephrase_query", "retrieve_documents")
 
     workflow.add_conditional_edges(
         "generate",
-        _grade_answer,
+        _timed("grade_answer", _grade_answer, _agrade_answer),
         {
             GradingOutcome.NOT_SUPPORTED.value: "express_uncertainty",
-            GradingOutcome.NOT_USEFUL.value: "rephrase_query",
+            GradingOutcome.NOT_USEFUL.value: rephrase_node,
             GradingOutcome.USEFUL.value: "wrap_up",
+            GradingOutcome.USEFUL_UNVERIFIED.value: "wrap_up_unverified",
         },
     )
 
     workflow.add_edge("express_uncertainty", END)
     workflow.add_edge("wrap_up", END)
+    workflow.add_edge("wrap_up_unverified", END)
 
     return workflow.compile()
 
 
-_graph = get_graph()
+@lru_cache
+def _get_compiled_graph():
+    return get_graph()
+
+
+def __getattr__(name: str):
+    # `_graph` is compiled on first access rather than at import time
+    if name == "_graph":
+        return _get_compiled_graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def warmup():
+    """
+    Build the graph, the Bedrock clients and the retriever ahead of the first request.
+    """
+    from nodes.retrieve_documents import get_retriever
+    from utils.aws_bedrock import get_chat_model
+
+    _get_compiled_graph()
+    get_chat_model()
+    get_retriever()
 
 
 def main():
 
     # Draw the workflow diagram
-    _graph.get_graph().draw_mermaid_png(
+    _get_compiled_graph().get_graph().draw_mermaid_png(
         output_file_path="resources/workflow_diagram.png",
         draw_method=MermaidDrawMethod.PYPPETEER,
         curve_style=CurveStyle.BASIS,
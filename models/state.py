@@ -1,7 +1,25 @@
-from pydantic import BaseModel
+import hashlib
+from pydantic import BaseModel, model_validator
 from langchain_core.messages import BaseMessage
 from langgraph.graph.message import add_messages
-from typing import List, Optional, Annotated, Sequence
+from typing import Any, List, Optional, Annotated, Sequence
+
+
+class DocumentRef(BaseModel):
+    """
+    Reference to a retrieved chunk by its vector store id, with its rerank score.
+    The text is looked up when a prompt is rendered, and only stored inline for
+    chunks that cannot be looked up, such as the ones of older threads.
+    """
+
+    id: str
+    score: Optional[float] = None
+    text: Optional[str] = None
+
+
+def inline_document_ref(text: str, score: Optional[float] = None) -> DocumentRef:
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return DocumentRef(id=f"inline-{digest}", score=score, text=text)
 
 
 class InputAgentState(BaseModel):
@@ -26,6 +44,23 @@ class AgentState(InputAgentState):
     """
 
     original_user_query: Optional[str] = None
-    documents: Optional[str] = None
+    documents: List[DocumentRef] = []
     generated_answer: Optional[str] = None
+    # Answer generated while grading the documents, used if grading keeps all of them
+    speculative_answer: Optional[str] = None
     rephrased_queries: List[str] = []
+    answer_cache_hit: bool = False
+    history_summary: Optional[str] = None
+    summarized_message_count: int = 0
+    loop_count: int = 0
+
+    @model_validator(mode="before")
+    @classmethod
+    def _migrate_documents(cls, data: Any) -> Any:
+        # Threads checkpointed before the state held references store the joined text
+        # of the last turn's chunks. Every turn retrieves its own, so it is dropped
+        if isinstance(data, dict) and "documents" in data:
+            documents = data["documents"]
+            if documents is None or isinstance(documents, str):
+                data = {**data, "documents": []}
+        return data
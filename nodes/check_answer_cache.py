@@ -0,0 +1,44 @@
+from typing import Optional, Sequence
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from models.state import AgentState
+from utils.chunk_store import compact_tool_messages
+
+
+def standalone_question(messages: Sequence[BaseMessage]) -> Optional[str]:
+    """
+    Return the question if the conversation consists of a single text question.
+    Follow-up questions depend on the chat history and are never served from the cache.
+    """
+    human_messages = [m for m in messages if isinstance(m, HumanMessage)]
+    if len(human_messages) != 1 or not isinstance(human_messages[0].content, str):
+        return None
+    return human_messages[0].content
+
+
+def _check_answer_cache(state: AgentState) -> AgentState:
+    """
+    Answer from the semantic answer cache when a similar question was answered before.
+    """
+    from utils.answer_cache import ANSWER_CACHE_ENABLED, get_answer_cache
+
+    # Threads from before the state held chunk references are compacted on their next
+    # turn; the replacements keep the ids of the messages they replace
+    migrated = compact_tool_messages(state.messages)
+
+    # Every turn starts a new request, with its own rephrase loop count and chunks
+    update = {"loop_count": 0, "documents": [], "messages": migrated}
+    question = standalone_question(state.messages)
+    if not ANSWER_CACHE_ENABLED or question is None:
+        return {**update, "answer_cache_hit": False}
+
+    answer = get_answer_cache().lookup(question)
+    if answer is None:
+        return {**update, "answer_cache_hit": False}
+
+    return {
+        **update,
+        "answer_cache_hit": True,
+        "messages": [*migrated, AIMessage(content=answer)],
+    }
@@ -0,0 +1,121 @@
+from typing import List, Sequence, Tuple
+
+from pydantic import BaseModel, Field
+from langchain_core.messages import BaseMessage
+from langchain_core.prompts import ChatPromptTemplate
+
+from models.state import AgentState
+from utils.aws_bedrock import get_chat_model
+from utils.context import HISTORY_TOKEN_BUDGET, render_transcript
+from utils.tokens import estimate_tokens
+
+
+class SummaryResponse(BaseModel):
+    summary: str = Field(
+        None, description="The updated summary of the conversation so far."
+    )
+
+
+prompt_template = ChatPromptTemplate(
+    [
+        (
+            "system",
+            """
+You maintain a running summary of a conversation between a music producer and a music production assistant.
+
+Guidelines for the summary:
+- Fold the new conversation turns into the existing summary
+- Keep the questions the user asked, the key facts and advice given, and any preferences or context the user shared (genre, DAW, gear)
+- Drop greetings, repetition and details that later turns made irrelevant
+- Write in the third person and keep the summary under 150 words
+""",
+        ),
+        (
+            "human",
+            """
+EXISTING SUMMARY: {summary}
+
+NEW CONVERSATION TURNS:
+{transcript}
+
+Write the updated summary.
+""",
+        ),
+    ]
+)
+
+
+def _messages_to_fold(state: AgentState) -> Tuple[List[BaseMessage], int]:
+    """
+    Return the oldest unsummarized messages that have to be folded into the summary so
+    that the rest of the history fits in half of the token budget, and the new count
+    of summarized messages. Nothing is folded while the history fits in the budget.
+    """
+    # The last message is the current question, which is never summarized
+    unsummarized: Sequence[BaseMessage] = state.messages[
+        state.summarized_message_count : -1
+    ]
+    tokens = [
+        sum(estimate_tokens(line) for line in render_transcript([message]))
+        for message in unsummarized
+    ]
+    if sum(tokens) <= HISTORY_TOKEN_BUDGET:
+        return [], state.summarized_message_count
+
+    split = len(unsummarized)
+    kept_tokens = 0
+    while split > 0 and kept_tokens + tokens[split - 1] <= HISTORY_TOKEN_BUDGET // 2:
+        split -= 1
+        kept_tokens += tokens[split]
+
+    return list(unsummarized[:split]), state.summarized_message_count + split
+
+
+def _compact_history_chain():
+    model_with_structured_output = get_chat_model(
+        cached=True, priority="low"
+    ).with_structured_output(SummaryResponse)
+    return prompt_template | model_with_structured_output
+
+
+def _compact_history_inputs(state: AgentState, messages: List[BaseMessage]):
+    return {
+        "summary": state.history_summary or "(none)",
+        "transcript": "\n\n".join(render_transcript(messages)),
+    }
+
+
+def _compact_history(state: AgentState) -> AgentState:
+    """
+    Incrementally summarize the oldest turns once the chat history outgrows its budget.
+    """
+    messages, summarized_message_count = _messages_to_fold(state)
+    if not messages:
+        return {}
+
+    response: SummaryResponse = _compact_history_chain().invoke(
+        _compact_history_inputs(state, messages)
+    )
+
+    return {
+        "history_summary": response.summary,
+        "summarized_message_count": summarized_message_count,
+    }
+
+
+async def _acompact_history(state: AgentState) -> AgentState:
+    """
+    Async variant of `_compact_history`.
+    """
+    messages, summarized_message_count = _messages_to_fold(state)
+    if not messages:
+        return {}
+
+    response: SummaryResponse = await _compact_history_chain().ainvoke(
+        _compact_history_inputs(state, messages)
+    )
+
+    return {
+        "history_summary": response.summary,
+        "summarized_message_count": summarized_message_count,
+    }
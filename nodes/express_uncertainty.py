@@ -1,19 +1,29 @@
 from models.state import AgentState
 from langchain_core.messages import AIMessage
 
+from nodes.generate import STREAM_ANSWER
+from utils.metrics import COUNT_BUCKETS, REQUEST_LOOPS, get_metrics
+
+UNCERTAINTY_NOTICE = """
+I'm not entirely sure about the accuracy of the information provided.
+The sources do not provide enough context to ensure complete accuracy.
+"""
+
 
 def _express_uncertainty(state: AgentState) -> AgentState:
     """
     Express uncertainty in the generated answer.
     This node is used to indicate that the generated answer may not be fully accurate or complete.
     """
-    uncertainty_message = """
-I'm not entirely sure about the accuracy of the information provided.
-The sources do not provide enough context to ensure complete accuracy.
-"""
     generated_message = state.generated_answer
 
-    result = uncertainty_message + "\n\n" + generated_message
+    get_metrics().observe(REQUEST_LOOPS, state.loop_count, buckets=COUNT_BUCKETS)
+
+    if STREAM_ANSWER:
+        # The answer was already streamed to the user, so the notice can only follow it
+        result = generated_message + "\n\n" + UNCERTAINTY_NOTICE.strip()
+    else:
+        result = UNCERTAINTY_NOTICE + "\n\n" + generated_message
 
     return {
         "messages": [AIMessage(content=result)],
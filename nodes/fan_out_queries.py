@@ -0,0 +1,169 @@
+import os
+from typing import List, Sequence
+
+from pydantic import BaseModel, Field
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage, ToolMessage
+from langchain_core.prompts import ChatPromptTemplate
+
+from models.state import AgentState
+from nodes.retrieve_documents import (
+    afan_out_search,
+    fan_out_search,
+    retriever_tool,
+    retriever_tool_call,
+)
+from utils.aws_bedrock import get_chat_model
+from utils.context import REPHRASE_DOCUMENTS_TOKEN_BUDGET, pack_documents
+from utils.chunk_store import render_documents, search_result
+
+# How the query is reworded when retrieval or the answer falls short: serial (one
+# rephrasing searched per round) or fanout (several variants searched concurrently
+# per round, with one rerank)
+REPHRASE_MODE = os.getenv("REPHRASE_MODE", "serial").lower()
+
+# Query variants generated and searched concurrently per fan-out round
+FANOUT_QUERY_COUNT = int(os.getenv("FANOUT_QUERY_COUNT", "3"))
+
+
+class QueryVariants(BaseModel):
+    queries: List[str] = Field(
+        default=[],
+        description="Distinct rephrasings of the user query for better search results.",
+    )
+
+
+prompt_template = ChatPromptTemplate(
+    [
+        (
+            "system",
+            """
+You are a question re-writer that converts an input question into several alternative versions optimized for vectorstore retrieval in the music production domain.
+
+Your expertise includes:
+- Music theory, sound design, and audio engineering concepts
+- Understanding semantic intent and underlying meaning of queries
+- Optimizing queries for better document matching and retrieval
+
+Guidelines for rephrasing:
+- Analyze the underlying semantic intent and meaning of the original question
+- Every version must approach the question from a different angle: different terminology, a narrower or broader scope, or a related concept
+- Use specific music production terminology when appropriate
+- Include relevant synonyms and related concepts that might appear in documents
+- Preserve the original intent and avoid overly broad or vague reformulations
+- Every result must be formulated as a clear question.
+""",
+        ),
+        (
+            "human",
+            """
+Analyze the semantic intent of this music production question and write {count} different rephrased versions for optimal vectorstore retrieval.
+
+ORIGINAL QUESTION: {user_query}
+
+PREVIOUS REPHRASE ATTEMPTS: {rephrased_queries}
+
+CURRENT RETRIEVED DOCUMENTS: {documents}
+
+PREVIOUS RESPONSE GENERATED: {generated_answer}
+
+Create {count} new rephrased versions, each different from the original question and from the previous attempts.
+""",
+        ),
+    ]
+)
+
+
+def _fan_out_queries_inputs(state: AgentState):
+    return {
+        "count": FANOUT_QUERY_COUNT,
+        "user_query": state.original_user_query,
+        "rephrased_queries": state.rephrased_queries,
+        "documents": pack_documents(
+            render_documents(state.documents), REPHRASE_DOCUMENTS_TOKEN_BUDGET
+        ),
+        "generated_answer": state.generated_answer,
+    }
+
+
+def _fan_out_queries_chain():
+    model_with_structured_output = get_chat_model(
+        cached=True, priority="low"
+    ).with_structured_output(QueryVariants)
+    return prompt_template | model_with_structured_output
+
+
+def _query_variants(response: QueryVariants, state: AgentState) -> List[str]:
+    tried = {
+        query.strip().lower()
+        for query in [state.original_user_query, *state.rephrased_queries]
+        if query
+    }
+    variants: List[str] = []
+    for query in response.queries:
+        query = query.strip()
+        if query and query.lower() not in tried:
+            tried.add(query.lower())
+            variants.append(query)
+
+    # Search the original question again rather than nothing at all
+    return variants[:FANOUT_QUERY_COUNT] or [state.original_user_query]
+
+
+def _search_messages(
+    queries: Sequence[str], results: Sequence[List[Document]]
+) -> List[BaseMessage]:
+    """
+    Record the fan-out as one retriever tool call per query variant, the way the
+    `retrieve_documents` node would, so `_grade_documents` reads the results as usual.
+    """
+    search = retriever_tool_call(queries, "fanout")
+    messages: List[BaseMessage] = [search]
+    for tool_call, documents in zip(search.tool_calls, results):
+        content, refs = search_result(documents)
+        messages.append(
+            ToolMessage(
+                content=content,
+                artifact=refs,
+                name=retriever_tool.name,
+                tool_call_id=tool_call["id"],
+            )
+        )
+    return messages
+
+
+def _fan_out_queries(state: AgentState):
+    """
+    Generate several query variants in one call and search them concurrently, with
+    a single rerank of the merged results against the original question.
+    """
+    response: QueryVariants = _fan_out_queries_chain().invoke(
+        _fan_out_queries_inputs(state)
+    )
+    queries = _query_variants(response, state)
+
+    results = fan_out_search(queries, state.original_user_query)
+
+    return {
+        "messages": _search_messages(queries, results),
+        "rephrased_queries": state.rephrased_queries + queries,
+        "loop_count": state.loop_count + 1,
+    }
+
+
+async def _afan_out_queries(state: AgentState):
+    """
+    Async variant of `_fan_out_queries`.
+    """
+    response: QueryVariants = await _fan_out_queries_chain().ainvoke(
+        _fan_out_queries_inputs(state)
+    )
+    queries = _query_variants(response, state)
+
+    results = await afan_out_search(queries, state.original_user_query)
+
+    return {
+        "messages": _search_messages(queries, results),
+        "rephrased_queries": state.rephrased_queries + queries,
+        "loop_count": state.loop_count + 1,
+    }
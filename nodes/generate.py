@@ -1,9 +1,33 @@
+import os
+from typing import List, Optional
+
 from models.state import AgentState
 from pydantic import BaseModel, Field
 
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 
-from utils.aws_bedrock import chat_claude_4_sonnet
+from utils.aws_bedrock import get_chat_model
+from utils.context import pack_documents, pack_history
+from utils.chunk_store import render_documents
+
+# Generate the answer as plain text streamed token by token, instead of one structured
+# response, so clients can show it while it is being written
+STREAM_ANSWER = os.getenv("STREAM_ANSWER", "false").lower() == "true"
+
+# Tag of the answer generation call, used to pick its tokens out of the graph stream
+ANSWER_TAG = "answer"
+
+# Generate the answer while the documents are graded, and keep it when grading keeps
+# every document. Streamed answers are never generated speculatively, since their
+# tokens would reach the client before grading decided to keep them
+SPECULATIVE_GENERATION = (
+    os.getenv("SPECULATIVE_GENERATION", "false").lower() == "true" and not STREAM_ANSWER
+)
+
+# Call site of the speculative generation calls in the LLM metrics
+SPECULATIVE_CALL_SITE = "speculative_generate"
 
 
 class GenerateResponse(BaseModel):
@@ -46,27 +70,100 @@ Provide a complete, helpful answer based on the available information.
 )
 
 
-def _generate(state: AgentState):
+def _generate_inputs(state: AgentState):
+    return {
+        "user_query": state.original_user_query,
+        "documents": pack_documents(render_documents(state.documents)),
+        "chat_history": pack_history(
+            state.messages[state.summarized_message_count :], state.history_summary
+        ),
+    }
+
+
+def _generate_chain():
+    if STREAM_ANSWER:
+        model = get_chat_model(priority="high").with_config(tags=[ANSWER_TAG])
+        return prompt_template | model | StrOutputParser()
+
+    model_with_structured_output = get_chat_model(
+        priority="high"
+    ).with_structured_output(GenerateResponse)
+    return prompt_template | model_with_structured_output
+
+
+def _speculative_chain(callbacks: Optional[List[BaseCallbackHandler]]):
+    return _generate_chain().with_config(
+        metadata={"call_site": SPECULATIVE_CALL_SITE}, callbacks=callbacks
+    )
+
+
+def speculative_generate(
+    state: AgentState, callbacks: Optional[List[BaseCallbackHandler]] = None
+) -> str:
     """
-    Generate an answer based on the search results.
+    Generate the answer from the documents of `state` ahead of the generate node,
+    which uses it as long as grading keeps those documents.
     """
-    user_query = state.original_user_query
-    documents = state.documents
-
-    model_with_structured_output = chat_claude_4_sonnet.with_structured_output(
-        GenerateResponse
+    response: GenerateResponse = _speculative_chain(callbacks).invoke(
+        _generate_inputs(state)
     )
-    response: GenerateResponse = (
-        prompt_template | model_with_structured_output
-    ).invoke(
-        {
-            "user_query": user_query,
-            "documents": documents,
-            "chat_history": state.messages,
-        }
+    return response.generated_answer
+
+
+async def aspeculative_generate(
+    state: AgentState, callbacks: Optional[List[BaseCallbackHandler]] = None
+) -> str:
+    """
+    Async variant of `speculative_generate`.
+    """
+    response: GenerateResponse = await _speculative_chain(callbacks).ainvoke(
+        _generate_inputs(state)
     )
+    return response.generated_answer
+
 
+def _generated(generated_answer: str):
     return {
-        "generated_answer": response.generated_answer,
+        "generated_answer": generated_answer,
+        "speculative_answer": None,
         "rephrased_queries": [],
     }
+
+
+def _generate(state: AgentState):
+    """
+    Generate an answer based on the search results.
+    """
+    if state.speculative_answer is not None:
+        # Generated while grading the documents, which kept all of them
+        return _generated(state.speculative_answer)
+
+    if STREAM_ANSWER:
+        # Grading waits for the completed text, the tokens reach the client meanwhile
+        generated_answer = "".join(_generate_chain().stream(_generate_inputs(state)))
+    else:
+        response: GenerateResponse = _generate_chain().invoke(_generate_inputs(state))
+        generated_answer = response.generated_answer
+
+    return _generated(generated_answer)
+
+
+async def _agenerate(state: AgentState):
+    """
+    Async variant of `_generate`.
+    """
+    if state.speculative_answer is not None:
+        return _generated(state.speculative_answer)
+
+    if STREAM_ANSWER:
+        tokens = [
+            token async for token in _generate_chain().astream(_generate_inputs(state))
+        ]
+        generated_answer = "".join(tokens)
+    else:
+        response: GenerateResponse = await _generate_chain().ainvoke(
+            _generate_inputs(state)
+        )
+        generated_answer = response.generated_answer
+
+    return _generated(generated_answer)
@@ -1,14 +1,27 @@
+import asyncio
+import os
 from enum import Enum
+from typing import Optional, Tuple
 from models.state import AgentState
 from pydantic import BaseModel, Field
 
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableParallel
+from langchain_core.runnables.config import run_in_executor
 
-from utils.aws_bedrock import chat_claude_4_sonnet
+from utils.aws_bedrock import get_chat_model, get_embeddings
+from utils.context import pack_documents
+from utils.chunk_store import render_documents
+from utils.metrics import GRADING_DECISIONS, get_metrics
+
+# How the two answer graders run: "sequential", "concurrent" or "combined" (single call)
+GRADE_ANSWER_MODE = os.getenv("GRADE_ANSWER_MODE", "sequential").lower()
 
 
 class GradingOutcome(str, Enum):
     USEFUL = "useful"
+    # Useful, but with a verdict settled by the local signals rather than an LLM grader
+    USEFUL_UNVERIFIED = "useful unverified"
     NOT_USEFUL = "not useful"
     NOT_SUPPORTED = "not supported"
 
@@ -20,6 +33,17 @@ class GradingResult(BaseModel):
     )
 
 
+class CombinedGradingResult(BaseModel):
+    grounded: bool = Field(
+        default=False,
+        description="Indicates whether the answer is grounded in the retrieved facts.",
+    )
+    resolves_question: bool = Field(
+        default=False,
+        description="Indicates whether the answer addresses and resolves the question.",
+    )
+
+
 hallucination_grading_prompt_template = ChatPromptTemplate(
     [
         (
@@ -98,37 +122,250 @@ Determine if the answer addresses and resolves the question, and provide reasoni
 )
 
 
+combined_grading_prompt_template = ChatPromptTemplate(
+    [
+        (
+            "system",
+            """
+You are a grader assessing an LLM generated answer in the music production domain. You give two independent verdicts.
+
+1. GROUNDED: Is the answer grounded in and supported by the retrieved facts?
+- GROUNDED: The answer is directly supported by the provided facts/documents
+- GROUNDED: The answer appropriately states "I don't know" when information is insufficient
+- GROUNDED: The answer combines retrieved facts with well-established music production knowledge
+- NOT GROUNDED: The answer contains claims not supported by, or contradicting, the retrieved facts
+- NOT GROUNDED: The answer provides specific details not present in the documents
+
+2. RESOLVES QUESTION: Does the answer address and resolve the question?
+- RESOLVES: The answer directly responds to the question and provides actionable information
+- RESOLVES: The answer appropriately states "I don't know" when the question cannot be answered
+- RESOLVES: The answer provides sufficient detail and stays focused on the specific question asked
+- DOES NOT RESOLVE: The answer is off-topic, too vague or generic, or avoids the question
+- DOES NOT RESOLVE: The answer partially addresses the question but leaves key aspects unanswered
+
+Assessment guidelines:
+- Check if all factual claims in the answer can be traced back to the retrieved documents
+- Consider whether a music producer would find this answer helpful for their specific question
+- Judge both verdicts independently of each other
+""",
+        ),
+        (
+            "human",
+            """
+Assess whether this generated answer is grounded in the retrieved facts, and whether it adequately addresses and resolves the user's question.
+
+USER QUESTION: {user_query}
+
+RETRIEVED FACTS/DOCUMENTS: {documents}
+
+GENERATED ANSWER: {generated_answer}
+
+Determine both verdicts.
+""",
+        ),
+    ]
+)
+
+
+def _resolve_outcome(grounded: bool, resolves_question: bool) -> GradingOutcome:
+    if not grounded:
+        return GradingOutcome.NOT_SUPPORTED
+    if resolves_question:
+        return GradingOutcome.USEFUL
+    return GradingOutcome.NOT_USEFUL
+
+
+def _grade_answer_inputs(state: AgentState):
+    return {
+        "generated_answer": state.generated_answer,
+        "documents": pack_documents(render_documents(state.documents)),
+        "user_query": state.original_user_query,
+    }
+
+
+# Grading runs on the edge leaving `generate`, so its calls are labelled explicitly
+_GRADING_CONFIG = {"metadata": {"call_site": "grade_answer"}}
+
+
+def _combined_grading_chain():
+    model_with_structured_output = get_chat_model(
+        cached=True, priority="low"
+    ).with_structured_output(CombinedGradingResult)
+    return (
+        combined_grading_prompt_template | model_with_structured_output
+    ).with_config(_GRADING_CONFIG)
+
+
+def _grading_chains():
+    model_with_structured_output = get_chat_model(
+        cached=True, priority="low"
+    ).with_structured_output(GradingResult)
+    return (
+        (
+            hallucination_grading_prompt_template | model_with_structured_output
+        ).with_config(_GRADING_CONFIG),
+        (answer_grading_prompt_template | model_with_structured_output).with_config(
+            _GRADING_CONFIG
+        ),
+    )
+
+
+def _local_verdicts(state: AgentState) -> Tuple[Optional[bool], Optional[bool]]:
+    """
+    Settle what the local signals can of the (grounded, resolves_question) verdicts.
+    """
+    from utils.grading_cascade import (
+        GRADE_ANSWER_CASCADE,
+        compute_signals,
+        load_thresholds,
+        local_verdicts,
+    )
+
+    if not GRADE_ANSWER_CASCADE or not state.generated_answer:
+        return None, None
+
+    signals = compute_signals(
+        state.original_user_query,
+        state.generated_answer,
+        render_documents(state.documents),
+        get_embeddings(),
+    )
+    verdicts = local_verdicts(signals, load_thresholds())
+
+    metrics = get_metrics()
+    for grader, verdict in zip(("grounded", "resolves_question"), verdicts):
+        decided_by = "llm" if verdict is None else "local"
+        metrics.inc(GRADING_DECISIONS, grader=grader, decided_by=decided_by)
+    return verdicts
+
+
+def _mark_unverified(
+    outcome: GradingOutcome, local: Tuple[Optional[bool], Optional[bool]]
+) -> GradingOutcome:
+    """
+    Tell apart the useful answers the local signals vouched for, which must not be
+    reused from the answer cache as if an LLM grader had accepted them.
+    """
+    if outcome is GradingOutcome.USEFUL and any(v is not None for v in local):
+        return GradingOutcome.USEFUL_UNVERIFIED
+    return outcome
+
+
 def _grade_answer(state: AgentState):
     """
     Check whether the generated answer is grounded in the retrieved documents and addresses the user's query.
     """
-    generation = state.generated_answer
-    documents = state.documents
-    user_query = state.original_user_query
+    local = _local_verdicts(state)
+    return _mark_unverified(_grade_remaining(state, *local), local)
 
-    model_with_structured_output = chat_claude_4_sonnet.with_structured_output(
-        GradingResult
-    )
 
-    chain = hallucination_grading_prompt_template | model_with_structured_output
-    hallucination_grading_response: GradingResult = chain.invoke(
-        {
-            "generated_answer": generation,
-            "documents": documents,
-        }
-    )
+def _grade_remaining(
+    state: AgentState, grounded: Optional[bool], resolves_question: Optional[bool]
+) -> GradingOutcome:
+    if grounded is False:
+        return GradingOutcome.NOT_SUPPORTED
+    if grounded is not None and resolves_question is not None:
+        return _resolve_outcome(grounded, resolves_question)
+
+    # The LLM graders only give the verdicts the local signals left open
+    inputs = _grade_answer_inputs(state)
 
-    if hallucination_grading_response.grading:
-        chain = answer_grading_prompt_template | model_with_structured_output
-        answer_grading_result: GradingResult = chain.invoke(
-            {
-                "generated_answer": generation,
-                "user_query": user_query,
-            }
+    if GRADE_ANSWER_MODE == "combined":
+        combined_grading_result: CombinedGradingResult = (
+            _combined_grading_chain().invoke(inputs)
         )
-        if answer_grading_result.grading:
-            return GradingOutcome.USEFUL
-        else:
-            return GradingOutcome.NOT_USEFUL
-    else:
+        if grounded is None:
+            grounded = combined_grading_result.grounded
+        if resolves_question is None:
+            resolves_question = combined_grading_result.resolves_question
+        return _resolve_outcome(grounded, resolves_question)
+
+    hallucination_chain, answer_chain = _grading_chains()
+
+    if GRADE_ANSWER_MODE == "concurrent":
+        # Run both graders at once; the usefulness verdict is ignored if not grounded
+        chains = {}
+        if grounded is None:
+            chains["hallucination"] = hallucination_chain
+        if resolves_question is None:
+            chains["answer"] = answer_chain
+        results = RunnableParallel(chains).invoke(inputs)
+        if grounded is None:
+            grounded = results["hallucination"].grading
+        if resolves_question is None:
+            resolves_question = results["answer"].grading
+        return _resolve_outcome(grounded, resolves_question)
+
+    if grounded is None:
+        hallucination_grading_response: GradingResult = hallucination_chain.invoke(
+            inputs
+        )
+        if not hallucination_grading_response.grading:
+            return GradingOutcome.NOT_SUPPORTED
+
+    if resolves_question is None:
+        answer_grading_result: GradingResult = answer_chain.invoke(inputs)
+        resolves_question = answer_grading_result.grading
+    return _resolve_outcome(True, resolves_question)
+
+
+async def _skipped():
+    """
+    Stands in for a grader whose verdict is already settled.
+    """
+    return None
+
+
+async def _agrade_answer(state: AgentState):
+    """
+    Async variant of `_grade_answer`.
+    """
+    # The signals need a blocking embedding call
+    local = await run_in_executor(None, _local_verdicts, state)
+    return _mark_unverified(await _agrade_remaining(state, *local), local)
+
+
+async def _agrade_remaining(
+    state: AgentState, grounded: Optional[bool], resolves_question: Optional[bool]
+) -> GradingOutcome:
+    if grounded is False:
         return GradingOutcome.NOT_SUPPORTED
+    if grounded is not None and resolves_question is not None:
+        return _resolve_outcome(grounded, resolves_question)
+
+    inputs = _grade_answer_inputs(state)
+
+    if GRADE_ANSWER_MODE == "combined":
+        combined_grading_result: CombinedGradingResult = (
+            await _combined_grading_chain().ainvoke(inputs)
+        )
+        if grounded is None:
+            grounded = combined_grading_result.grounded
+        if resolves_question is None:
+            resolves_question = combined_grading_result.resolves_question
+        return _resolve_outcome(grounded, resolves_question)
+
+    hallucination_chain, answer_chain = _grading_chains()
+
+    if GRADE_ANSWER_MODE == "concurrent":
+        hallucination_grading_response, answer_grading_result = await asyncio.gather(
+            hallucination_chain.ainvoke(inputs) if grounded is None else _skipped(),
+            answer_chain.ainvoke(inputs) if resolves_question is None else _skipped(),
+        )
+        if grounded is None:
+            grounded = hallucination_grading_response.grading
+        if resolves_question is None:
+            resolves_question = answer_grading_result.grading
+        return _resolve_outcome(grounded, resolves_question)
+
+    if grounded is None:
+        hallucination_grading_response: GradingResult = (
+            await hallucination_chain.ainvoke(inputs)
+        )
+        if not hallucination_grading_response.grading:
+            return GradingOutcome.NOT_SUPPORTED
+
+    if resolves_question is None:
+        answer_grading_result: GradingResult = await answer_chain.ainvoke(inputs)
+        resolves_question = answer_grading_result.grading
+    return _resolve_outcome(True, resolves_question)
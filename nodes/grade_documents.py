@@ -1,15 +1,42 @@
-from typing import List
+import asyncio
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Union
 from pydantic import BaseModel, Field
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+from langchain_core.messages import ToolMessage
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables.config import ContextThreadPoolExecutor
 
-from models.state import AgentState
-from utils.aws_bedrock import chat_claude_4_sonnet
+from models.state import AgentState, DocumentRef, inline_document_ref
+from nodes.generate import (
+    SPECULATIVE_GENERATION,
+    aspeculative_generate,
+    speculative_generate,
+)
+from utils.aws_bedrock import get_chat_model
+from utils.chunk_store import as_document_refs, resolve_chunks
+from utils.metrics import (
+    SPECULATIVE_GENERATIONS,
+    SPECULATIVE_WASTED_TOKENS,
+    get_metrics,
+)
 
 
-class GradingResult(BaseModel):
-    documents_relevant: bool = Field(
+class ChunkGrade(BaseModel):
+    chunk_index: int = Field(
+        description="The index of the document chunk, as shown between square brackets.",
+    )
+    relevant: bool = Field(
         default=False,
-        description="Indicates whether the retrieved documents are relevant to the user's query.",
+        description="Indicates whether the document chunk is relevant to the user's query.",
+    )
+
+
+class GradingResult(BaseModel):
+    chunk_grades: List[ChunkGrade] = Field(
+        default=[],
+        description="The relevance grade of every document chunk.",
     )
 
 
@@ -20,7 +47,7 @@ prompt_template = ChatPromptTemplate(
             """
 You are an expert document relevance assessor for a RAG (Retrieval-Augmented Generation) system.
 
-Your task is to determine if a retrieved document contains information that could help answer the user's question.
+Your task is to determine, for each retrieved document chunk, if it contains information that could help answer the user's question.
 
 Grading criteria:
 - Grade as RELEVANT if the document contains:
@@ -40,37 +67,246 @@ Be lenient in your assessment - it's better to include potentially useful docume
         (
             "human",
             """
-Assess the relevance of this document to the user's question:
+Assess the relevance of each document chunk to the user's question:
 
 USER QUESTION: {user_query}
 
-DOCUMENTS:
+DOCUMENT CHUNKS:
 {documents}
 
-Determine if these documents are relevant.
+Grade every chunk individually, referring to it by its index.
 """,
         ),
     ]
 )
 
 
+def _last_tool_messages(state: AgentState) -> List[ToolMessage]:
+    # A search with several tool calls answers with one ToolMessage per call
+    messages = []
+    for message in reversed(state.messages):
+        if not isinstance(message, ToolMessage):
+            break
+        messages.append(message)
+    messages.reverse()
+    return messages
+
+
+def _retrieved_chunks(state: AgentState) -> List[Tuple[DocumentRef, str]]:
+    """
+    Return the chunks of the last retrieval. Low-scoring chunks were already cut by
+    the adaptive reranking.
+    """
+    tool_messages = _last_tool_messages(state)
+    if not tool_messages:
+        message = state.messages[-1]
+        return (
+            [(inline_document_ref(message.content), message.content)]
+            if message.content
+            else []
+        )
+
+    refs: List[DocumentRef] = []
+    for message in tool_messages:
+        if not message.content:
+            continue
+        if not message.artifact:
+            # Tool output without an artifact cannot be split, so grade it as one chunk
+            refs.append(inline_document_ref(message.content))
+            continue
+        refs.extend(as_document_refs(message.artifact))
+
+    if len(tool_messages) > 1:
+        # Results of several searches are graded best first
+        refs.sort(key=lambda ref: ref.score or 0.0, reverse=True)
+    return resolve_chunks(refs)
+
+
+def _format_chunks(chunks: List[Tuple[DocumentRef, str]]) -> str:
+    return "\n\n".join(f"[{index}]\n{text}" for index, (_, text) in enumerate(chunks))
+
+
+def _relevant_documents(
+    chunks: List[Tuple[DocumentRef, str]], response: GradingResult
+) -> List[DocumentRef]:
+    # Chunks the grader did not mention are kept, in line with the lenient criteria
+    irrelevant = {
+        grade.chunk_index for grade in response.chunk_grades if not grade.relevant
+    }
+    # The same chunk can be found by several searches
+    relevant: Dict[str, DocumentRef] = {}
+    for index, (ref, _) in enumerate(chunks):
+        if index not in irrelevant:
+            relevant.setdefault(ref.id, ref)
+    return list(relevant.values())
+
+
+def _grade_documents_chain():
+    model_with_structured_output = get_chat_model(
+        cached=True, priority="low"
+    ).with_structured_output(GradingResult)
+    return prompt_template | model_with_structured_output
+
+
+@lru_cache
+def _speculation_executor() -> ContextThreadPoolExecutor:
+    # Copies the caller's context, so the call is traced under the grading node
+    return ContextThreadPoolExecutor(thread_name_prefix="speculative-generate")
+
+
+def _record_wasted(usage: UsageMetadataCallbackHandler):
+    metrics = get_metrics()
+    for model_usage in usage.usage_metadata.values():
+        for direction in ("input", "output"):
+            metrics.inc(
+                SPECULATIVE_WASTED_TOKENS,
+                model_usage.get(f"{direction}_tokens", 0),
+                direction=direction,
+            )
+
+
+def _discard(
+    speculation: Union[Future, asyncio.Task], usage: UsageMetadataCallbackHandler
+):
+    """
+    Drop a speculative answer grading did not keep the documents of, cancelling it when
+    it is still running. Its tokens are counted as wasted once the call has ended.
+
+    Only the async path can stop a call in flight: a thread pool future can only be
+    cancelled before it starts, so a running sync speculation finishes as "wasted".
+    """
+    if speculation.done():
+        outcome = "discarded"
+    elif speculation.cancel():
+        outcome = "cancelled"
+    else:
+        outcome = "wasted"
+    get_metrics().inc(SPECULATIVE_GENERATIONS, outcome=outcome)
+
+    def finished(speculation: Union[Future, asyncio.Task]):
+        if not speculation.cancelled():
+            # Retrieve the error of a failed call, which nobody awaits any more
+            speculation.exception()
+        _record_wasted(usage)
+
+    speculation.add_done_callback(finished)
+
+
+def _graded_update(
+    chunks: List[Tuple[DocumentRef, str]],
+    response: GradingResult,
+    user_query: str,
+    speculative_answer: Optional[str] = None,
+):
+    return {
+        "documents": _relevant_documents(chunks, response),
+        "original_user_query": user_query,
+        "speculative_answer": speculative_answer,
+    }
+
+
+def _keeps_all(chunks: List[Tuple[DocumentRef, str]], response: GradingResult) -> bool:
+    kept = _relevant_documents(chunks, response)
+    return len(kept) == len({ref.id for ref, _ in chunks})
+
+
 def _grade_documents(state: AgentState):
     """
-    Check the relevance of the documents to the user's query.
+    Grade each retrieved chunk and keep only the ones relevant to the user's query.
+
+    With speculative generation, the answer is generated from all retrieved chunks
+    while they are graded, and handed to the generate node when grading keeps them all.
     """
     user_query = state.original_user_query
-    documents = state.messages[-1].content
+    chunks = _retrieved_chunks(state)
 
     # Early return if no documents to grade
-    if not documents:
-        return {"documents": None, "original_user_query": user_query}
+    if not chunks:
+        return {
+            "documents": [],
+            "original_user_query": user_query,
+            "speculative_answer": None,
+        }
 
-    model_with_structured_output = chat_claude_4_sonnet.with_structured_output(
-        GradingResult
-    )
+    speculation = usage = None
+    if SPECULATIVE_GENERATION:
+        usage = UsageMetadataCallbackHandler()
+        speculative_state = state.model_copy(
+            update={"documents": _relevant_documents(chunks, GradingResult())}
+        )
+        speculation = _speculation_executor().submit(
+            speculative_generate, speculative_state, [usage]
+        )
 
-    response: GradingResult = (prompt_template | model_with_structured_output).invoke(
-        {"user_query": user_query, "documents": documents}
-    )
+    try:
+        response: GradingResult = _grade_documents_chain().invoke(
+            {"user_query": user_query, "documents": _format_chunks(chunks)}
+        )
+    except BaseException:
+        if speculation is not None:
+            _discard(speculation, usage)
+        raise
+
+    if speculation is None:
+        return _graded_update(chunks, response, user_query)
+    if not _keeps_all(chunks, response):
+        _discard(speculation, usage)
+        return _graded_update(chunks, response, user_query)
+
+    try:
+        speculative_answer = speculation.result()
+    except Exception:
+        # The generate node makes the call again
+        get_metrics().inc(SPECULATIVE_GENERATIONS, outcome="failed")
+        return _graded_update(chunks, response, user_query)
+    get_metrics().inc(SPECULATIVE_GENERATIONS, outcome="used")
+    return _graded_update(chunks, response, user_query, speculative_answer)
+
+
+async def _agrade_documents(state: AgentState):
+    """
+    Async variant of `_grade_documents`.
+    """
+    user_query = state.original_user_query
+    chunks = _retrieved_chunks(state)
+
+    # Early return if no documents to grade
+    if not chunks:
+        return {
+            "documents": [],
+            "original_user_query": user_query,
+            "speculative_answer": None,
+        }
+
+    speculation = usage = None
+    if SPECULATIVE_GENERATION:
+        usage = UsageMetadataCallbackHandler()
+        speculative_state = state.model_copy(
+            update={"documents": _relevant_documents(chunks, GradingResult())}
+        )
+        speculation = asyncio.create_task(
+            aspeculative_generate(speculative_state, [usage])
+        )
+
+    try:
+        response: GradingResult = await _grade_documents_chain().ainvoke(
+            {"user_query": user_query, "documents": _format_chunks(chunks)}
+        )
+    except BaseException:
+        if speculation is not None:
+            _discard(speculation, usage)
+        raise
+
+    if speculation is None:
+        return _graded_update(chunks, response, user_query)
+    if not _keeps_all(chunks, response):
+        _discard(speculation, usage)
+        return _graded_update(chunks, response, user_query)
 
-    return {"documents": documents, "original_user_query": user_query}
+    try:
+        speculative_answer = await speculation
+    except Exception:
+        get_metrics().inc(SPECULATIVE_GENERATIONS, outcome="failed")
+        return _graded_update(chunks, response, user_query)
+    get_metrics().inc(SPECULATIVE_GENERATIONS, outcome="used")
+    return _graded_update(chunks, response, user_query, speculative_answer)
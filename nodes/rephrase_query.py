@@ -1,9 +1,12 @@
 from models.state import AgentState
+from nodes.retrieve_documents import retriever_tool_call
 from pydantic import BaseModel, Field
 
 from langchain_core.prompts import ChatPromptTemplate
 
-from utils.aws_bedrock import chat_claude_4_sonnet
+from utils.aws_bedrock import get_chat_model
+from utils.context import REPHRASE_DOCUMENTS_TOKEN_BUDGET, pack_documents
+from utils.chunk_store import render_documents
 
 
 class RephraseResponse(BaseModel):
@@ -54,31 +57,54 @@ Create a new rephrased version that captures the underlying meaning while using
 )
 
 
-def _rephrase_query(state: AgentState):
+def _rephrase_query_inputs(state: AgentState):
+    return {
+        "user_query": state.original_user_query,
+        "rephrased_queries": state.rephrased_queries,
+        "documents": pack_documents(
+            render_documents(state.documents), REPHRASE_DOCUMENTS_TOKEN_BUDGET
+        ),
+        "generated_answer": state.generated_answer,
+    }
+
+
+def _rephrase_query_chain():
+    model_with_structured_output = get_chat_model(
+        cached=True, priority="low"
+    ).with_structured_output(RephraseResponse)
+    return prompt_template | model_with_structured_output
+
+
+def _rephrase_query_update(state: AgentState, response: RephraseResponse):
     """
-    Generate an answer based on the search results.
+    Search the rephrased query directly: the supervisor model would only re-emit the
+    same retriever tool call.
     """
-    user_query = state.original_user_query
-    documents = state.documents
-    rephrased_queries = state.rephrased_queries
-    generated_answer = state.generated_answer
+    query = response.rephrased_user_query or state.original_user_query
+    return {
+        "messages": [retriever_tool_call([query], "rephrase")],
+        "rephrased_queries": state.rephrased_queries + [query],
+        "loop_count": state.loop_count + 1,
+    }
 
-    model_with_structured_output = chat_claude_4_sonnet.with_structured_output(
-        RephraseResponse
-    )
-    response: RephraseResponse = (
-        prompt_template | model_with_structured_output
-    ).invoke(
-        {
-            "user_query": user_query,
-            "rephrased_queries": rephrased_queries,
-            "documents": documents,
-            "generated_answer": generated_answer,
-        }
+
+def _rephrase_query(state: AgentState):
+    """
+    Rephrase the user query for another search.
+    """
+    response: RephraseResponse = _rephrase_query_chain().invoke(
+        _rephrase_query_inputs(state)
     )
 
-    rephrased_queries = state.rephrased_queries + [response.rephrased_user_query]
+    return _rephrase_query_update(state, response)
 
-    return {
-        "rephrased_queries": rephrased_queries,
-    }
+
+async def _arephrase_query(state: AgentState):
+    """
+    Async variant of `_rephrase_query`.
+    """
+    response: RephraseResponse = await _rephrase_query_chain().ainvoke(
+        _rephrase_query_inputs(state)
+    )
+
+    return _rephrase_query_update(state, response)
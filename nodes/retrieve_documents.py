@@ -1,14 +1,201 @@
-from langchain.tools.retriever import create_retriever_tool
+import asyncio
+import threading
+import uuid
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+    Callbacks,
+)
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.tools import Tool
+from langchain_core.tools.retriever import RetrieverInput
 from langgraph.prebuilt import ToolNode
 
-from models.state import AgentState
-from utils.vector_store import load_vector_store
+from models.state import AgentState, DocumentRef
+from utils.chunk_store import RETRIEVER_TOOL_NAME, search_result
+from utils.metrics import RETRIEVAL_SECONDS, get_metrics
+from utils.retrieval import amulti_query_search, multi_query_search
+from utils.retrieval_cache import get_retrieval_cache, normalize_query
+from utils.single_flight import SingleFlight
+
+CORPUS_PATHS = ["resources/MakingMusic_DennisDeSantis.pdf"]
+
+_retriever_lock = threading.Lock()
+
+
+@lru_cache
+def _load_retriever() -> BaseRetriever:
+    from utils.vector_store import load_vector_store
+
+    return load_vector_store(CORPUS_PATHS, sync=False)
+
+
+def get_retriever() -> BaseRetriever:
+    """
+    Open the vector store on first use. Ingestion only happens here when the store is
+    empty; otherwise it is kept up to date with the offline `ingest.py` command.
+    """
+    # Concurrent first searches would each open (or ingest) the vector store
+    with _retriever_lock:
+        return _load_retriever()
+
+
+# Identical searches running at the same time, as in batches of similar questions,
+# share one embedding call, vector search and rerank
+_searches = SingleFlight()
+
+
+class LazyRetriever(BaseRetriever):
+    """
+    Retriever that defers loading the vector store until the first search, and serves
+    repeated searches from the retrieval cache.
+    """
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        cache = get_retrieval_cache()
+        version = cache.version() if cache is not None else None
+        documents = cache.lookup(query, version) if cache is not None else None
+        if documents is not None:
+            return documents
+
+        def search() -> List[Document]:
+            with get_metrics().timer(RETRIEVAL_SECONDS, stage="total"):
+                documents = get_retriever().invoke(
+                    query, config={"callbacks": run_manager.get_child()}
+                )
+            if cache is not None:
+                cache.store(query, documents, version)
+            return documents
+
+        return _searches.do(normalize_query(query), search)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        cache = get_retrieval_cache()
+        version = cache.version() if cache is not None else None
+        documents = cache.lookup(query, version) if cache is not None else None
+        if documents is not None:
+            return documents
+
+        async def search() -> List[Document]:
+            # Loading the vector store blocks, so keep it off the event loop
+            retriever = await asyncio.to_thread(get_retriever)
+            with get_metrics().timer(RETRIEVAL_SECONDS, stage="total"):
+                documents = await retriever.ainvoke(
+                    query, config={"callbacks": run_manager.get_child()}
+                )
+            if cache is not None:
+                cache.store(query, documents, version)
+            return documents
+
+        return await _searches.ado(normalize_query(query), search)
+
+
+_lazy_retriever = LazyRetriever()
+
+
+def _fan_out_keys(queries: Sequence[str], rerank_query: str) -> List[str]:
+    """
+    Retrieval cache keys of the results of each variant of a fan-out search, which
+    depend on all of the variants since they are reranked together.
+    """
+    search = "\x01".join([rerank_query, *queries])
+    return [f"fanout\x00{search}\x00{index}" for index in range(len(queries))]
+
+
+def _cached_fan_out(
+    keys: List[str],
+) -> Tuple[Optional[List[List[Document]]], Optional[str]]:
+    """
+    Return the cached results of a fan-out search, or None, with the corpus version
+    the search is to be stored under.
+    """
+    cache = get_retrieval_cache()
+    if cache is None:
+        return None, None
+    version = cache.version()
+    results = []
+    for key in keys:
+        documents = cache.lookup(key, version)
+        if documents is None:
+            return None, version
+        results.append(documents)
+    return results, version
+
+
+def _store_fan_out(
+    keys: List[str], results: List[List[Document]], version: Optional[str]
+):
+    cache = get_retrieval_cache()
+    if cache is not None and version is not None:
+        for key, documents in zip(keys, results):
+            cache.store(key, documents, version)
+
+
+def fan_out_search(queries: Sequence[str], rerank_query: str) -> List[List[Document]]:
+    """
+    Search several query variants with one rerank against `rerank_query`, through the
+    retrieval cache and the single-flight of the retriever tool.
+    """
+    keys = _fan_out_keys(queries, rerank_query)
+    results, version = _cached_fan_out(keys)
+    if results is not None:
+        return results
+
+    def search() -> List[List[Document]]:
+        with get_metrics().timer(RETRIEVAL_SECONDS, stage="total"):
+            results = multi_query_search(get_retriever(), queries, rerank_query)
+        _store_fan_out(keys, results, version)
+        return results
+
+    return _searches.do(normalize_query(keys[0]), search)
+
 
-loaded_vector_store = load_vector_store("resources/MakingMusic_DennisDeSantis.pdf")
-retriever_tool = create_retriever_tool(
-    loaded_vector_store,
-    "electronic_music_production_guide",
+async def afan_out_search(
+    queries: Sequence[str], rerank_query: str
+) -> List[List[Document]]:
     """
+    Async variant of `fan_out_search`.
+    """
+    keys = _fan_out_keys(queries, rerank_query)
+    results, version = _cached_fan_out(keys)
+    if results is not None:
+        return results
+
+    async def search() -> List[List[Document]]:
+        # Loading the vector store blocks, so keep it off the event loop
+        retriever = await asyncio.to_thread(get_retriever)
+        with get_metrics().timer(RETRIEVAL_SECONDS, stage="total"):
+            results = await amulti_query_search(retriever, queries, rerank_query)
+        _store_fan_out(keys, results, version)
+        return results
+
+    return await _searches.ado(normalize_query(keys[0]), search)
+
+
+def _search(query: str, callbacks: Callbacks = None) -> Tuple[str, List[DocumentRef]]:
+    documents = _lazy_retriever.invoke(query, config={"callbacks": callbacks})
+    return search_result(documents)
+
+
+async def _asearch(
+    query: str, callbacks: Callbacks = None
+) -> Tuple[str, List[DocumentRef]]:
+    documents = await _lazy_retriever.ainvoke(query, config={"callbacks": callbacks})
+    return search_result(documents)
+
+
+retriever_tool = Tool(
+    name=RETRIEVER_TOOL_NAME,
+    description="""
     Search and return comprehensive information about electronic music production techniques, creative strategies, and solutions for common challenges faced by electronic music producers.
     This resource contains 74 detailed strategies covering how to start new tracks when facing creative blocks, generate musical ideas through various methods including catalog of attributes and active listening,
     choose appropriate sounds and tempos, organize workflow and studio setup, overcome procrastination and creative paralysis, program realistic drum beats with proper timing and groove,
@@ -18,6 +205,32 @@ retriever_tool = create_retriever_tool(
     and solve technical production issues including voice leading, tuning everything in the mix, managing silence and noise as compositional elements,
     and using randomization tools responsibly while maintaining creative control throughout the music-making process.
     """,
+    func=_search,
+    coroutine=_asearch,
+    args_schema=RetrieverInput,
+    # The ToolMessage keeps references to the retrieved chunks with their rerank
+    # scores, not their text, so checkpoints stay small
+    response_format="content_and_artifact",
 )
 
+
+def retriever_tool_call(queries: Sequence[str], id_prefix: str) -> AIMessage:
+    """
+    Build the AI message calling `retriever_tool` once per query, for the nodes that
+    choose the search queries themselves instead of asking the supervisor model.
+    """
+    return AIMessage(
+        content="",
+        tool_calls=[
+            {
+                "name": retriever_tool.name,
+                "args": {"query": query},
+                "id": f"{id_prefix}_{uuid.uuid4().hex}",
+                "type": "tool_call",
+            }
+            for query in queries
+        ],
+    )
+
+
 _retrieve_documents = ToolNode([retriever_tool])
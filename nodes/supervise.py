@@ -1,9 +1,15 @@
-from langchain_core.messages import HumanMessage
+from typing import Optional
+
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables.config import run_in_executor
 
 from models.state import AgentState
-from utils.aws_bedrock import chat_claude_4_sonnet
-from nodes.retrieve_documents import retriever_tool
+from utils.aws_bedrock import get_chat_model
+from utils.context import pack_history
+from utils.metrics import SUPERVISOR_ROUTES, get_metrics
+from nodes.check_answer_cache import standalone_question
+from nodes.retrieve_documents import retriever_tool, retriever_tool_call
 
 prompt_template = ChatPromptTemplate(
     [
@@ -48,27 +54,63 @@ FULL CHAT HISTORY: {chat_history}
 )
 
 
+def _supervise_inputs(state: AgentState):
+    query = state.original_user_query
+    if len(state.messages) > 0 and isinstance(state.messages[-1], HumanMessage):
+        query = state.messages[-1].content
+
+    inputs = {
+        "user_query": query,
+        "chat_history": pack_history(
+            state.messages[state.summarized_message_count :], state.history_summary
+        ),
+    }
+    return inputs, query
+
+
+def _classified_search(state: AgentState, query: str) -> Optional[AIMessage]:
+    """
+    Search a clear first-turn music production question without asking the model.
+    Follow-up questions depend on the chat history and always go to the model.
+    """
+    from utils.intent import INTENT_CLASSIFIER, get_intent_classifier
+
+    if not INTENT_CLASSIFIER or standalone_question(state.messages) is None:
+        return None
+    should_search = get_intent_classifier().should_search(query)
+    get_metrics().inc(
+        SUPERVISOR_ROUTES, routed_by="classifier" if should_search else "model"
+    )
+    return retriever_tool_call([query], "intent") if should_search else None
+
+
+def _supervise_chain():
+    tool_binded_model = get_chat_model().bind_tools([retriever_tool])
+    return prompt_template | tool_binded_model
+
+
 def _supervise(state: AgentState) -> AgentState:
     """
     Supervise the agent's actions and ensure they align with the user's intent.
     """
+    inputs, original_user_query = _supervise_inputs(state)
+    response = _classified_search(state, original_user_query)
+    if response is None:
+        response = _supervise_chain().invoke(inputs)
 
-    query = state.original_user_query
-    original_user_query = None
-
-    if state.rephrased_queries and len(state.rephrased_queries) > 0:
-        query = state.rephrased_queries[-1]
-    elif len(state.messages) > 0 and isinstance(state.messages[-1], HumanMessage):
-        query = state.messages[-1].content
-        original_user_query = query
+    return {"original_user_query": original_user_query, "messages": [response]}
 
-    tool_binded_model = chat_claude_4_sonnet.bind_tools([retriever_tool])
 
-    response = (prompt_template | tool_binded_model).invoke(
-        {
-            "user_query": query,
-            "chat_history": state.messages,
-        }
+async def _asupervise(state: AgentState) -> AgentState:
+    """
+    Async variant of `_supervise`.
+    """
+    inputs, original_user_query = _supervise_inputs(state)
+    # Embedding the question blocks
+    response = await run_in_executor(
+        None, _classified_search, state, original_user_query
     )
+    if response is None:
+        response = await _supervise_chain().ainvoke(inputs)
 
     return {"original_user_query": original_user_query, "messages": [response]}
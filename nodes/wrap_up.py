@@ -1,12 +1,35 @@
 from models.state import AgentState
 from langchain_core.messages import AIMessage
 
+from nodes.check_answer_cache import standalone_question
+from utils.metrics import COUNT_BUCKETS, REQUEST_LOOPS, get_metrics
 
-def _wrap_up(state: AgentState) -> AgentState:
+
+def _wrap_up(state: AgentState, cache_answer: bool = True) -> AgentState:
     """
     Wrap up the conversation and provide the final response.
     """
+    from utils.answer_cache import ANSWER_CACHE_ENABLED, get_answer_cache
+
     generated_message = state.generated_answer
+
+    get_metrics().observe(REQUEST_LOOPS, state.loop_count, buckets=COUNT_BUCKETS)
+
+    # Only answers that passed both LLM graders are safe to reuse
+    if (
+        cache_answer
+        and ANSWER_CACHE_ENABLED
+        and standalone_question(state.messages) is not None
+    ):
+        get_answer_cache().store(state.original_user_query, generated_message)
+
     return {
         "messages": [AIMessage(content=generated_message)],
     }
+
+
+def _wrap_up_unverified(state: AgentState) -> AgentState:
+    """
+    Wrap up with an answer the local grading signals accepted, without caching it.
+    """
+    return _wrap_up(state, cache_answer=False)
@@ -0,0 +1,102 @@
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.runnables import RunnableConfig
+
+from nodes.express_uncertainty import UNCERTAINTY_NOTICE
+from nodes.generate import ANSWER_TAG
+
+# Shown when a streamed answer was graded not useful and a new one follows
+RETRACTION_NOTICE = (
+    "\n\nThat answer did not fully address the question, let me look again.\n\n"
+)
+
+# Nodes whose message ends the conversation turn
+_FINAL_NODES = (
+    "check_answer_cache",
+    "supervise",
+    "express_uncertainty",
+    "wrap_up",
+    "wrap_up_unverified",
+)
+
+_STREAM_MODES = ["messages", "updates"]
+
+
+class _AnswerStream:
+    """
+    Turns the graph's message and update stream into the text shown to the user: the
+    answer tokens as they are generated, then a notice if grading rejected them.
+    Answers that were not streamed token by token are sent whole when the turn ends.
+    """
+
+    def __init__(self):
+        self.answer_id: Optional[str] = None
+
+    def on_message(self, chunk: Any, metadata: Dict[str, Any]) -> Optional[str]:
+        if not isinstance(chunk, AIMessageChunk):
+            return None
+        if ANSWER_TAG not in metadata.get("tags", []):
+            return None
+
+        text = chunk.text()
+        if chunk.id != self.answer_id:
+            retracted = self.answer_id is not None
+            self.answer_id = chunk.id
+            if retracted:
+                text = RETRACTION_NOTICE + text
+        return text or None
+
+    def on_update(self, node: str, update: Optional[Dict[str, Any]]) -> Optional[str]:
+        if node not in _FINAL_NODES or not update:
+            return None
+        messages = update.get("messages") or []
+        if not messages or not isinstance(messages[-1], AIMessage):
+            return None
+        message = messages[-1]
+        if message.tool_calls:
+            return None
+
+        if self.answer_id is None:
+            return message.text() or None
+        if node == "express_uncertainty":
+            return "\n\n" + UNCERTAINTY_NOTICE.strip()
+        return None
+
+
+def stream_answer(
+    graph, inputs: Dict[str, Any], config: Optional[RunnableConfig] = None
+) -> Iterator[str]:
+    """
+    Run the graph and yield the text of the answer as it is produced.
+    """
+    answer_stream = _AnswerStream()
+    for mode, payload in graph.stream(inputs, config, stream_mode=_STREAM_MODES):
+        if mode == "messages":
+            text = answer_stream.on_message(*payload)
+            if text:
+                yield text
+        else:
+            for node, update in payload.items():
+                text = answer_stream.on_update(node, update)
+                if text:
+                    yield text
+
+
+async def astream_answer(
+    graph, inputs: Dict[str, Any], config: Optional[RunnableConfig] = None
+) -> AsyncIterator[str]:
+    """
+    Async variant of `stream_answer`.
+    """
+    answer_stream = _AnswerStream()
+    async for mode, payload in graph.astream(inputs, config, stream_mode=_STREAM_MODES):
+        if mode == "messages":
+            text = answer_stream.on_message(*payload)
+            if text:
+                yield text
+        else:
+            for node, update in payload.items():
+                text = answer_stream.on_update(node, update)
+                if text:
+                    yield text
@@ -0,0 +1,9 @@
+import pytest
+
+from benchmarks.fakes import FakeEmbeddings
+
+
+@pytest.fixture
+def embeddings() -> FakeEmbeddings:
+    # Small vectors keep the index files tiny
+    return FakeEmbeddings(dimension=16)
@@ -0,0 +1,73 @@
+from typing import Any, Dict, List
+
+from langchain_core.documents import Document
+
+from utils.retrieval import AdaptiveRerank
+
+
+class _ScoredReranker:
+    """
+    Scores each document with the number in its metadata.
+    """
+
+    def rerank(self, documents, query, top_n=None) -> List[Dict[str, Any]]:
+        results = [
+            {"index": index, "relevance_score": document.metadata["score"]}
+            for index, document in enumerate(documents)
+        ]
+        results.sort(key=lambda result: result["relevance_score"], reverse=True)
+        return results[:top_n]
+
+
+def _documents(*scores: float, words: int = 10) -> List[Document]:
+    return [
+        Document(page_content="word " * words, metadata={"score": score})
+        for score in scores
+    ]
+
+
+def _kept_scores(rerank: AdaptiveRerank, documents: List[Document]) -> List[float]:
+    return [
+        document.metadata["relevance_score"]
+        for document in rerank.compress_documents(documents, "query")
+    ]
+
+
+def _rerank(**settings: Any) -> AdaptiveRerank:
+    defaults = dict(
+        min_score=0.15, max_score_gap=0.5, token_budget=10_000, max_chunks=6
+    )
+    return AdaptiveRerank(reranker=_ScoredReranker(), **{**defaults, **settings})
+
+
+def test_sorted_by_score():
+    assert _kept_scores(_rerank(), _documents(0.5, 0.9, 0.7)) == [0.9, 0.7, 0.5]
+
+
+def test_cut_below_min_score():
+    assert _kept_scores(_rerank(), _documents(0.9, 0.8, 0.1, 0.05)) == [0.9, 0.8]
+
+
+def test_cut_at_score_gap():
+    # 0.8 to 0.3 is a drop of more than half
+    assert _kept_scores(_rerank(), _documents(0.9, 0.8, 0.3, 0.29)) == [0.9, 0.8]
+
+
+def test_cut_at_token_budget():
+    documents = _documents(0.9, 0.9, 0.9, words=100)
+    kept = _kept_scores(_rerank(token_budget=250), documents)
+
+    assert len(kept) == 2
+
+
+def test_max_chunks():
+    assert len(_kept_scores(_rerank(max_chunks=3), _documents(*[0.9] * 10))) == 3
+
+
+def test_min_chunks_kept_below_min_score():
+    assert _kept_scores(_rerank(), _documents(0.05, 0.01)) == [0.05]
+    assert _kept_scores(_rerank(min_chunks=0), _documents(0.05)) == []
+
+
+def test_no_documents():
+    assert _rerank().compress_documents([], "query") == []
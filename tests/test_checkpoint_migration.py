@@ -0,0 +1,93 @@
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.graph import END, START, StateGraph
+
+from models.state import AgentState
+from nodes.check_answer_cache import _check_answer_cache
+from utils.chunk_store import (
+    OMITTED_SEARCH_CONTENT,
+    RETRIEVER_TOOL_NAME,
+    compact_tool_messages,
+)
+
+# Chunks as the baseline retriever tool returned them: joined text, no artifact
+CHUNKS = "\n\n".join(
+    f"Chunk {number}: " + "production tip " * 200 for number in range(6)
+)
+
+
+def _baseline_thread():
+    return {
+        "messages": [
+            HumanMessage(content="How do I start a track?", id="human-1"),
+            AIMessage(
+                content="",
+                id="ai-1",
+                tool_calls=[
+                    {
+                        "name": RETRIEVER_TOOL_NAME,
+                        "args": {"query": "start a track"},
+                        "id": "call-1",
+                    }
+                ],
+            ),
+            ToolMessage(
+                content=CHUNKS,
+                name=RETRIEVER_TOOL_NAME,
+                tool_call_id="call-1",
+                id="tool-1",
+            ),
+            AIMessage(content="Start from a sound you like.", id="ai-2"),
+        ],
+        "original_user_query": "How do I start a track?",
+        "documents": CHUNKS,
+        "generated_answer": "Start from a sound you like.",
+    }
+
+
+def _checkpoint_bytes(saver: InMemorySaver, config) -> int:
+    checkpoint = saver.get_tuple(config).checkpoint
+    return len(saver.serde.dumps_typed(checkpoint["channel_values"])[1])
+
+
+def test_baseline_tool_messages_are_compacted():
+    thread = _baseline_thread()
+
+    compacted = compact_tool_messages(thread["messages"])
+
+    assert [message.id for message in compacted] == ["tool-1"]
+    assert compacted[0].content == OMITTED_SEARCH_CONTENT
+    # Compacted messages are left alone on the next turn
+    assert compact_tool_messages(compacted) == []
+
+
+def test_other_tool_messages_are_kept():
+    message = ToolMessage(content="42", name="calculator", tool_call_id="c", id="t")
+
+    assert compact_tool_messages([message]) == []
+
+
+def test_legacy_documents_string_is_dropped():
+    assert AgentState(messages=[], documents=CHUNKS).documents == []
+
+
+def test_baseline_checkpoint_shrinks_on_the_next_turn():
+    workflow = StateGraph(AgentState)
+    workflow.add_node("check_answer_cache", _check_answer_cache)
+    workflow.add_edge(START, "check_answer_cache")
+    workflow.add_edge("check_answer_cache", END)
+    saver = InMemorySaver()
+    graph = workflow.compile(checkpointer=saver)
+    config = {"configurable": {"thread_id": "baseline"}}
+
+    graph.update_state(config, _baseline_thread(), as_node="check_answer_cache")
+    before = _checkpoint_bytes(saver, config)
+
+    graph.invoke({"messages": [HumanMessage(content="And then?")]}, config)
+    after = _checkpoint_bytes(saver, config)
+
+    state = graph.get_state(config).values
+    tool_message = next(m for m in state["messages"] if isinstance(m, ToolMessage))
+    assert tool_message.content == OMITTED_SEARCH_CONTENT
+    assert state["documents"] == []
+    assert after < before / 4
@@ -0,0 +1,96 @@
+import numpy as np
+
+from benchmarks.fakes import FakeEmbeddings
+
+from utils.embedding_cache import CachedEmbeddings, EmbeddingCache
+
+DIMENSION = 4
+ROW_BYTES = DIMENSION * 4
+
+
+def _vector(number: int):
+    return [float(number)] * DIMENSION
+
+
+def _items(numbers):
+    return {f"key-{number}": _vector(number) for number in numbers}
+
+
+def test_put_and_get(tmp_path):
+    cache = EmbeddingCache(str(tmp_path))
+    cache.put_many(_items(range(3)))
+
+    assert cache.get_many(["key-1", "missing"]) == {"key-1": _vector(1)}
+
+
+def test_other_instance_reads_new_rows(tmp_path):
+    writer = EmbeddingCache(str(tmp_path))
+    reader = EmbeddingCache(str(tmp_path))
+    writer.put_many(_items(range(2)))
+
+    assert reader.get_many(["key-0", "key-1"]) == _items(range(2))
+
+    # Rows written by the reader land after the writer's ones
+    reader.put_many(_items([2]))
+    assert writer.get_many(["key-0", "key-2"]) == _items([0, 2])
+
+
+def test_eviction_across_instances(tmp_path):
+    # Five rows fit, eviction keeps the four most recently used
+    first = EmbeddingCache(str(tmp_path), max_bytes=5 * ROW_BYTES)
+    second = EmbeddingCache(str(tmp_path), max_bytes=5 * ROW_BYTES)
+    for number in range(4):
+        first.put_many(_items([number]))
+
+    second.put_many(_items([4, 5]))
+
+    expected = _items(range(2, 6))
+    for cache in (first, second, EmbeddingCache(str(tmp_path))):
+        assert cache.get_many(list(_items(range(6)))) == expected
+    assert (tmp_path / "vectors.f32").stat().st_size == 4 * ROW_BYTES
+
+    # Rows added after the eviction still line up with the compacted file
+    first.put_many(_items([6]))
+    assert second.get_many(["key-5", "key-6"]) == _items([5, 6])
+
+
+def test_orphaned_rows_are_overwritten(tmp_path):
+    cache = EmbeddingCache(str(tmp_path))
+    cache.put_many(_items([0]))
+    # A write that failed before saving the index leaves rows without entries
+    with open(tmp_path / "vectors.f32", "ab") as f:
+        f.write(np.asarray([_vector(9)], dtype=np.float32).tobytes())
+
+    cache.put_many(_items([1]))
+
+    assert EmbeddingCache(str(tmp_path)).get_many(["key-0", "key-1"]) == _items([0, 1])
+
+
+def test_index_not_matching_the_vectors_is_dropped(tmp_path):
+    EmbeddingCache(str(tmp_path)).put_many(_items(range(2)))
+    with open(tmp_path / "vectors.f32", "ab") as f:
+        f.write(b"\0" * 3)
+
+    assert EmbeddingCache(str(tmp_path)).get_many(["key-0"]) == {}
+
+
+class _RecordingEmbeddings(FakeEmbeddings):
+    def __init__(self):
+        super().__init__(dimension=DIMENSION)
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return super().embed_documents(texts)
+
+
+def test_cached_embeddings_only_embed_new_texts(tmp_path):
+    underlying = _RecordingEmbeddings()
+    cached = CachedEmbeddings(underlying, "fake", cache_directory=str(tmp_path))
+
+    first = cached.embed_documents(["a", "b"])
+    second = cached.embed_documents(["b", "c"])
+
+    assert underlying.calls == [["a", "b"], ["c"]]
+    # Cached vectors are stored as float32
+    np.testing.assert_allclose(second[0], first[1], rtol=1e-6)
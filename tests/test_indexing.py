@@ -0,0 +1,82 @@
+import os
+
+import pytest
+from langchain_core.documents import Document
+
+from utils.indexing import index_documents
+from utils.numpy_store import NumpyVectorStore
+
+
+@pytest.fixture
+def store(tmp_path, embeddings) -> NumpyVectorStore:
+    return NumpyVectorStore(embeddings, str(tmp_path / "index"))
+
+
+def _chunks(source: str, *texts: str):
+    return [Document(page_content=text, metadata={"source": source}) for text in texts]
+
+
+def _texts(store: NumpyVectorStore):
+    return sorted(store.get()["documents"])
+
+
+def test_unchanged_chunks_are_not_added_again(store, tmp_path):
+    a = str(tmp_path / "a.pdf")
+
+    first = index_documents(store, _chunks(a, "one", "two"))
+    second = index_documents(store, _chunks(a, "one", "two"))
+
+    assert (first.added, first.unchanged, first.deleted) == (2, 0, 0)
+    assert (second.added, second.unchanged, second.deleted) == (0, 2, 0)
+
+
+def test_duplicate_chunks_in_a_run_are_added_once(store, tmp_path):
+    a = str(tmp_path / "a.pdf")
+
+    result = index_documents(store, _chunks(a, "one", "one", "two"), batch_size=2)
+
+    assert result.added == 2
+    assert _texts(store) == ["one", "two"]
+
+
+def test_stale_chunks_of_indexed_sources_are_deleted(store, tmp_path):
+    a, b = str(tmp_path / "a.pdf"), str(tmp_path / "b.pdf")
+    index_documents(store, _chunks(a, "one", "two") + _chunks(b, "three"))
+
+    # b is not part of this run, so its chunks are out of scope and kept
+    result = index_documents(store, _chunks(a, "one", "changed"))
+
+    assert (result.added, result.unchanged, result.deleted) == (1, 1, 1)
+    assert _texts(store) == ["changed", "one", "three"]
+
+
+def test_in_scope_deletes_chunks_of_removed_sources(store, tmp_path):
+    directory = os.path.join(str(tmp_path), "docs", "")
+    a, b = directory + "a.pdf", directory + "b.pdf"
+    index_documents(store, _chunks(a, "one") + _chunks(b, "two"))
+
+    result = index_documents(
+        store, _chunks(a, "one"), in_scope=lambda source: source.startswith(directory)
+    )
+
+    assert result.deleted == 1
+    assert _texts(store) == ["one"]
+
+
+def test_sources_match_by_canonical_path(store, tmp_path):
+    a = str(tmp_path / "a.pdf")
+    index_documents(store, _chunks(os.path.join(str(tmp_path), ".", "a.pdf"), "old"))
+
+    result = index_documents(store, _chunks(a, "new"))
+
+    assert result.deleted == 1
+    assert _texts(store) == ["new"]
+
+
+def test_chunks_without_source_are_deleted(store, tmp_path):
+    store.add_texts(["legacy"], [{}])
+
+    result = index_documents(store, _chunks(str(tmp_path / "a.pdf"), "one"))
+
+    assert result.deleted == 1
+    assert _texts(store) == ["one"]
@@ -0,0 +1,39 @@
+from utils.metrics import (
+    RETRIEVAL_SECONDS,
+    SUPERVISOR_ROUTES,
+    CacheStats,
+    MetricsRegistry,
+    NullMetricsRegistry,
+)
+
+
+def _record(registry: MetricsRegistry):
+    registry.inc(SUPERVISOR_ROUTES, router="model")
+    registry.observe(RETRIEVAL_SECONDS, 0.1, stage="dense")
+    with registry.timer(RETRIEVAL_SECONDS, stage="total"):
+        pass
+    stats = CacheStats()
+    stats.record(True)
+    registry.register_cache("retrieval", stats)
+
+
+def test_registry_records():
+    registry = MetricsRegistry()
+    _record(registry)
+
+    snapshot = registry.snapshot()
+    assert snapshot[SUPERVISOR_ROUTES] == [
+        {"labels": {"router": "model"}, "value": 1.0}
+    ]
+    assert {entry["labels"]["stage"] for entry in snapshot[RETRIEVAL_SECONDS]} == {
+        "dense",
+        "total",
+    }
+
+
+def test_null_registry_drops_everything():
+    registry = NullMetricsRegistry()
+    _record(registry)
+
+    assert registry.snapshot() == {}
+    assert registry.to_prometheus() == "\n"
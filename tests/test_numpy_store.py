@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+from utils.numpy_store import NumpyVectorStore
+
+TEXTS = [f"chunk {number} about topic {number % 3}" for number in range(20)]
+
+
+@pytest.fixture(params=["float32", "int8"])
+def store(request, tmp_path, embeddings) -> NumpyVectorStore:
+    return NumpyVectorStore(embeddings, str(tmp_path), quantization=request.param)
+
+
+def _best_match(store: NumpyVectorStore, text: str) -> str:
+    return store.similarity_search(text, k=1)[0].page_content
+
+
+def _positions(store: NumpyVectorStore):
+    return [row[0] for row in store._query("SELECT position FROM chunks ORDER BY 1")]
+
+
+def test_add_and_search(store):
+    ids = store.add_texts(TEXTS)
+
+    assert store.count() == len(TEXTS)
+    assert all(_best_match(store, text) == text for text in TEXTS)
+    assert [document.id for document in store.get_by_ids(ids[:3])] == ids[:3]
+
+
+def test_add_existing_ids_overwrites_in_place(store):
+    ids = store.add_texts(TEXTS)
+    store.add_texts(["replaced text"], ids=[ids[5]])
+
+    assert store.count() == len(TEXTS)
+    assert store.get_by_ids([ids[5]])[0].page_content == "replaced text"
+    assert _best_match(store, "replaced text") == "replaced text"
+
+
+def test_delete_compacts_into_new_generation_file(store, tmp_path):
+    ids = store.add_texts(TEXTS)
+    old_files = set(os.listdir(tmp_path))
+
+    assert store.delete(ids[2:18:3]) is True
+
+    kept = [text for number, text in enumerate(TEXTS) if number not in range(2, 18, 3)]
+    assert store.count() == len(kept)
+    assert store.get()["documents"] == kept
+    assert all(_best_match(store, text) == text for text in kept)
+    # The old vector files are removed once the new ones are committed
+    files = set(os.listdir(tmp_path))
+    assert not (old_files - {"metadata.db"}) & files
+    assert _positions(store) == list(range(len(kept)))
+
+
+def test_delete_unknown_ids(store):
+    store.add_texts(TEXTS)
+
+    assert store.delete(["unknown"]) is False
+    assert store.delete([]) is None
+    assert store.count() == len(TEXTS)
+
+
+def test_other_instance_sees_changes(store, tmp_path, embeddings):
+    ids = store.add_texts(TEXTS)
+    reader = NumpyVectorStore(embeddings, str(tmp_path))
+    assert _best_match(reader, TEXTS[7]) == TEXTS[7]
+    snapshot = reader._current()
+
+    store.delete(ids[:5])
+    store.add_texts(["added later"])
+
+    assert reader.quantization == store.quantization
+    assert reader.count() == len(TEXTS) - 4
+    assert _best_match(reader, "added later") == "added later"
+    assert _best_match(reader, TEXTS[7]) == TEXTS[7]
+    # A mapping taken before the compaction stays readable
+    assert snapshot.vectors[len(TEXTS) - 1].shape == (16,)
+
+
+def test_reopen(store, tmp_path, embeddings):
+    ids = store.add_texts(TEXTS)
+    store.delete(ids[:2])
+
+    reopened = NumpyVectorStore(embeddings, str(tmp_path), quantization="float32")
+
+    assert reopened.quantization == store.quantization
+    assert reopened.count() == len(TEXTS) - 2
+    assert all(_best_match(reopened, text) == text for text in TEXTS[2:])
+
+
+def test_dimension_mismatch(store):
+    store.add_texts(TEXTS[:2])
+    store._embedding.dimension = 8
+
+    with pytest.raises(ValueError):
+        store.add_texts(["other dimension"])
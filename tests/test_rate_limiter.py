@@ -0,0 +1,97 @@
+import sqlite3
+import time
+
+import pytest
+
+from utils.rate_limiter import (
+    PRIORITY_AGING_SECONDS,
+    PRIORITY_HIGH,
+    PRIORITY_LOW,
+    PRIORITY_NORMAL,
+    PriorityRateLimiter,
+    SharedRateLimiter,
+)
+
+
+def _limiter(tmp_path, **settings) -> SharedRateLimiter:
+    # A refill too slow to matter during a test
+    defaults = dict(requests_per_second=1e-6, max_burst=2, tokens_per_minute=6000)
+    return SharedRateLimiter(str(tmp_path / "limits.db"), **{**defaults, **settings})
+
+
+def test_full_bucket_admits_every_priority(tmp_path):
+    for priority in (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW):
+        assert _limiter(tmp_path, max_burst=2, name=priority).try_acquire(priority)
+
+
+def test_headroom_is_kept_for_higher_priorities(tmp_path):
+    limiter = _limiter(tmp_path, max_burst=2)
+    assert limiter.try_acquire(PRIORITY_LOW)
+
+    # One request left: low and normal priority leave it to high priority
+    assert not limiter.try_acquire(PRIORITY_LOW)
+    assert not limiter.try_acquire(PRIORITY_NORMAL)
+    assert limiter.try_acquire(PRIORITY_HIGH)
+    assert not limiter.try_acquire(PRIORITY_HIGH)
+
+
+def test_waiting_callers_lose_their_headroom(tmp_path):
+    limiter = _limiter(tmp_path, max_burst=2)
+    assert limiter.try_acquire(PRIORITY_HIGH)
+
+    assert not limiter.try_acquire(PRIORITY_LOW, PRIORITY_AGING_SECONDS / 2)
+    assert limiter.try_acquire(PRIORITY_LOW, PRIORITY_AGING_SECONDS)
+
+
+def test_token_headroom(tmp_path):
+    limiter = _limiter(tmp_path, max_burst=10)
+    # Spend most of the 10 second token burst
+    limiter.record_success(int(limiter.token_capacity * 0.6))
+
+    assert not limiter.try_acquire(PRIORITY_LOW)
+    assert limiter.try_acquire(PRIORITY_NORMAL)
+
+
+def test_limiters_on_the_same_file_share_the_quota(tmp_path):
+    first, second = _limiter(tmp_path), _limiter(tmp_path)
+
+    assert first.try_acquire(PRIORITY_HIGH)
+    assert second.try_acquire(PRIORITY_HIGH)
+    assert not first.try_acquire(PRIORITY_HIGH)
+
+
+def test_throttling_empties_the_bucket_and_halves_the_rate(tmp_path):
+    limiter = _limiter(tmp_path, requests_per_second=5)
+    limiter.record_throttle()
+    # Throttles within the cooldown only count once
+    limiter.record_throttle()
+
+    decreased_at = limiter._refilled(0).decreased_at
+    buckets = limiter._refilled(decreased_at)
+    assert buckets.requests == 0
+    assert buckets.scale == pytest.approx(0.5)
+
+
+def test_waiting_callers_sleep_until_the_refill(tmp_path):
+    limiter = _limiter(tmp_path, requests_per_second=10, max_burst=1)
+    assert limiter.try_acquire(PRIORITY_HIGH)
+
+    assert limiter.acquire_or_wait(PRIORITY_HIGH) == pytest.approx(0.1, abs=0.02)
+
+    started = time.perf_counter()
+    assert PriorityRateLimiter(limiter, PRIORITY_HIGH).acquire()
+    assert time.perf_counter() - started == pytest.approx(0.1, abs=0.05)
+
+
+def test_rejected_callers_do_not_take_the_write_lock(tmp_path):
+    limiter = _limiter(tmp_path, max_burst=1)
+    assert limiter.try_acquire(PRIORITY_HIGH)
+
+    other = sqlite3.connect(str(tmp_path / "limits.db"), isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        # Would block on the other process' write lock if the read took one
+        assert limiter.acquire_or_wait(PRIORITY_HIGH) > 0
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
@@ -0,0 +1,55 @@
+from langchain_core.documents import Document
+
+from utils.retrieval_cache import RetrievalCache
+
+
+class _Corpus:
+    def __init__(self):
+        self.version = "v1"
+
+    def __call__(self) -> str:
+        return self.version
+
+
+def _documents(text: str):
+    return [Document(id="1", page_content=text, metadata={"relevance_score": 0.9})]
+
+
+def test_hits_are_keyed_by_the_normalized_query():
+    cache = RetrievalCache(corpus_version=_Corpus())
+    version = cache.version()
+    assert cache.lookup("Sidechain compression", version) is None
+    cache.store("Sidechain compression", _documents("ducking"), version)
+
+    assert cache.lookup("  sidechain   COMPRESSION ")[0].page_content == "ducking"
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+
+
+def test_results_of_a_search_overtaken_by_ingestion_are_not_stored(tmp_path):
+    corpus = _Corpus()
+    cache = RetrievalCache(
+        database_path=str(tmp_path / "cache.db"), corpus_version=corpus
+    )
+    version = cache.version()
+    assert cache.lookup("reverb", version) is None
+
+    # The corpus changes while the search runs
+    corpus.version = "v2"
+    cache.store("reverb", _documents("stale"), version)
+
+    assert cache.lookup("reverb") is None
+    reopened = RetrievalCache(
+        database_path=str(tmp_path / "cache.db"), corpus_version=corpus
+    )
+    assert reopened.lookup("reverb") is None
+
+
+def test_a_new_corpus_version_drops_the_entries():
+    corpus = _Corpus()
+    cache = RetrievalCache(corpus_version=corpus)
+    cache.store("reverb", _documents("old"), cache.version())
+
+    corpus.version = "v2"
+    assert cache.lookup("reverb") is None
+    cache.store("reverb", _documents("new"), cache.version())
+    assert cache.lookup("reverb")[0].page_content == "new"
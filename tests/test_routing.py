@@ -0,0 +1,17 @@
+from main import MAX_REPHRASE_ROUNDS, decide_to_generate
+from models.state import AgentState, DocumentRef
+
+
+def test_rephrases_until_the_round_limit():
+    # One fan-out round records several variants but is a single round
+    state = AgentState(messages=[], rephrased_queries=["a", "b", "c"], loop_count=1)
+    assert decide_to_generate(state) == "rephrase_query"
+
+    state.loop_count = MAX_REPHRASE_ROUNDS
+    assert decide_to_generate(state) == "generate"
+
+
+def test_generates_once_documents_are_found():
+    state = AgentState(messages=[], documents=[DocumentRef(id="chunk")])
+
+    assert decide_to_generate(state) == "generate"
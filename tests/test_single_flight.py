@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    flight = SingleFlight()
+    runs = []
+    started = threading.Event()
+
+    def search():
+        runs.append(1)
+        started.set()
+        time.sleep(0.1)
+        return "result"
+
+    with ThreadPoolExecutor(4) as executor:
+        leader = executor.submit(flight.do, "query", search)
+        started.wait()
+        followers = [executor.submit(flight.do, "query", search) for _ in range(3)]
+        results = [leader.result()] + [future.result() for future in followers]
+
+    assert results == ["result"] * 4
+    assert len(runs) == 1
+
+
+def test_errors_are_shared_and_not_kept():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        flight.do("query", fail)
+    assert flight.do("query", lambda: "retried") == "retried"
+
+
+def test_async_calls_share_one_run():
+    flight = SingleFlight()
+    runs = []
+
+    async def search():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*(flight.ado("query", search) for _ in range(4)))
+
+    assert asyncio.run(main()) == ["result"] * 4
+    assert len(runs) == 1
+
+
+def test_cancelled_waiter_does_not_cancel_the_call():
+    flight = SingleFlight()
+
+    async def search():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        first = asyncio.ensure_future(flight.ado("query", search))
+        second = asyncio.ensure_future(flight.ado("query", search))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "result"
@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from utils.aws_bedrock import get_embeddings
+from utils.corpus_version import get_corpus_version
+from utils.metrics import CacheStats, get_metrics
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(
+    os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95")
+)
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1024"))
+
+# Number of recent question embeddings kept so storing an answer does not embed again
+_QUESTION_VECTOR_MEMO_SIZE = 256
+
+
+def _normalize_question(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+class _CachedAnswer:
+    def __init__(self, answer: str, vector: np.ndarray):
+        self.answer = answer
+        self.vector = vector
+        self.created_at = time.monotonic()
+
+
+class SemanticAnswerCache:
+    """
+    In-memory cache of graded answers, looked up by embedding similarity of the question.
+
+    Entries expire after `ttl_seconds`, the least recently used entries are evicted beyond
+    `max_entries`, and the whole cache is cleared when the corpus version changes.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        similarity_threshold: float = ANSWER_CACHE_SIMILARITY_THRESHOLD,
+        ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        corpus_version: Callable[[], str] = get_corpus_version,
+    ):
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.corpus_version = corpus_version
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, _CachedAnswer] = OrderedDict()
+        self._question_vectors: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[str] = []
+        self._version = corpus_version()
+        self.stats = CacheStats()
+
+    def _embed(self, question: str) -> np.ndarray:
+        key = _normalize_question(question)
+        with self._lock:
+            vector = self._question_vectors.get(key)
+        if vector is not None:
+            return vector
+
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+
+        with self._lock:
+            self._question_vectors[key] = vector
+            while len(self._question_vectors) > _QUESTION_VECTOR_MEMO_SIZE:
+                self._question_vectors.popitem(last=False)
+        return vector
+
+    def _invalidate_stale(self):
+        # Called with the lock held
+        version = self.corpus_version()
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+            self._matrix = None
+
+        now = time.monotonic()
+        expired = [
+            key
+            for key, entry in self._entries.items()
+            if now - entry.created_at > self.ttl_seconds
+        ]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def lookup(self, question: str) -> Optional[str]:
+        """
+        Return the cached answer of the most similar question above the threshold, if any.
+        """
+        answer = self._lookup(question)
+        self.stats.record(answer is not None)
+        return answer
+
+    def _lookup(self, question: str) -> Optional[str]:
+        vector = self._embed(question)
+
+        with self._lock:
+            self._invalidate_stale()
+            if not self._entries:
+                return None
+
+            if self._matrix is None:
+                self._matrix_keys = list(self._entries.keys())
+                self._matrix = np.stack(
+                    [self._entries[key].vector for key in self._matrix_keys]
+                )
+            similarities = self._matrix @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                return None
+
+            # Reordering for LRU keeps the matrix valid, since its keys are kept alongside
+            key = self._matrix_keys[best]
+            self._entries.move_to_end(key)
+            return self._entries[key].answer
+
+    def store(self, question: str, answer: str):
+        vector = self._embed(question)
+
+        with self._lock:
+            self._invalidate_stale()
+            key = _normalize_question(question)
+            self._entries[key] = _CachedAnswer(answer, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+
+@lru_cache
+def get_answer_cache() -> SemanticAnswerCache:
+    cache = SemanticAnswerCache(get_embeddings())
+    get_metrics().register_cache("answer", cache.stats)
+    return cache
@@ -1,28 +1,186 @@
-from langchain_aws import ChatBedrockConverse, BedrockEmbeddings, BedrockRerank
-from langchain_core.rate_limiters import InMemoryRateLimiter
+import os
+from functools import lru_cache
+from typing import Any, Dict
 
 aws_region = "eu-central-1"
 model_arn_rerank = "arn:aws:bedrock:eu-central-1::foundation-model/cohere.rerank-v3-5:0"
 model_id_embeddings = "cohere.embed-multilingual-v3"
 model_id_chat = "eu.anthropic.claude-sonnet-4-20250514-v1:0"
 
-chat_claude_4_sonnet = ChatBedrockConverse(
-    model=model_id_chat,
-    region_name=aws_region,
-    temperature=0,
-    max_tokens=4096,
-    rate_limiter=InMemoryRateLimiter(
+# Connections per boto client; size this to the number of concurrent conversations
+BEDROCK_MAX_POOL_CONNECTIONS = int(os.getenv("BEDROCK_MAX_POOL_CONNECTIONS", "50"))
+
+# The Bedrock clients are created on first use, so importing this module stays cheap
+
+# Local stand-ins for the Bedrock models, set with `override_models`
+_model_overrides: Dict[str, Any] = {}
+
+
+def override_models(chat_model=None, embeddings=None, compressor=None):
+    """
+    Replace Bedrock models with local stand-ins, such as the deterministic fakes used by
+    the benchmarks. Models that are not passed keep using Bedrock.
+    """
+    for name, model in (
+        ("chat_model", chat_model),
+        ("embeddings", embeddings),
+        ("compressor", compressor),
+    ):
+        if model is not None:
+            _model_overrides[name] = model
+
+    get_chat_model.cache_clear()
+    get_compressor.cache_clear()
+    get_embeddings.cache_clear()
+
+
+@lru_cache
+def get_boto_client(service_name: str):
+    """
+    Return the boto client for a Bedrock service, shared by every model that uses it.
+    boto clients are thread-safe, so one pooled client serves all concurrent calls.
+    """
+    import boto3
+    from botocore.config import Config
+
+    config = Config(
+        region_name=aws_region,
+        max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS,
+        retries={"mode": "standard"},
+    )
+    client = boto3.session.Session().client(service_name, config=config)
+
+    if service_name == "bedrock-runtime":
+        from utils.rate_limiter import (
+            RATE_LIMITER,
+            get_shared_rate_limiter,
+            on_bedrock_attempt,
+        )
+
+        if RATE_LIMITER == "shared":
+            # Throttled attempts that botocore retries never surface as errors
+            hook = on_bedrock_attempt(get_shared_rate_limiter())
+            for operation in ("Converse", "ConverseStream"):
+                client.meta.events.register(
+                    f"needs-retry.bedrock-runtime.{operation}", hook
+                )
+    return client
+
+
+@lru_cache
+def get_rate_limiter(priority: str = "normal"):
+    """
+    Return the rate limiter of the chat model calls made with the given priority.
+    """
+    from utils.rate_limiter import RATE_LIMITER, get_shared_rate_limiter
+
+    if RATE_LIMITER == "shared":
+        return get_shared_rate_limiter().view(priority)
+    if RATE_LIMITER == "memory":
+        return _get_memory_rate_limiter()
+    raise ValueError(f"Unknown RATE_LIMITER: {RATE_LIMITER!r}")
+
+
+@lru_cache
+def _get_memory_rate_limiter():
+    # A single per-process limiter, without priorities
+    from langchain_core.rate_limiters import InMemoryRateLimiter
+    from utils.metrics import METRICS_ENABLED, InstrumentedRateLimiter
+
+    rate_limiter_class = (
+        InstrumentedRateLimiter if METRICS_ENABLED else InMemoryRateLimiter
+    )
+    return rate_limiter_class(
         requests_per_second=5, check_every_n_seconds=0.5, max_bucket_size=2
-    ),
-)
-
-compressor = BedrockRerank(
-    model_arn=model_arn_rerank,
-    region_name=aws_region,
-    top_n=10,
-)
-
-embeddings = BedrockEmbeddings(
-    model_id=model_id_embeddings,
-    region_name=aws_region,
-)
+    )
+
+
+@lru_cache
+def get_chat_model(cached: bool = False, priority: str = "normal"):
+    """
+    Return the chat model. With `cached=True` identical calls are answered from the
+    LLM response cache, which is only safe for deterministic prompts such as graders.
+
+    `priority` ("high", "normal" or "low") decides who goes first when the shared rate
+    limiter runs short: user-facing answer generation before background grading.
+    """
+    from utils.llm_cache import get_llm_cache
+    from utils.metrics import METRICS_ENABLED, get_metrics_callback_handler
+    from utils.rate_limiter import RATE_LIMITER, get_rate_limit_feedback_handler
+
+    cache = get_llm_cache() if cached else None
+    callbacks = []
+    if METRICS_ENABLED:
+        callbacks.append(get_metrics_callback_handler())
+
+    if "chat_model" in _model_overrides:
+        # Stand-ins have no Bedrock quota to protect, so they skip the rate limiter
+        return _model_overrides["chat_model"].model_copy(
+            update={"cache": cache, "callbacks": callbacks or None}
+        )
+
+    if RATE_LIMITER == "shared":
+        callbacks.append(get_rate_limit_feedback_handler())
+
+    from langchain_aws import ChatBedrockConverse
+
+    return ChatBedrockConverse(
+        model=model_id_chat,
+        region_name=aws_region,
+        client=get_boto_client("bedrock-runtime"),
+        bedrock_client=get_boto_client("bedrock"),
+        temperature=0,
+        max_tokens=4096,
+        rate_limiter=get_rate_limiter(priority),
+        cache=cache,
+        callbacks=callbacks or None,
+    )
+
+
+@lru_cache
+def get_compressor():
+    if "compressor" in _model_overrides:
+        return _model_overrides["compressor"]
+
+    from langchain_aws import BedrockRerank
+
+    return BedrockRerank(
+        model_arn=model_arn_rerank,
+        region_name=aws_region,
+        client=get_boto_client("bedrock-agent-runtime"),
+        top_n=10,
+    )
+
+
+@lru_cache
+def get_embeddings():
+    from utils.embedding_cache import CachedEmbeddings
+
+    if "embeddings" in _model_overrides:
+        embeddings = _model_overrides["embeddings"]
+        return CachedEmbeddings(embeddings, model_id=type(embeddings).__name__)
+
+    from langchain_aws import BedrockEmbeddings
+
+    return CachedEmbeddings(
+        BedrockEmbeddings(
+            model_id=model_id_embeddings,
+            region_name=aws_region,
+            client=get_boto_client("bedrock-runtime"),
+        ),
+        model_id=model_id_embeddings,
+    )
+
+
+_lazy_clients = {
+    "chat_claude_4_sonnet": get_chat_model,
+    "compressor": get_compressor,
+    "embeddings": get_embeddings,
+}
+
+
+def __getattr__(name: str):
+    # Keep the original module-level names available, created on first access
+    if name in _lazy_clients:
+        return _lazy_clients[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,213 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage, ToolMessage
+from langchain_core.vectorstores import VectorStore
+
+from models.state import DocumentRef, inline_document_ref
+from utils.context import join_documents
+from utils.metrics import CacheStats, get_metrics
+
+CHUNK_CACHE_MAX_ENTRIES = int(os.getenv("CHUNK_CACHE_MAX_ENTRIES", "4096"))
+
+# Name of the retriever tool, whose ToolMessages hold the search results
+RETRIEVER_TOOL_NAME = "electronic_music_production_guide"
+
+# Content left in the search results of older threads, whose chunks were not kept
+OMITTED_SEARCH_CONTENT = "Retrieved chunks of an earlier turn, no longer stored."
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkCache:
+    """
+    In-memory LRU cache of chunk texts by vector store id. Chunk ids are content
+    hashes, so a cached text never goes stale.
+    """
+
+    def __init__(self, max_entries: int = CHUNK_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._texts: OrderedDict[str, str] = OrderedDict()
+        self.stats = CacheStats()
+
+    def get_many(self, ids: Iterable[str]) -> Dict[str, str]:
+        found: Dict[str, str] = {}
+        with self._lock:
+            for id in ids:
+                text = self._texts.get(id)
+                self.stats.record(text is not None)
+                if text is not None:
+                    self._texts.move_to_end(id)
+                    found[id] = text
+        return found
+
+    def put_many(self, texts: Dict[str, str]):
+        with self._lock:
+            for id, text in texts.items():
+                self._texts[id] = text
+                self._texts.move_to_end(id)
+            while len(self._texts) > self.max_entries:
+                self._texts.popitem(last=False)
+
+
+@lru_cache
+def get_chunk_cache() -> ChunkCache:
+    cache = ChunkCache()
+    get_metrics().register_cache("chunk", cache.stats)
+    return cache
+
+
+@lru_cache
+def _vector_stores() -> List[VectorStore]:
+    from utils.shards import load_shards
+    from utils.vector_store import open_vector_store
+
+    return [open_vector_store(shard.name) for shard in load_shards()]
+
+
+def document_refs(documents: Sequence[Document]) -> List[DocumentRef]:
+    """
+    Reference retrieved chunks, keeping their text in the chunk cache for the prompts
+    that render them later in the request.
+    """
+    refs: List[DocumentRef] = []
+    texts: Dict[str, str] = {}
+    for document in documents:
+        score = document.metadata.get("relevance_score")
+        if document.id:
+            texts[document.id] = document.page_content
+            refs.append(DocumentRef(id=document.id, score=score))
+        else:
+            # Without an id the chunk cannot be looked up again
+            refs.append(inline_document_ref(document.page_content, score))
+    get_chunk_cache().put_many(texts)
+    return refs
+
+
+def _is_document(item: Any) -> bool:
+    # Documents restored from a checkpoint may come back as their serialized dicts
+    return isinstance(item, Document) or (
+        isinstance(item, dict) and "page_content" in item
+    )
+
+
+def as_document_refs(artifact: Any) -> List[DocumentRef]:
+    """
+    Read the references of a retriever ToolMessage artifact: references, as restored
+    from a checkpoint, or the full documents stored by older threads.
+    """
+    refs: List[DocumentRef] = []
+    for item in artifact or []:
+        if _is_document(item):
+            document = item if isinstance(item, Document) else Document(**item)
+            refs.extend(document_refs([document]))
+        else:
+            refs.append(DocumentRef.model_validate(item))
+    return refs
+
+
+def _search_content(refs: Sequence[DocumentRef]) -> str:
+    listing = "\n".join(
+        ref.id if ref.score is None else f"{ref.id} (relevance {ref.score:.2f})"
+        for ref in refs
+    )
+    return f"Retrieved {len(refs)} chunks:\n{listing}" if refs else ""
+
+
+def search_result(documents: Sequence[Document]) -> Tuple[str, List[DocumentRef]]:
+    """
+    Content and artifact of a retriever ToolMessage. The content only lists the chunk
+    references: the text is rendered into the prompts from the state instead.
+    """
+    refs = document_refs(documents)
+    return _search_content(refs), refs
+
+
+def _compacted(message: ToolMessage) -> Optional[ToolMessage]:
+    if message.artifact is None:
+        # The tool used to return the joined chunk text as content, with no artifact.
+        # Nothing reads the tool output of earlier turns, so a stub replaces it
+        if message.name != RETRIEVER_TOOL_NAME:
+            return None
+        return message.model_copy(
+            update={"content": OMITTED_SEARCH_CONTENT, "artifact": []}
+        )
+    if not isinstance(message.artifact, list):
+        return None
+    if not any(_is_document(item) for item in message.artifact):
+        return None
+    refs = as_document_refs(message.artifact)
+    return message.model_copy(
+        update={"content": _search_content(refs), "artifact": refs}
+    )
+
+
+def compact_tool_messages(messages: Sequence[BaseMessage]) -> List[ToolMessage]:
+    """
+    Compacted replacements, with the same ids, for the retriever ToolMessages of older
+    threads that still hold the chunk text. Returned as a state update, they shrink
+    the checkpoints of the thread from its next step on.
+    """
+    compacted: List[ToolMessage] = []
+    for message in messages:
+        if not isinstance(message, ToolMessage) or not message.id:
+            continue
+        replacement = _compacted(message)
+        if replacement is not None:
+            compacted.append(replacement)
+    return compacted
+
+
+def resolve_chunks(refs: Sequence[DocumentRef]) -> List[Tuple[DocumentRef, str]]:
+    """
+    Look up the text of the referenced chunks in the chunk cache, then in the vector
+    stores of the corpus shards. Chunks deleted from the corpus since they were
+    retrieved are skipped.
+    """
+    cache = get_chunk_cache()
+    found = cache.get_many(ref.id for ref in refs if ref.text is None)
+
+    missing = list(
+        dict.fromkeys(
+            ref.id for ref in refs if ref.text is None and ref.id not in found
+        )
+    )
+    if missing:
+        # Chunk ids are content hashes, unique across the shards of the corpus
+        fetched: Dict[str, str] = {}
+        for vector_store in _vector_stores():
+            remaining = [id for id in missing if id not in fetched]
+            if not remaining:
+                break
+            fetched.update(
+                (document.id, document.page_content)
+                for document in vector_store.get_by_ids(remaining)
+            )
+        cache.put_many(fetched)
+        found.update(fetched)
+        if len(fetched) < len(missing):
+            logger.warning(
+                "%d referenced chunks no longer exist", len(missing) - len(fetched)
+            )
+
+    chunks: List[Tuple[DocumentRef, str]] = []
+    for ref in refs:
+        text = ref.text if ref.text is not None else found.get(ref.id)
+        if text is not None:
+            chunks.append((ref, text))
+    return chunks
+
+
+def render_documents(refs: Sequence[DocumentRef]) -> Optional[str]:
+    """
+    Resolve the references into the chunk string the prompts are rendered with.
+    """
+    if not refs:
+        return None
+    return join_documents([text for _, text in resolve_chunks(refs)])
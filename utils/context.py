@@ -0,0 +1,101 @@
+import os
+from typing import List, Optional, Sequence
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from utils.tokens import CHARS_PER_TOKEN, estimate_tokens
+
+# Token budgets of the chat history and of the documents rendered into the prompts
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+DOCUMENTS_TOKEN_BUDGET = int(os.getenv("DOCUMENTS_TOKEN_BUDGET", "3000"))
+REPHRASE_DOCUMENTS_TOKEN_BUDGET = int(
+    os.getenv("REPHRASE_DOCUMENTS_TOKEN_BUDGET", "1000")
+)
+
+# Separator between the chunks of the documents rendered into the prompts
+DOCUMENT_SEPARATOR = "\n\n---\n\n"
+
+
+def _render_message(message: BaseMessage) -> Optional[str]:
+    """
+    Render a message as a transcript line. Tool calls and tool results are dropped,
+    since the retrieved documents are passed to the prompts separately.
+    """
+    if isinstance(message, HumanMessage):
+        role = "User"
+    elif isinstance(message, AIMessage):
+        role = "Assistant"
+    else:
+        return None
+
+    text = message.text().strip()
+    if not text:
+        return None
+    return f"{role}: {text}"
+
+
+def render_transcript(messages: Sequence[BaseMessage]) -> List[str]:
+    """
+    Render messages as transcript lines, without tool payloads and repeated lines.
+    """
+    lines: List[str] = []
+    for message in messages:
+        line = _render_message(message)
+        if line is not None and (not lines or lines[-1] != line):
+            lines.append(line)
+    return lines
+
+
+def pack_history(
+    messages: Sequence[BaseMessage],
+    summary: Optional[str] = None,
+    token_budget: int = HISTORY_TOKEN_BUDGET,
+) -> str:
+    """
+    Pack the chat history into a compact transcript: the summary of the older turns
+    followed by as many of the most recent lines as fit in the token budget.
+    """
+    lines = render_transcript(messages)
+
+    kept: List[str] = []
+    tokens = estimate_tokens(summary) if summary else 0
+    for line in reversed(lines):
+        tokens += estimate_tokens(line)
+        if kept and tokens > token_budget:
+            break
+        kept.append(line)
+    kept.reverse()
+
+    if summary:
+        kept.insert(0, f"Summary of the earlier conversation: {summary}")
+    return "\n\n".join(kept)
+
+
+def join_documents(chunks: Sequence[str]) -> Optional[str]:
+    """
+    Join chunks into the documents string of the prompts, dropping repeated chunks.
+    """
+    unique_chunks = list(dict.fromkeys(chunk.strip() for chunk in chunks))
+    return DOCUMENT_SEPARATOR.join(chunk for chunk in unique_chunks if chunk) or None
+
+
+def pack_documents(
+    documents: Optional[str], token_budget: int = DOCUMENTS_TOKEN_BUDGET
+) -> Optional[str]:
+    """
+    Keep the leading chunks of `documents` that fit in the token budget. The first
+    chunk is always kept, truncated if it does not fit on its own.
+    """
+    if not documents:
+        return documents
+
+    kept: List[str] = []
+    tokens = 0
+    for chunk in documents.split(DOCUMENT_SEPARATOR):
+        tokens += estimate_tokens(chunk)
+        if tokens > token_budget:
+            if not kept:
+                kept.append(chunk[: token_budget * CHARS_PER_TOKEN])
+            break
+        kept.append(chunk)
+    return DOCUMENT_SEPARATOR.join(kept)
@@ -0,0 +1,28 @@
+import os
+import uuid
+
+# Stamp that changes whenever ingestion adds or removes chunks, shared by all processes
+CORPUS_VERSION_PATH = ".corpus_version"
+
+
+def get_corpus_version() -> str:
+    """
+    Return the current corpus version, or an empty string if nothing was ingested yet.
+    """
+    try:
+        with open(CORPUS_VERSION_PATH, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
+
+
+def bump_corpus_version() -> str:
+    """
+    Mark the corpus as changed, invalidating everything cached against the old version.
+    """
+    version = uuid.uuid4().hex
+    tmp_path = CORPUS_VERSION_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, CORPUS_VERSION_PATH)
+    return version
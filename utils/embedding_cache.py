@@ -0,0 +1,312 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from utils.metrics import CacheStats, get_metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: the cache is then only safe within one process
+    fcntl = None
+
+# Directory for the persistent embedding cache
+CACHE_DIRECTORY = ".embedding_cache"
+
+# Upper bound for the vector file of a single model, evicted down to the low watermark
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+EVICTION_LOW_WATERMARK = 0.8
+
+# Recent query embeddings kept in memory, so the nodes embedding the same question
+# and the batches embedding their questions up front do not call the model again
+QUERY_EMBEDDING_MEMO_SIZE = int(os.getenv("QUERY_EMBEDDING_MEMO_SIZE", "1024"))
+
+
+def cache_key(model_id: str, text: str) -> str:
+    """
+    Content-addressed key for an embedding: the model id plus a hash of the text.
+    """
+    return hashlib.sha256(f"{model_id}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    On-disk store of float32 embedding vectors for a single model.
+
+    Vectors are appended row by row to `vectors.f32`, which is read through a
+    memory map. `index.json` maps each key to its row and last-use timestamp,
+    and is used to evict the least recently used rows once the vector file
+    grows beyond `max_bytes`.
+
+    Several processes can share the directory: writers hold an exclusive lock on
+    `lock` while appending and rewriting the index, readers a shared one, and every
+    process reloads the index when another one has rewritten it.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = MAX_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.index_path = os.path.join(directory, "index.json")
+        self.lock_path = os.path.join(directory, "lock")
+        self._lock = threading.Lock()
+        self._memmap: Optional[np.memmap] = None
+
+        os.makedirs(directory, exist_ok=True)
+        with self._file_lock(exclusive=False):
+            self._load_index()
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _index_version(self) -> Optional[int]:
+        try:
+            return os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load_index(self):
+        self._index_loaded = self._index_version()
+        self._dim, self._rows = self._read_index()
+        self._memmap = None
+
+    def _refresh_index(self):
+        # Called with the file lock held
+        if self._index_version() != self._index_loaded:
+            self._load_index()
+
+    def _read_index(self) -> Tuple[Optional[int], Dict[str, List[float]]]:
+        if not os.path.exists(self.index_path):
+            return None, {}
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+
+        dim, rows = index["dim"], index["rows"]
+        # Drop the cache if the vector file does not match the index (e.g. interrupted write)
+        expected_size = len(rows) * (dim or 0) * 4
+        if not os.path.exists(self.vectors_path) or (
+            os.path.getsize(self.vectors_path) != expected_size
+        ):
+            return None, {}
+        return dim, rows
+
+    def _write_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self._dim, "rows": self._rows}, f)
+        os.replace(tmp_path, self.index_path)
+        self._index_loaded = self._index_version()
+
+    def _vectors(self) -> np.memmap:
+        row_count = len(self._rows)
+        if self._memmap is None or self._memmap.shape[0] != row_count:
+            self._memmap = np.memmap(
+                self.vectors_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(row_count, self._dim),
+            )
+        return self._memmap
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """
+        Return the cached vectors for the given keys, skipping keys that are not cached.
+        """
+        with self._lock, self._file_lock(exclusive=False):
+            self._refresh_index()
+            hits = [key for key in keys if key in self._rows]
+            if not hits:
+                return {}
+
+            vectors = self._vectors()
+            now = time.time()
+            found = {}
+            for key in hits:
+                entry = self._rows[key]
+                entry[1] = now
+                found[key] = vectors[int(entry[0])].tolist()
+            return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        """
+        Append new vectors to the cache and evict old ones if the cache grew too large.
+        """
+        with self._lock, self._file_lock(exclusive=True):
+            self._refresh_index()
+            items = {
+                key: vector for key, vector in items.items() if key not in self._rows
+            }
+            if not items:
+                return
+
+            array = np.asarray(list(items.values()), dtype=np.float32)
+            if self._dim is None:
+                self._dim = array.shape[1]
+            elif array.shape[1] != self._dim:
+                raise ValueError(
+                    f"Embedding dimension {array.shape[1]} does not match cache dimension {self._dim}"
+                )
+
+            row_bytes = self._dim * 4
+            with open(self.vectors_path, "ab") as f:
+                # Rows appended without their index entry, by a write that failed
+                # before the index was saved, are overwritten
+                f.truncate(len(self._rows) * row_bytes)
+                f.seek(0, os.SEEK_END)
+                first_row = f.tell() // row_bytes
+                f.write(array.tobytes())
+
+            now = time.time()
+            for offset, key in enumerate(items):
+                self._rows[key] = [first_row + offset, now]
+
+            if len(self._rows) * self._dim * 4 > self.max_bytes:
+                self._evict()
+
+            self._write_index()
+
+    def _evict(self):
+        """
+        Keep the most recently used rows up to the low watermark and compact the vector file.
+        """
+        max_rows = int(self.max_bytes * EVICTION_LOW_WATERMARK) // (self._dim * 4)
+        keep = sorted(self._rows.items(), key=lambda item: item[1][1], reverse=True)
+        keep = keep[:max_rows]
+
+        vectors = self._vectors()
+        compacted = np.asarray(
+            [vectors[int(entry[0])] for _, entry in keep], dtype=np.float32
+        ).reshape(-1, self._dim)
+
+        tmp_path = self.vectors_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(compacted.tobytes())
+        self._memmap = None
+        os.replace(tmp_path, self.vectors_path)
+
+        self._rows = {key: [row, entry[1]] for row, (key, entry) in enumerate(keep)}
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves document embeddings from a persistent EmbeddingCache,
+    so only texts that were never embedded before are sent to the underlying model.
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        model_id: str,
+        cache_directory: str = CACHE_DIRECTORY,
+        max_bytes: int = MAX_CACHE_BYTES,
+    ):
+        self.underlying = underlying
+        self.model_id = model_id
+        model_directory = os.path.join(
+            cache_directory, model_id.replace(":", "_").replace("/", "_")
+        )
+        self.cache = EmbeddingCache(model_directory, max_bytes=max_bytes)
+        self.stats = CacheStats()
+        get_metrics().register_cache("embedding", self.stats)
+
+        self._query_lock = threading.Lock()
+        self._query_vectors: OrderedDict[str, List[float]] = OrderedDict()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [cache_key(self.model_id, text) for text in texts]
+        found = self.cache.get_many(keys)
+        for key in keys:
+            self.stats.record(key in found)
+
+        # Embed each missing text only once, even if it occurs several times in the batch
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            new_items = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(new_items)
+            found.update(new_items)
+
+        return [found[key] for key in keys]
+
+    def _remember_queries(self, vectors: Dict[str, List[float]]):
+        with self._query_lock:
+            for text, vector in vectors.items():
+                self._query_vectors[text] = vector
+                self._query_vectors.move_to_end(text)
+            while len(self._query_vectors) > QUERY_EMBEDDING_MEMO_SIZE:
+                self._query_vectors.popitem(last=False)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._query_lock:
+            vector = self._query_vectors.get(text)
+        if vector is None:
+            vector = self.underlying.embed_query(text)
+            self._remember_queries({text: vector})
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed several queries in as few model calls as possible, remembering them for
+        the `embed_query` calls that follow.
+        """
+        with self._query_lock:
+            found = {
+                text: self._query_vectors[text]
+                for text in texts
+                if text in self._query_vectors
+            }
+        missing = [text for text in dict.fromkeys(texts) if text not in found]
+        if missing:
+            vectors = dict(zip(missing, embed_query_batch(self.underlying, missing)))
+            self._remember_queries(vectors)
+            found.update(vectors)
+        return [found[text] for text in texts]
+
+
+def embed_query_batch(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """
+    Embed queries in batches. The Cohere models on Bedrock embed a query differently
+    from a document, and `BedrockEmbeddings.embed_documents` always embeds documents,
+    so query batches are sent to the model directly.
+    """
+    if getattr(embeddings, "_inferred_provider", None) != "cohere":
+        return [embeddings.embed_query(text) for text in texts]
+
+    from langchain_aws.embeddings.bedrock import _batch_cohere_embedding_texts
+
+    cleaned = [text.replace(os.linesep, " ") for text in texts]
+    try:
+        batches = list(_batch_cohere_embedding_texts(cleaned))
+    except ValueError:
+        # Queries longer than a Cohere batch allows are embedded one by one
+        return [embeddings.embed_query(text) for text in texts]
+
+    vectors: List[List[float]] = []
+    for batch in batches:
+        response = embeddings._invoke_model(
+            input_body={"input_type": "search_query", "texts": batch}
+        )
+        vectors.extend(response["embeddings"])
+    if embeddings.normalize:
+        vectors = [embeddings._normalize_vector(vector) for vector in vectors]
+    return vectors
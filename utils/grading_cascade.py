@@ -0,0 +1,164 @@
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from pydantic import BaseModel
+
+from utils.context import DOCUMENT_SEPARATOR
+from utils.lexical_index import tokenize
+
+# Grade answers on local signals first, and only ask the LLM graders when unsure. Off
+# by default: enable it once `benchmarks/calibrate_grading.py` has written thresholds
+# for the corpus
+GRADE_ANSWER_CASCADE = os.getenv("GRADE_ANSWER_CASCADE", "false").lower() == "true"
+
+# Thresholds written by `benchmarks/calibrate_grading.py`
+GRADING_THRESHOLDS_PATH = os.getenv(
+    "GRADING_THRESHOLDS_PATH", "resources/grading_thresholds.json"
+)
+
+# Used until the thresholds are calibrated: accept only very clear cases and never
+# reject locally
+DEFAULT_THRESHOLDS: Dict[str, Dict[str, Dict[str, float]]] = {
+    "grounded": {
+        "grounding_similarity": {"accept": 0.8, "reject": -1.0},
+        "lexical_overlap": {"accept": 0.8, "reject": -1.0},
+    },
+    "resolves_question": {
+        "question_similarity": {"accept": 0.7, "reject": -1.0},
+    },
+}
+
+_SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n+")
+
+# Only a short answer that opens with a refusal is a refusal: a long answer that
+# mentions not knowing one detail still makes claims the graders must check
+_DONT_KNOW_PATTERN = re.compile(
+    r"^\W*(?:sorry,?\s*)?(i don'?t know|i do not know|i'?m not sure|i am not sure|"
+    r"i (?:can'?t|cannot) answer|(?:there is |i have )?no information (?:about|on))\b",
+    re.IGNORECASE,
+)
+
+_DONT_KNOW_MAX_WORDS = 30
+
+# Sentences shorter than this carry too little content to compare
+_MIN_SENTENCE_TOKENS = 3
+
+
+class GradingSignals(BaseModel):
+    dont_know: bool
+    grounding_similarity: Optional[float] = None
+    lexical_overlap: Optional[float] = None
+    question_similarity: Optional[float] = None
+
+
+def split_sentences(text: str) -> List[str]:
+    return [
+        sentence.strip()
+        for sentence in _SENTENCE_PATTERN.split(text)
+        if len(tokenize(sentence)) >= _MIN_SENTENCE_TOKENS
+    ]
+
+
+def is_dont_know(answer: str) -> bool:
+    return len(answer.split()) <= _DONT_KNOW_MAX_WORDS and bool(
+        _DONT_KNOW_PATTERN.search(answer)
+    )
+
+
+def lexical_overlap(answer: str, chunks: List[str]) -> float:
+    """
+    Share of the answer's content words that occur in the retrieved chunks.
+    """
+    answer_terms = set(tokenize(answer))
+    if not answer_terms:
+        return 0.0
+    chunk_terms = set(tokenize(" ".join(chunks)))
+    return len(answer_terms & chunk_terms) / len(answer_terms)
+
+
+def _normalized(vectors: List[List[float]]) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def compute_signals(
+    question: Optional[str],
+    answer: str,
+    documents: Optional[str],
+    embeddings: Embeddings,
+) -> GradingSignals:
+    """
+    Compute the local grading signals. Chunk embeddings come from the embedding cache
+    filled at ingestion. Answer sentences are embedded by the underlying model, as they
+    are rarely seen twice and would only fill the persistent cache, and the question
+    comes from the in-memory query embeddings.
+    """
+    signals = GradingSignals(dont_know=is_dont_know(answer))
+    sentences = split_sentences(answer)
+    if not sentences:
+        return signals
+
+    chunks = documents.split(DOCUMENT_SEPARATOR) if documents else []
+    model = getattr(embeddings, "underlying", embeddings)
+    sentence_vectors = _normalized(model.embed_documents(sentences))
+
+    if chunks:
+        chunk_vectors = _normalized(embeddings.embed_documents(chunks))
+        # Every sentence should be close to at least one chunk
+        similarities = sentence_vectors @ chunk_vectors.T
+        signals.grounding_similarity = float(similarities.max(axis=1).mean())
+        signals.lexical_overlap = lexical_overlap(answer, chunks)
+
+    if question:
+        question_vector = _normalized([embeddings.embed_query(question)])[0]
+        signals.question_similarity = float((sentence_vectors @ question_vector).max())
+
+    return signals
+
+
+def _band(
+    values: Dict[str, Optional[float]], thresholds: Dict[str, Dict[str, float]]
+) -> Optional[bool]:
+    """
+    True when every signal clears its accept threshold, False when every signal is at
+    or below its reject threshold, None when the signals are missing or uncertain.
+    """
+    if any(values.get(name) is None for name in thresholds):
+        return None
+    if all(values[name] >= band["accept"] for name, band in thresholds.items()):
+        return True
+    if all(values[name] <= band["reject"] for name, band in thresholds.items()):
+        return False
+    return None
+
+
+def local_verdicts(
+    signals: GradingSignals, thresholds: Dict[str, Any]
+) -> Tuple[Optional[bool], Optional[bool]]:
+    """
+    Return the (grounded, resolves_question) verdicts the signals settle, None for the
+    ones left to the LLM graders.
+    """
+    # The graders accept an answer that admits not knowing, see their prompts
+    if signals.dont_know:
+        return True, True
+
+    values = signals.model_dump()
+    return (
+        _band(values, thresholds["grounded"]),
+        _band(values, thresholds["resolves_question"]),
+    )
+
+
+@lru_cache
+def load_thresholds() -> Dict[str, Any]:
+    if not os.path.exists(GRADING_THRESHOLDS_PATH):
+        return DEFAULT_THRESHOLDS
+    with open(GRADING_THRESHOLDS_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
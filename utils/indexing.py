@@ -0,0 +1,110 @@
+import hashlib
+import os
+from itertools import batched
+from typing import Callable, Iterable, List, Optional, Set
+
+from pydantic import BaseModel
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+# Number of chunks checked against and written to the vector store at once
+INDEX_BATCH_SIZE = 64
+
+
+class IndexingResult(BaseModel):
+    """
+    Summary of an incremental indexing run.
+    """
+
+    added: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+
+
+def _sha256(*parts: str) -> str:
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+def page_fingerprint(page: Document) -> str:
+    """
+    Fingerprint of a source page, used to trace which version of a page a chunk came from.
+    """
+    return _sha256(
+        str(page.metadata.get("source", "")),
+        str(page.metadata.get("page", "")),
+        page.page_content,
+    )
+
+
+def chunk_id(chunk: Document) -> str:
+    """
+    Stable id of a chunk, derived from its source and its content.
+    """
+    return _sha256(str(chunk.metadata.get("source", "")), chunk.page_content)
+
+
+def index_documents(
+    vector_store: VectorStore,
+    chunks: Iterable[Document],
+    batch_size: int = INDEX_BATCH_SIZE,
+    in_scope: Optional[Callable[[str], bool]] = None,
+) -> IndexingResult:
+    """
+    Bring the vector store in sync with the given chunks.
+
+    Chunks already present (by content-hash id) are left untouched, new chunks are
+    embedded and added, and chunks of the indexed sources that are no longer produced
+    are deleted. `in_scope` can widen the set of sources whose stale chunks are deleted,
+    e.g. to include files that were removed from an ingested directory. Chunks without
+    a `source` metadata entry predate incremental indexing and are deleted as well,
+    since they cannot be matched against their source.
+    """
+    result = IndexingResult()
+    wanted_ids: Set[str] = set()
+    sources: Set[str] = set()
+
+    for batch in batched(chunks, batch_size):
+        new_chunks: List[Document] = []
+        for chunk in batch:
+            chunk.id = chunk_id(chunk)
+            if chunk.id in wanted_ids:
+                continue
+            wanted_ids.add(chunk.id)
+            sources.add(chunk.metadata.get("source"))
+            new_chunks.append(chunk)
+
+        if not new_chunks:
+            continue
+
+        existing_ids = set(
+            vector_store.get(ids=[chunk.id for chunk in new_chunks], include=[])["ids"]
+        )
+        new_chunks = [chunk for chunk in new_chunks if chunk.id not in existing_ids]
+        result.unchanged += len(existing_ids)
+
+        if new_chunks:
+            vector_store.add_documents(
+                new_chunks, ids=[chunk.id for chunk in new_chunks]
+            )
+            result.added += len(new_chunks)
+
+    # Chunks stored under another spelling of a source path, e.g. relative to an
+    # earlier working directory, are matched by their canonical path
+    sources = {os.path.realpath(source) for source in sources if source}
+    stored = vector_store.get(include=["metadatas"])
+    stale_ids = [
+        id
+        for id, metadata in zip(stored["ids"], stored["metadatas"])
+        if id not in wanted_ids
+        and (
+            not metadata
+            or "source" not in metadata
+            or os.path.realpath(metadata["source"]) in sources
+            or (in_scope is not None and in_scope(os.path.realpath(metadata["source"])))
+        )
+    ]
+    if stale_ids:
+        vector_store.delete(ids=stale_ids)
+        result.deleted = len(stale_ids)
+
+    return result
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from pypdf import PdfReader
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from utils.indexing import (
+    INDEX_BATCH_SIZE,
+    IndexingResult,
+    index_documents,
+    page_fingerprint,
+)
+
+# Directory for the extracted page text, keyed by the hash of the PDF file
+PARSED_TEXT_CACHE_DIRECTORY = ".ingest_cache"
+
+# Pages extracted per worker task, and the number of tasks kept in flight per worker
+PAGES_PER_TASK = 8
+TASKS_PER_WORKER = 2
+
+text_splitter = RecursiveCharacterTextSplitter(
+    # Set a really small chunk size, just to show.
+    chunk_size=2048,
+    chunk_overlap=200,
+    length_function=len,
+    is_separator_regex=False,
+)
+
+
+def iter_pdf_paths(paths: Union[str, Sequence[str]]) -> Iterator[str]:
+    """
+    Expand a list of PDF files and directories into canonical PDF file paths.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+
+    for path in paths:
+        path = os.path.realpath(path)
+        if os.path.isdir(path):
+            for root, _, file_names in sorted(os.walk(path)):
+                for file_name in sorted(file_names):
+                    if file_name.lower().endswith(".pdf"):
+                        yield os.path.realpath(os.path.join(root, file_name))
+        else:
+            yield path
+
+
+def file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _page_count(file_path: str) -> int:
+    return len(PdfReader(file_path).pages)
+
+
+def _extract_page_range(file_path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    """
+    Extract the text of a range of pages. Runs in a worker process.
+    """
+    reader = PdfReader(file_path)
+    return [
+        (number, reader.pages[number].extract_text()) for number in range(start, stop)
+    ]
+
+
+def _extract_pages(
+    executor: ProcessPoolExecutor, file_path: str, max_pending: int
+) -> Iterator[Tuple[int, str]]:
+    """
+    Extract the pages of a PDF in the worker pool and yield them as they complete,
+    keeping at most `max_pending` tasks in flight.
+    """
+    page_count = executor.submit(_page_count, file_path).result()
+    page_ranges = (
+        (start, min(start + PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PAGES_PER_TASK)
+    )
+
+    pending = set()
+    for start, stop in page_ranges:
+        pending.add(executor.submit(_extract_page_range, file_path, start, stop))
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+    for future in pending:
+        yield from future.result()
+
+
+def _iter_cached_pages(cache_path: str) -> Iterator[Tuple[int, str]]:
+    with open(cache_path, "r", encoding="utf-8") as f:
+        for line in f:
+            page = json.loads(line)
+            yield page["page"], page["text"]
+
+
+def iter_pages(
+    paths: Union[str, Sequence[str]], max_workers: Optional[int] = None
+) -> Iterator[Document]:
+    """
+    Stream the pages of all PDFs as documents, extracting them in a process pool.
+
+    Extracted text is cached per file hash, so unchanged PDFs are not parsed again.
+    Workers are spawned rather than forked, since the lazy ingest runs inside the
+    threaded LangGraph server where forking could copy locks held by other threads.
+    """
+    os.makedirs(PARSED_TEXT_CACHE_DIRECTORY, exist_ok=True)
+    max_workers = max_workers or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        for file_path in iter_pdf_paths(paths):
+            cache_path = os.path.join(
+                PARSED_TEXT_CACHE_DIRECTORY, f"{file_hash(file_path)}.jsonl"
+            )
+
+            if os.path.exists(cache_path):
+                print(f"Loading cached pages of {file_path}")
+                for number, text in _iter_cached_pages(cache_path):
+                    yield Document(
+                        page_content=text,
+                        metadata={"source": file_path, "page": number},
+                    )
+                continue
+
+            print(f"Extracting pages of {file_path}")
+            tmp_path = cache_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as cache_file:
+                pages = _extract_pages(
+                    executor, file_path, max_pending=max_workers * TASKS_PER_WORKER
+                )
+                for number, text in pages:
+                    cache_file.write(json.dumps({"page": number, "text": text}) + "\n")
+                    yield Document(
+                        page_content=text,
+                        metadata={"source": file_path, "page": number},
+                    )
+            os.replace(tmp_path, cache_path)
+
+
+def iter_chunks(pages: Iterable[Document]) -> Iterator[Document]:
+    """
+    Split pages into chunks as they arrive. Chunks keep the metadata of their page.
+    """
+    for page in pages:
+        page.metadata["page_fingerprint"] = page_fingerprint(page)
+        yield from text_splitter.split_documents([page])
+
+
+def ingest(
+    vector_store: VectorStore,
+    paths: Union[str, Sequence[str]],
+    max_workers: Optional[int] = None,
+    batch_size: int = INDEX_BATCH_SIZE,
+) -> IndexingResult:
+    """
+    Stream PDFs through extraction, chunking and incremental indexing.
+
+    Only a bounded number of pages and one batch of chunks are held in memory at a time.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    # Sources are stored as canonical paths, whatever the working directory or the
+    # spelling of the path, so the same file always maps to the same chunk ids
+    paths = [os.path.realpath(path) for path in paths]
+    directories = [os.path.join(path, "") for path in paths if os.path.isdir(path)]
+
+    def in_scope(source: str) -> bool:
+        # Sources below an ingested directory are in scope, so removed files get deleted
+        return source in paths or any(source.startswith(d) for d in directories)
+
+    chunks = iter_chunks(iter_pages(paths, max_workers=max_workers))
+    return index_documents(
+        vector_store, chunks, batch_size=batch_size, in_scope=in_scope
+    )
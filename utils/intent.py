@@ -0,0 +1,104 @@
+import os
+from functools import lru_cache
+from typing import List, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Route clear first-turn music production questions straight to retrieval by embedding
+# similarity, instead of asking the supervisor model
+INTENT_CLASSIFIER = os.getenv("INTENT_CLASSIFIER", "false").lower() == "true"
+
+# Similarity to the closest search example a question needs to be searched directly,
+# and the lead it needs over the closest example of the other intents. The defaults
+# are a conservative guess for Cohere query embeddings, not measured on real traffic:
+# fit them to labelled questions with `benchmarks/calibrate_intent.py`
+INTENT_SEARCH_THRESHOLD = float(os.getenv("INTENT_SEARCH_THRESHOLD", "0.6"))
+INTENT_SEARCH_MARGIN = float(os.getenv("INTENT_SEARCH_MARGIN", "0.1"))
+
+# Questions the supervisor answers with the music production guide
+SEARCH_EXAMPLES = [
+    "How do I start a new track when I have writer's block?",
+    "How can I make my drum programming sound less robotic?",
+    "What is a good way to write a melody over a chord progression?",
+    "How do I stop the kick drum and the bass from clashing in the low end?",
+    "How should I arrange a song so it keeps building tension?",
+    "How do I know when a track is finished?",
+    "How can I use automation to make a loop more interesting?",
+    "Which tempo should I choose for a new song?",
+    "How do I build richer chords than basic triads?",
+    "How can sampling be used creatively in electronic music?",
+    "How do I organize my studio and workflow to be more productive?",
+    "How can randomization help me come up with new ideas?",
+]
+
+# Small talk and off-topic questions, left to the supervisor model
+OTHER_EXAMPLES = [
+    "Hello, how are you?",
+    "Thanks, that was helpful!",
+    "What can you help me with?",
+    "What is the weather like tomorrow?",
+    "Who won the football match yesterday?",
+    "Can you write a Python function that sorts a list?",
+    "What is the capital of France?",
+    "Recommend me a good restaurant nearby.",
+]
+
+
+def _normalized(vectors: List[List[float]]) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+class IntentClassifier:
+    """
+    Nearest-example classifier deciding whether a question should be searched in the
+    guide. It only says so when confident; every other question goes to the model.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        threshold: float = INTENT_SEARCH_THRESHOLD,
+        margin: float = INTENT_SEARCH_MARGIN,
+    ):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.margin = margin
+        # The examples are questions, so they are embedded the same way as the
+        # questions they are compared to
+        examples = SEARCH_EXAMPLES + OTHER_EXAMPLES
+        embed_queries = getattr(embeddings, "embed_queries", None)
+        if embed_queries is not None:
+            vectors = embed_queries(examples)
+        else:
+            vectors = [embeddings.embed_query(example) for example in examples]
+        vectors = _normalized(vectors)
+        self.search_vectors = vectors[: len(SEARCH_EXAMPLES)]
+        self.other_vectors = vectors[len(SEARCH_EXAMPLES) :]
+
+    def similarities(self, question: str) -> Tuple[float, float]:
+        """
+        Similarity of the question to the closest search example, and to the closest
+        example of the other intents.
+        """
+        vector = _normalized([self.embeddings.embed_query(question)])[0]
+        return (
+            float((self.search_vectors @ vector).max()),
+            float((self.other_vectors @ vector).max()),
+        )
+
+    def should_search(self, question: str) -> bool:
+        search_similarity, other_similarity = self.similarities(question)
+        return (
+            search_similarity >= self.threshold
+            and search_similarity - other_similarity >= self.margin
+        )
+
+
+@lru_cache
+def get_intent_classifier() -> IntentClassifier:
+    from utils.aws_bedrock import get_embeddings
+
+    return IntentClassifier(get_embeddings())
@@ -0,0 +1,116 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+# Directory for the persisted BM25 indexes, one file per collection
+LEXICAL_INDEX_DIRECTORY = ".bm25_index"
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:['-][a-z0-9]+)*")
+
+_STOPWORDS = frozenset("""
+    a an and are as at be but by can do does for from how i if in into is it its me my
+    of on or so than that the their them then there these they this to was we what when
+    where which while who why will with you your
+    """.split())
+
+
+def tokenize(text: str) -> List[str]:
+    return [
+        token
+        for token in _TOKEN_PATTERN.findall(text.lower())
+        if token not in _STOPWORDS
+    ]
+
+
+class BM25Index:
+    """
+    In-process Okapi BM25 inverted index over the chunks of a collection.
+    """
+
+    def __init__(
+        self,
+        doc_ids: List[str],
+        doc_lengths: List[int],
+        postings: Dict[str, Dict[int, int]],
+        k1: float = 1.5,
+        b: float = 0.75,
+    ):
+        self.doc_ids = doc_ids
+        self.doc_lengths = doc_lengths
+        self.postings = postings
+        self.k1 = k1
+        self.b = b
+        self.avg_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0
+
+    @classmethod
+    def build(cls, ids: Sequence[str], texts: Sequence[str]) -> "BM25Index":
+        postings: Dict[str, Dict[int, int]] = {}
+        doc_lengths = []
+        for position, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                postings.setdefault(term, {})[position] = frequency
+        return cls(list(ids), doc_lengths, postings)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """
+        Return the ids and BM25 scores of the `k` best matching chunks.
+        """
+        doc_count = len(self.doc_ids)
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(
+                1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5)
+            )
+            for position, frequency in postings.items():
+                length_norm = (
+                    1
+                    - self.b
+                    + self.b * self.doc_lengths[position] / (self.avg_length or 1.0)
+                )
+                scores[position] = scores.get(position, 0.0) + idf * (
+                    frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+                )
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.doc_ids[position], score) for position, score in best]
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "doc_ids": self.doc_ids,
+                    "doc_lengths": self.doc_lengths,
+                    "postings": self.postings,
+                    "k1": self.k1,
+                    "b": self.b,
+                },
+                f,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        # JSON object keys are strings, positions are ints
+        postings = {
+            term: {int(position): frequency for position, frequency in docs.items()}
+            for term, docs in data["postings"].items()
+        }
+        return cls(
+            data["doc_ids"], data["doc_lengths"], postings, k1=data["k1"], b=data["b"]
+        )
+
+
+def lexical_index_path(collection_name: str) -> str:
+    return os.path.join(LEXICAL_INDEX_DIRECTORY, f"{collection_name}.json")
@@ -0,0 +1,93 @@
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Optional, Tuple
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_community.cache import SQLiteCache
+
+from utils.metrics import CacheStats, get_metrics
+
+# Store for the deterministic grader and rephrase calls: "memory", "sqlite" or "none"
+LLM_CACHE = os.getenv("LLM_CACHE", "memory").lower()
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2048"))
+LLM_CACHE_DATABASE_PATH = os.getenv("LLM_CACHE_DATABASE_PATH", ".llm_cache.db")
+
+
+class LRUCache(BaseCache):
+    """
+    In-memory LLM cache that evicts the least recently used entries beyond `max_entries`.
+
+    Like every LangChain cache it is keyed by the rendered prompt and the `llm_string`,
+    which covers the model id, its parameters and the bound structured-output schema.
+    """
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Tuple[str, str], RETURN_VAL_TYPE] = OrderedDict()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        with self._lock:
+            return_val = self._entries.get((prompt, llm_string))
+            if return_val is not None:
+                self._entries.move_to_end((prompt, llm_string))
+        self.stats.record(return_val is not None)
+        return return_val
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        with self._lock:
+            self._entries[(prompt, llm_string)] = return_val
+            self._entries.move_to_end((prompt, llm_string))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    async def alookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        return self.lookup(prompt, llm_string)
+
+    async def aupdate(
+        self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE
+    ) -> None:
+        self.update(prompt, llm_string, return_val)
+
+    async def aclear(self, **kwargs: Any) -> None:
+        self.clear()
+
+
+class CountingSQLiteCache(SQLiteCache):
+    """
+    Persistent SQLite LLM cache with hit and miss counters.
+    """
+
+    def __init__(self, database_path: str = LLM_CACHE_DATABASE_PATH):
+        super().__init__(database_path=database_path)
+        self.stats = CacheStats()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        return_val = super().lookup(prompt, llm_string)
+        self.stats.record(return_val is not None)
+        return return_val
+
+
+@lru_cache
+def get_llm_cache() -> Optional[BaseCache]:
+    """
+    Return the configured LLM cache, or None when caching is disabled.
+    """
+    if LLM_CACHE == "none":
+        return None
+    if LLM_CACHE == "memory":
+        cache = LRUCache()
+    elif LLM_CACHE == "sqlite":
+        cache = CountingSQLiteCache()
+    else:
+        raise ValueError(f"Unknown LLM_CACHE store: {LLM_CACHE!r}")
+
+    get_metrics().register_cache("llm", cache.stats)
+    return cache
@@ -0,0 +1,414 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.rate_limiters import InMemoryRateLimiter
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Upper bounds of the histogram buckets: latencies in seconds, loop counts and
+# relevance scores
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 6, 8)
+SCORE_BUCKETS = (0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8, 1)
+
+NODE_SECONDS = "agentic_rag_node_seconds"
+LLM_CALL_SECONDS = "agentic_rag_llm_call_seconds"
+LLM_CALLS = "agentic_rag_llm_calls_total"
+LLM_TOKENS = "agentic_rag_llm_tokens_total"
+REQUEST_LOOPS = "agentic_rag_request_loops"
+RETRIEVAL_SECONDS = "agentic_rag_retrieval_seconds"
+RERANK_KEPT_CHUNKS = "agentic_rag_rerank_kept_chunks"
+RERANK_CUT_SCORE = "agentic_rag_rerank_cut_score"
+RATE_LIMITER_WAIT_SECONDS = "agentic_rag_rate_limiter_wait_seconds"
+RATE_LIMITER_THROTTLES = "agentic_rag_rate_limiter_throttles_total"
+GRADING_DECISIONS = "agentic_rag_grading_decisions_total"
+SUPERVISOR_ROUTES = "agentic_rag_supervisor_routes_total"
+SPECULATIVE_GENERATIONS = "agentic_rag_speculative_generations_total"
+SPECULATIVE_WASTED_TOKENS = "agentic_rag_speculative_wasted_tokens_total"
+CACHE_HITS = "agentic_rag_cache_hits_total"
+CACHE_MISSES = "agentic_rag_cache_misses_total"
+CACHE_HIT_RATIO = "agentic_rag_cache_hit_ratio"
+
+_HELP = {
+    NODE_SECONDS: "Latency of the graph nodes and of the answer grading edge.",
+    LLM_CALL_SECONDS: "Latency of the chat model calls per call site.",
+    LLM_CALLS: "Chat model calls per call site, by whether the LLM cache answered them.",
+    LLM_TOKENS: "Input and output tokens of the chat model calls per call site.",
+    REQUEST_LOOPS: "Rephrase loops per answered request.",
+    RETRIEVAL_SECONDS: "Latency of the retrieval stages.",
+    RERANK_KEPT_CHUNKS: "Reranked chunks kept per search, by what ended the list.",
+    RERANK_CUT_SCORE: "Relevance score of the first reranked chunk left out.",
+    RATE_LIMITER_WAIT_SECONDS: "Time spent waiting on the Bedrock rate limiter.",
+    RATE_LIMITER_THROTTLES: "Bedrock throttling events that slowed the rate limiter.",
+    GRADING_DECISIONS: "Answer grading verdicts per grader, by local signals or LLM.",
+    SUPERVISOR_ROUTES: "First-turn questions routed by the intent classifier or the model.",
+    SPECULATIVE_GENERATIONS: "Answers generated during document grading, by outcome.",
+    SPECULATIVE_WASTED_TOKENS: "Tokens of the speculative answers that were discarded.",
+    CACHE_HITS: "Cache hits per cache.",
+    CACHE_MISSES: "Cache misses per cache.",
+    CACHE_HIT_RATIO: "Hit ratio per cache.",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in pairs
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+class CacheStats:
+    """
+    Thread-safe hit and miss counters of a cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class Histogram:
+    """
+    Histogram with fixed bucket upper bounds, as exported to Prometheus.
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        # One count per bucket, plus the +Inf bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate a quantile as the upper bound of the bucket it falls in, or as the
+        largest observation beyond the last bucket.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class MetricsRegistry:
+    """
+    In-process registry of counters and histograms, exportable in the Prometheus text
+    format and as a JSON snapshot. Cache hit ratios are read from the registered
+    `CacheStats` at export time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._caches: Dict[str, CacheStats] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any):
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        **labels: Any,
+    ):
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: Any):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def register_cache(self, name: str, stats: CacheStats):
+        with self._lock:
+            self._caches[name] = stats
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def _cache_series(self) -> Dict[str, Dict[Labels, float]]:
+        series: Dict[str, Dict[Labels, float]] = {
+            CACHE_HITS: {},
+            CACHE_MISSES: {},
+            CACHE_HIT_RATIO: {},
+        }
+        for name, stats in self._caches.items():
+            key = _labels({"cache": name})
+            series[CACHE_HITS][key] = stats.hits
+            series[CACHE_MISSES][key] = stats.misses
+            series[CACHE_HIT_RATIO][key] = stats.hit_ratio
+        return series
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Return all metrics as JSON-serializable data, with p50/p95/p99 estimates for
+        the histograms.
+        """
+        with self._lock:
+            counters = {**self._counters, **self._cache_series()}
+            snapshot: Dict[str, Any] = {
+                name: [
+                    {"labels": dict(labels), "value": value}
+                    for labels, value in series.items()
+                ]
+                for name, series in counters.items()
+                if series
+            }
+            for name, series in self._histograms.items():
+                snapshot[name] = [
+                    {
+                        "labels": dict(labels),
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "p50": histogram.quantile(0.5),
+                        "p95": histogram.quantile(0.95),
+                        "p99": histogram.quantile(0.99),
+                    }
+                    for labels, histogram in series.items()
+                ]
+        return snapshot
+
+    def to_prometheus(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format.
+        """
+        lines: List[str] = []
+        with self._lock:
+            cache_series = self._cache_series()
+            for name, series in {**self._counters, **cache_series}.items():
+                if not series:
+                    continue
+                kind = "gauge" if name == CACHE_HIT_RATIO else "counter"
+                lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in series.items():
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+
+            for name, series in self._histograms.items():
+                lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        le = _format_labels(labels, [("le", str(bound))])
+                        lines.append(f"{name}_bucket{le} {cumulative}")
+                    le = _format_labels(labels, [("le", "+Inf")])
+                    lines.append(f"{name}_bucket{le} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(
+                        f"{name}_count{_format_labels(labels)} {histogram.count}"
+                    )
+        return "\n".join(lines) + "\n"
+
+
+class NullMetricsRegistry(MetricsRegistry):
+    """
+    Registry that drops every measurement, used when `METRICS_ENABLED` is off so the
+    instrumented call sites cost nothing and the endpoints serve no series.
+    """
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any):
+        pass
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        **labels: Any,
+    ):
+        pass
+
+    @contextmanager
+    def timer(self, name: str, **labels: Any):
+        yield
+
+    def register_cache(self, name: str, stats: CacheStats):
+        pass
+
+
+@lru_cache
+def get_metrics() -> MetricsRegistry:
+    return MetricsRegistry() if METRICS_ENABLED else NullMetricsRegistry()
+
+
+def instrument_node(name: str, func: Callable) -> Callable:
+    """
+    Wrap a sync or async node function so its latency is recorded under `name`.
+    """
+    if not METRICS_ENABLED:
+        return func
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with get_metrics().timer(NODE_SECONDS, node=name):
+                return await func(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with get_metrics().timer(NODE_SECONDS, node=name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _call_site(metadata: Optional[Dict[str, Any]]) -> str:
+    # An explicit call site wins over the node, for calls made from conditional edges
+    metadata = metadata or {}
+    return metadata.get("call_site") or metadata.get("langgraph_node") or "unknown"
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Records the latency, call count and token usage of chat model calls per call site.
+    """
+
+    # The handler only updates counters, so it is safe to run on the calling thread
+    run_inline = True
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._runs: Dict[UUID, Tuple[str, float]] = {}
+
+    def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages: List[List[Any]],
+        *,
+        run_id: UUID,
+        metadata: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        with self._lock:
+            self._runs[run_id] = (_call_site(metadata), time.perf_counter())
+
+    def _finish(self, run_id: UUID) -> Tuple[str, Optional[float]]:
+        with self._lock:
+            call_site, started = self._runs.pop(run_id, ("unknown", None))
+        return call_site, started
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        call_site, started = self._finish(run_id)
+        if started is not None:
+            self.registry.observe(
+                LLM_CALL_SECONDS, time.perf_counter() - started, call_site=call_site
+            )
+
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(
+                    getattr(generation, "message", None), "usage_metadata", None
+                )
+                # LangChain zeroes the cost of responses served from the LLM cache
+                cached = bool(usage) and usage.get("total_cost") == 0
+                self.registry.inc(
+                    LLM_CALLS, call_site=call_site, cached=str(cached).lower()
+                )
+                if usage and not cached:
+                    self.registry.inc(
+                        LLM_TOKENS,
+                        usage.get("input_tokens", 0),
+                        call_site=call_site,
+                        direction="input",
+                    )
+                    self.registry.inc(
+                        LLM_TOKENS,
+                        usage.get("output_tokens", 0),
+                        call_site=call_site,
+                        direction="output",
+                    )
+
+    def on_llm_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        call_site, _ = self._finish(run_id)
+        self.registry.inc(LLM_CALLS, call_site=call_site, cached="error")
+
+
+@lru_cache
+def get_metrics_callback_handler() -> MetricsCallbackHandler:
+    return MetricsCallbackHandler(get_metrics())
+
+
+class InstrumentedRateLimiter(InMemoryRateLimiter):
+    """
+    `InMemoryRateLimiter` that records how long callers wait for a token.
+    """
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        started = time.perf_counter()
+        acquired = super().acquire(blocking=blocking)
+        get_metrics().observe(RATE_LIMITER_WAIT_SECONDS, time.perf_counter() - started)
+        return acquired
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        started = time.perf_counter()
+        acquired = await super().aacquire(blocking=blocking)
+        get_metrics().observe(RATE_LIMITER_WAIT_SECONDS, time.perf_counter() - started)
+        return acquired
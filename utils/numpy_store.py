@@ -0,0 +1,506 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+# Storage of new vector indexes: "float32", or "int8" for a quarter of the size at a
+# small loss of precision. An existing index keeps the format it was created with.
+VECTOR_STORE_QUANTIZATION = os.getenv("VECTOR_STORE_QUANTIZATION", "float32").lower()
+
+# Rows dequantized at once when scoring an int8 index, bounding the temporary memory
+_SCORING_BLOCK_ROWS = 1024
+
+_DTYPES = {"float32": np.float32, "int8": np.int8}
+
+
+def _content_id(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _normalized(vectors: Sequence[Sequence[float]]) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def quantize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Quantize vectors to int8 with a symmetric scale per row.
+    """
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    codes = np.round(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class _Snapshot(NamedTuple):
+    generation: int
+    ids: List[str]
+    vectors: np.ndarray
+    scales: Optional[np.ndarray]
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    In-process vector index: normalized embeddings in a flat file that is memory-mapped
+    read-only, so searches copy nothing and every process shares the same pages, next
+    to a SQLite table with the ids, texts and metadata of the rows.
+
+    New rows are written in place past the last committed row, so appending never
+    rewrites the file. Deleting compacts the rows into a new file named after the next
+    generation, which the database points to once the renumbered positions commit; the
+    old file is only removed after that. Readers remap when the generation counter in
+    the database has changed.
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        directory: str,
+        quantization: str = VECTOR_STORE_QUANTIZATION,
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self._embedding = embedding
+        self.directory = directory
+
+        # Reentrant, since writes read the table within their transaction
+        self._lock = threading.RLock()
+        # Transactions are managed explicitly, see `_write`
+        self._connection = sqlite3.connect(
+            os.path.join(directory, "metadata.db"),
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                position INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            )
+            """)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)"
+        )
+        self.quantization = self._setting("quantization") or quantization
+        if self.quantization not in _DTYPES:
+            raise ValueError(f"Unknown vector quantization: {self.quantization}")
+        self._snapshot: Optional[_Snapshot] = None
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        directory: str = ".vector_index",
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        store = cls(embedding, directory, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
+
+    def _file_path(self, setting: str, default: str) -> str:
+        return os.path.join(self.directory, self._setting(setting) or default)
+
+    @property
+    def _vectors_path(self) -> str:
+        return self._file_path("vectors_file", f"vectors.{self.quantization}")
+
+    @property
+    def _scales_path(self) -> str:
+        return self._file_path("scales_file", "scales.float32")
+
+    def _setting(self, name: str) -> Optional[str]:
+        row = self._connection.execute(
+            "SELECT value FROM settings WHERE name = ?", (name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, name: str, value: Any):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO settings VALUES (?, ?)", (name, str(value))
+        )
+
+    def _write(self, update):
+        """
+        Run `update` in one transaction, locked across processes, and bump the
+        generation so readers remap.
+        """
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = update()
+                self._set("generation", int(self._setting("generation") or 0) + 1)
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        return result
+
+    def _map(self, path: str, dtype, shape: Tuple[int, ...]) -> np.ndarray:
+        if shape[0] == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+    def _current(self) -> _Snapshot:
+        """
+        The mapping of the committed rows, remapped when another writer changed them.
+        """
+        with self._lock:
+            generation = int(self._setting("generation") or 0)
+            if self._snapshot is not None and self._snapshot.generation == generation:
+                return self._snapshot
+
+            # Read the rows and map their file in one transaction, so a compaction
+            # cannot commit and remove the file in between
+            self._connection.execute("BEGIN")
+            try:
+                self._snapshot = self._read_snapshot()
+            finally:
+                self._connection.execute("COMMIT")
+            return self._snapshot
+
+    def _read_snapshot(self) -> _Snapshot:
+        generation = int(self._setting("generation") or 0)
+        ids = [
+            row[0]
+            for row in self._connection.execute(
+                "SELECT id FROM chunks ORDER BY position"
+            )
+        ]
+        dimension = int(self._setting("dimension") or 0)
+        vectors = self._map(
+            self._vectors_path, _DTYPES[self.quantization], (len(ids), dimension)
+        )
+        scales = None
+        if self.quantization == "int8":
+            scales = self._map(self._scales_path, np.float32, (len(ids),))
+        return _Snapshot(generation, ids, vectors, scales)
+
+    def _query(self, sql: str, parameters: Sequence[Any] = ()) -> List[Tuple]:
+        # The connection is shared by threads, so reads wait for open transactions
+        with self._lock:
+            return self._connection.execute(sql, list(parameters)).fetchall()
+
+    def count(self) -> int:
+        return self._query("SELECT COUNT(*) FROM chunks")[0][0]
+
+    def centroid(self) -> Optional[np.ndarray]:
+        """
+        Mean of the normalized embeddings of all rows, or None when the store is empty.
+        """
+        snapshot = self._current()
+        if not snapshot.ids:
+            return None
+        total = np.zeros(snapshot.vectors.shape[1], dtype=np.float64)
+        for start in range(0, len(snapshot.ids), _SCORING_BLOCK_ROWS):
+            end = start + _SCORING_BLOCK_ROWS
+            block = snapshot.vectors[start:end].astype(np.float32)
+            if snapshot.scales is not None:
+                block *= snapshot.scales[start:end, None]
+            total += block.sum(axis=0)
+        return (total / len(snapshot.ids)).astype(np.float32)
+
+    def _write_rows(self, path: str, positions: Sequence[int], rows: np.ndarray):
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        row_bytes = rows[0].nbytes
+        with open(path, "r+b") as f:
+            for position, row in zip(positions, rows):
+                f.seek(position * row_bytes)
+                f.write(row.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [None] * len(texts)
+        ids = [id or _content_id(text) for id, text in zip(ids, texts)]
+        vectors = _normalized(self._embedding.embed_documents(texts))
+
+        def update():
+            dimension = self._setting("dimension")
+            if dimension is None:
+                self._set("dimension", vectors.shape[1])
+                self._set("quantization", self.quantization)
+            elif int(dimension) != vectors.shape[1]:
+                raise ValueError(
+                    f"Embedding dimension {vectors.shape[1]} does not match the "
+                    f"index dimension {dimension}"
+                )
+
+            # Existing ids are overwritten in place, new ones appended
+            count = self.count()
+            known = dict(
+                self._connection.execute(
+                    f"SELECT id, position FROM chunks WHERE id IN "
+                    f"({','.join('?' * len(ids))})",
+                    ids,
+                ).fetchall()
+            )
+            positions = []
+            for id in ids:
+                if id not in known:
+                    known[id] = count
+                    count += 1
+                positions.append(known[id])
+
+            if self.quantization == "int8":
+                codes, scales = quantize(vectors)
+                self._write_rows(self._vectors_path, positions, codes)
+                self._write_rows(self._scales_path, positions, scales[:, None])
+            else:
+                self._write_rows(self._vectors_path, positions, vectors)
+
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)",
+                [
+                    (position, id, text, json.dumps(metadata))
+                    for position, id, text, metadata in zip(
+                        positions, ids, texts, metadatas
+                    )
+                ],
+            )
+
+        self._write(update)
+        return ids
+
+    def _compact(
+        self,
+        setting: str,
+        path: str,
+        name: str,
+        dtype,
+        shape: Tuple[int, ...],
+        keep: List[int],
+    ):
+        """
+        Copy the `keep` rows of `path` to the new file `name`, and point `setting` to
+        it. The old file stays in place for the current readers.
+        """
+        rows = np.asarray(np.memmap(path, dtype=dtype, mode="r", shape=shape)[keep])
+        # A compaction that failed before committing left the same name behind
+        with open(os.path.join(self.directory, name), "wb") as f:
+            f.write(rows.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self._set(setting, name)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return None
+
+        def update():
+            deleted = {
+                row[0]
+                for row in self._connection.execute(
+                    f"SELECT position FROM chunks WHERE id IN "
+                    f"({','.join('?' * len(ids))})",
+                    ids,
+                )
+            }
+            if not deleted:
+                return False
+
+            count = self.count()
+            keep = [position for position in range(count) if position not in deleted]
+            dimension = int(self._setting("dimension"))
+            # The generation `_write` commits, so every compaction gets a new file
+            generation = int(self._setting("generation") or 0) + 1
+            stale = [self._vectors_path]
+            self._compact(
+                "vectors_file",
+                self._vectors_path,
+                f"vectors.{generation}.{self.quantization}",
+                _DTYPES[self.quantization],
+                (count, dimension),
+                keep,
+            )
+            if self.quantization == "int8":
+                stale.append(self._scales_path)
+                self._compact(
+                    "scales_file",
+                    self._scales_path,
+                    f"scales.{generation}.float32",
+                    np.float32,
+                    (count,),
+                    keep,
+                )
+
+            self._connection.execute(
+                f"DELETE FROM chunks WHERE position IN "
+                f"({','.join('?' * len(deleted))})",
+                list(deleted),
+            )
+            # Number the rows after the first deleted one on from it, in the order of
+            # the compacted file. The new positions go through negative ones first, as
+            # the primary key must stay unique after every row the update moves
+            first = min(deleted)
+            self._connection.execute(
+                "UPDATE chunks SET position = -1 - renumbered.position "
+                "FROM (SELECT position AS old, "
+                "? + ROW_NUMBER() OVER (ORDER BY position) - 1 AS position "
+                "FROM chunks WHERE position > ?) AS renumbered "
+                "WHERE chunks.position = renumbered.old",
+                (first, first),
+            )
+            self._connection.execute(
+                "UPDATE chunks SET position = -1 - position WHERE position < 0"
+            )
+            return stale
+
+        stale = self._write(update)
+        if not stale:
+            return False
+        for path in stale:
+            try:
+                os.remove(path)
+            except OSError:
+                # Already removed, or still mapped by a reader where that prevents it
+                pass
+        return True
+
+    def _documents(self, ids: Sequence[str]) -> Dict[str, Document]:
+        if not ids:
+            return {}
+        rows = self._query(
+            f"SELECT id, text, metadata FROM chunks WHERE id IN "
+            f"({','.join('?' * len(ids))})",
+            ids,
+        )
+        return {
+            id: Document(id=id, page_content=text, metadata=json.loads(metadata))
+            for id, text, metadata in rows
+        }
+
+    def get_by_ids(self, ids: Sequence[str], /) -> List[Document]:
+        documents = self._documents(ids)
+        return [documents[id] for id in ids if id in documents]
+
+    def get(
+        self,
+        ids: Optional[Sequence[str]] = None,
+        include: Optional[Sequence[str]] = None,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        """
+        Chroma-compatible `get`, returning the "ids" and the included "documents" and
+        "metadatas" of the given ids, or of all rows.
+        """
+        include = ["documents", "metadatas"] if include is None else include
+        query = "SELECT id, text, metadata FROM chunks"
+        parameters: List[str] = []
+        if ids is not None:
+            query += f" WHERE id IN ({','.join('?' * len(ids))})"
+            parameters = list(ids)
+        rows = self._query(query + " ORDER BY position", parameters)
+        return {
+            "ids": [row[0] for row in rows],
+            "documents": ([row[1] for row in rows] if "documents" in include else None),
+            "metadatas": (
+                [json.loads(row[2]) for row in rows] if "metadatas" in include else None
+            ),
+        }
+
+    def _scores(self, snapshot: _Snapshot, queries: np.ndarray) -> np.ndarray:
+        """
+        Cosine similarities of every row to every query, shaped (rows, queries).
+        """
+        if snapshot.scales is None:
+            return snapshot.vectors @ queries.T
+        blocks = []
+        for start in range(0, len(snapshot.ids), _SCORING_BLOCK_ROWS):
+            end = start + _SCORING_BLOCK_ROWS
+            block = snapshot.vectors[start:end].astype(np.float32) @ queries.T
+            blocks.append(block * snapshot.scales[start:end, None])
+        return np.concatenate(blocks)
+
+    def search_by_vectors(
+        self, embeddings: Sequence[Sequence[float]], k: int = 4
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        The `k` best rows of each query vector with their scores, scored in one pass.
+        """
+        snapshot = self._current()
+        if not snapshot.ids or not len(embeddings):
+            return [[] for _ in embeddings]
+
+        scores = self._scores(snapshot, _normalized(embeddings))
+        k = min(k, len(snapshot.ids))
+        best = np.argpartition(-scores, k - 1, axis=0)[:k]
+
+        rankings: List[List[Tuple[str, float]]] = []
+        for column in range(scores.shape[1]):
+            rows = best[:, column]
+            rows = rows[np.argsort(-scores[rows, column])]
+            rankings.append(
+                [(snapshot.ids[row], float(scores[row, column])) for row in rows]
+            )
+
+        documents = self._documents(
+            list({id for ranking in rankings for id, _ in ranking})
+        )
+        return [
+            [(documents[id], score) for id, score in ranking if id in documents]
+            for ranking in rankings
+        ]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.search_by_vectors([self._embedding.embed_query(query)], k)[0]
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [document for document, _ in self.search_by_vectors([embedding], k)[0]]
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k)]
+
+    def similarity_search_batch(
+        self, queries: Sequence[str], k: int = 4
+    ) -> List[List[Document]]:
+        """
+        Search several queries with a single matrix product.
+        """
+        embed_queries = getattr(self._embedding, "embed_queries", None)
+        if embed_queries is not None:
+            vectors = embed_queries(list(queries))
+        else:
+            vectors = [self._embedding.embed_query(query) for query in queries]
+        return [
+            [document for document, _ in results]
+            for results in self.search_by_vectors(vectors, k)
+        ]
+
+    def _select_relevance_score_fn(self):
+        # Scores are cosine similarities
+        return lambda score: (score + 1) / 2
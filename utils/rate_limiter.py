@@ -0,0 +1,337 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.rate_limiters import BaseRateLimiter
+
+from utils.metrics import (
+    RATE_LIMITER_THROTTLES,
+    RATE_LIMITER_WAIT_SECONDS,
+    get_metrics,
+)
+
+# Rate limiter of the Bedrock chat model: "shared" across the processes using the same
+# database, or "memory" for a limiter per process
+RATE_LIMITER = os.getenv("RATE_LIMITER", "shared").lower()
+RATE_LIMITER_DATABASE_PATH = os.getenv("RATE_LIMITER_DATABASE_PATH", ".rate_limiter.db")
+
+# Bedrock quota shared by all processes, and the requests allowed in a burst
+BEDROCK_REQUESTS_PER_SECOND = float(os.getenv("BEDROCK_REQUESTS_PER_SECOND", "5"))
+BEDROCK_MAX_BURST = float(os.getenv("BEDROCK_MAX_BURST", "2"))
+BEDROCK_TOKENS_PER_MINUTE = float(os.getenv("BEDROCK_TOKENS_PER_MINUTE", "200000"))
+
+# Seconds of token quota that can be spent in a burst
+TOKEN_BURST_SECONDS = 10
+
+# AIMD: the rates are halved on throttling, at most once per cooldown, and recover by
+# a small step on every successful call
+AIMD_DECREASE_FACTOR = 0.5
+AIMD_INCREASE_STEP = 0.02
+AIMD_MIN_SCALE = 0.1
+AIMD_COOLDOWN_SECONDS = 2.0
+
+PRIORITY_HIGH = "high"
+PRIORITY_NORMAL = "normal"
+PRIORITY_LOW = "low"
+
+# Share of both buckets that must be left after a call of the given priority, which
+# keeps capacity in reserve for the more urgent calls. For requests, the share is of
+# the burst beyond the call itself, so a full bucket always lets any priority through
+_HEADROOM = {PRIORITY_HIGH: 0.0, PRIORITY_NORMAL: 0.25, PRIORITY_LOW: 0.5}
+
+# The headroom of a waiting caller shrinks to nothing over this many seconds, so steady
+# traffic of higher priority delays lower priority calls but never starves them
+PRIORITY_AGING_SECONDS = 5.0
+
+# Bounds of the sleep of a waiting caller, which is the time the buckets need to refill.
+# The upper bound picks up aging headroom and recovering rates, the lower bound keeps
+# callers racing for the same refill from spinning
+_MIN_WAIT_SECONDS = 0.005
+_MAX_WAIT_SECONDS = 1.0
+
+_THROTTLING_ERROR_CODES = frozenset(
+    ["ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException"]
+)
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    response = getattr(error, "response", None)
+    if isinstance(response, dict):
+        return response.get("Error", {}).get("Code") in _THROTTLING_ERROR_CODES
+    return any(code in str(error) for code in _THROTTLING_ERROR_CODES)
+
+
+class _Buckets(NamedTuple):
+    requests: float
+    tokens: float
+    scale: float
+    decreased_at: float
+
+
+class SharedRateLimiter:
+    """
+    Token bucket rate limiter for requests and LLM tokens, with its state in a SQLite
+    database so every process using the same file shares one quota.
+
+    Requests are taken from the buckets before a call; the tokens a call used are
+    charged afterwards, which can leave the token bucket in debt until it refills.
+    Both refill rates follow AIMD: halved when Bedrock throttles, and slowly restored
+    by successful calls.
+    """
+
+    def __init__(
+        self,
+        database_path: str = RATE_LIMITER_DATABASE_PATH,
+        requests_per_second: float = BEDROCK_REQUESTS_PER_SECOND,
+        max_burst: float = BEDROCK_MAX_BURST,
+        tokens_per_minute: float = BEDROCK_TOKENS_PER_MINUTE,
+        name: str = "bedrock",
+    ):
+        self.requests_per_second = requests_per_second
+        self.max_burst = max_burst
+        self.tokens_per_second = tokens_per_minute / 60
+        self.token_capacity = self.tokens_per_second * TOKEN_BURST_SECONDS
+        self.name = name
+
+        self._lock = threading.Lock()
+        # Transactions are managed explicitly, see `_update`
+        self._connection = sqlite3.connect(
+            database_path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                name TEXT PRIMARY KEY,
+                requests REAL NOT NULL,
+                tokens REAL NOT NULL,
+                scale REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                decreased_at REAL NOT NULL
+            )
+            """)
+
+    def _refilled(self, now: float) -> _Buckets:
+        row = self._connection.execute(
+            "SELECT requests, tokens, scale, updated_at, decreased_at "
+            "FROM rate_limits WHERE name = ?",
+            (self.name,),
+        ).fetchone()
+        if row is None:
+            return _Buckets(self.max_burst, self.token_capacity, 1.0, 0.0)
+
+        requests, tokens, scale, updated_at, decreased_at = row
+        # Clocks of different processes may disagree slightly
+        elapsed = max(0.0, now - updated_at)
+        return _Buckets(
+            requests=min(
+                self.max_burst, requests + elapsed * self.requests_per_second * scale
+            ),
+            tokens=min(
+                self.token_capacity, tokens + elapsed * self.tokens_per_second * scale
+            ),
+            scale=scale,
+            decreased_at=decreased_at,
+        )
+
+    def _update(
+        self, update: Callable[[_Buckets, float], Optional[_Buckets]]
+    ) -> Optional[_Buckets]:
+        """
+        Apply `update` to the refilled buckets in one transaction, locked across
+        processes. `update` returns the new buckets, or None to leave them unchanged.
+        """
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                buckets = update(self._refilled(now), now)
+                if buckets is not None:
+                    self._connection.execute(
+                        "INSERT OR REPLACE INTO rate_limits VALUES (?, ?, ?, ?, ?, ?)",
+                        (self.name, *buckets[:3], now, buckets.decreased_at),
+                    )
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        return buckets
+
+    def _wait_seconds(self, buckets: _Buckets, headroom: float) -> float:
+        """
+        Seconds until the refill leaves `headroom` after a call, or 0 if it already does.
+        """
+        missing_requests = (
+            1 + headroom * max(0.0, self.max_burst - 1) - buckets.requests
+        )
+        missing_tokens = headroom * self.token_capacity - buckets.tokens
+        if missing_requests <= 0 and missing_tokens < 0:
+            return 0.0
+        return max(
+            _MIN_WAIT_SECONDS,
+            missing_requests / (self.requests_per_second * buckets.scale),
+            missing_tokens / (self.tokens_per_second * buckets.scale),
+        )
+
+    def acquire_or_wait(
+        self, priority: str = PRIORITY_NORMAL, waited: float = 0.0
+    ) -> float:
+        """
+        Take a request from the buckets if the priority's headroom is left, given that
+        the caller has already waited `waited` seconds. Return 0 when the request was
+        taken, otherwise the seconds until the buckets should have refilled enough.
+
+        The buckets are read without a write lock first, so waiting callers only lock
+        the database when they are likely to get through.
+        """
+        headroom = _HEADROOM[priority] * max(0.0, 1 - waited / PRIORITY_AGING_SECONDS)
+        with self._lock:
+            wait = self._wait_seconds(self._refilled(time.time()), headroom)
+        if wait:
+            return wait
+
+        def update(buckets: _Buckets, now: float) -> Optional[_Buckets]:
+            nonlocal wait
+            # Another caller may have taken the request since the read
+            wait = self._wait_seconds(buckets, headroom)
+            if wait:
+                return None
+            return buckets._replace(requests=buckets.requests - 1)
+
+        self._update(update)
+        return wait
+
+    def try_acquire(self, priority: str = PRIORITY_NORMAL, waited: float = 0.0) -> bool:
+        return not self.acquire_or_wait(priority, waited)
+
+    def record_success(self, tokens_used: int):
+        def update(buckets: _Buckets, now: float) -> _Buckets:
+            return buckets._replace(
+                tokens=buckets.tokens - tokens_used,
+                scale=min(1.0, buckets.scale + AIMD_INCREASE_STEP),
+            )
+
+        self._update(update)
+
+    def record_throttle(self):
+        def update(buckets: _Buckets, now: float) -> Optional[_Buckets]:
+            if now - buckets.decreased_at < AIMD_COOLDOWN_SECONDS:
+                # Calls throttled in the same burst only count once
+                return None
+            # Emptying the request bucket pauses every process for a moment
+            return _Buckets(
+                requests=min(buckets.requests, 0.0),
+                tokens=buckets.tokens,
+                scale=max(AIMD_MIN_SCALE, buckets.scale * AIMD_DECREASE_FACTOR),
+                decreased_at=now,
+            )
+
+        if self._update(update) is not None:
+            get_metrics().inc(RATE_LIMITER_THROTTLES)
+
+    def view(self, priority: str) -> "PriorityRateLimiter":
+        return PriorityRateLimiter(limiter=self, priority=priority)
+
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """
+    View of a SharedRateLimiter that acquires with a fixed priority, usable as the
+    `rate_limiter` of a chat model.
+    """
+
+    def __init__(self, limiter: SharedRateLimiter, priority: str):
+        self.limiter = limiter
+        self.priority = priority
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        started = time.perf_counter()
+        wait = self.limiter.acquire_or_wait(self.priority)
+        while blocking and wait:
+            time.sleep(min(wait, _MAX_WAIT_SECONDS))
+            wait = self.limiter.acquire_or_wait(
+                self.priority, time.perf_counter() - started
+            )
+        get_metrics().observe(
+            RATE_LIMITER_WAIT_SECONDS,
+            time.perf_counter() - started,
+            priority=self.priority,
+        )
+        return not wait
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        # The SQLite transaction can wait on other processes, off the event loop
+        started = time.perf_counter()
+        wait = await asyncio.to_thread(self.limiter.acquire_or_wait, self.priority)
+        while blocking and wait:
+            await asyncio.sleep(min(wait, _MAX_WAIT_SECONDS))
+            wait = await asyncio.to_thread(
+                self.limiter.acquire_or_wait,
+                self.priority,
+                time.perf_counter() - started,
+            )
+        get_metrics().observe(
+            RATE_LIMITER_WAIT_SECONDS,
+            time.perf_counter() - started,
+            priority=self.priority,
+        )
+        return not wait
+
+
+class RateLimitFeedbackHandler(BaseCallbackHandler):
+    """
+    Feeds the outcome of chat model calls back into the shared rate limiter: the tokens
+    used by successful calls, and throttling errors.
+    """
+
+    run_inline = True
+
+    def __init__(self, limiter: SharedRateLimiter):
+        self.limiter = limiter
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or {}
+                # Responses served from the LLM cache never reached Bedrock
+                if usage.get("total_cost") == 0:
+                    continue
+                self.limiter.record_success(usage.get("total_tokens", 0))
+
+    def on_llm_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        if is_throttling_error(error):
+            self.limiter.record_throttle()
+
+
+def on_bedrock_attempt(limiter: SharedRateLimiter):
+    """
+    Return a botocore `needs-retry` hook that reports every throttled attempt, including
+    the ones botocore retries on its own.
+    """
+
+    def hook(response: Optional[Tuple[Any, Dict[str, Any]]] = None, **kwargs: Any):
+        if response is not None:
+            code = response[1].get("Error", {}).get("Code")
+            if code in _THROTTLING_ERROR_CODES:
+                limiter.record_throttle()
+        # Returning None leaves the retry decision to botocore
+        return None
+
+    return hook
+
+
+@lru_cache
+def get_shared_rate_limiter() -> SharedRateLimiter:
+    return SharedRateLimiter()
+
+
+@lru_cache
+def get_rate_limit_feedback_handler() -> RateLimitFeedbackHandler:
+    return RateLimitFeedbackHandler(get_shared_rate_limiter())
@@ -0,0 +1,430 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+    Callbacks,
+)
+from langchain_core.documents import BaseDocumentCompressor, Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import run_in_executor
+from langchain_core.vectorstores import VectorStore
+
+from utils.lexical_index import BM25Index
+from utils.metrics import (
+    COUNT_BUCKETS,
+    RERANK_CUT_SCORE,
+    RERANK_KEPT_CHUNKS,
+    RETRIEVAL_SECONDS,
+    SCORE_BUCKETS,
+    get_metrics,
+)
+from utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true"
+
+# Candidates fetched for reranking, and the limits used to cut the reranked list
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+RETRIEVAL_MAX_CHUNKS = int(os.getenv("RETRIEVAL_MAX_CHUNKS", "6"))
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "2500"))
+RERANK_MIN_SCORE = float(os.getenv("RERANK_MIN_SCORE", "0.15"))
+RERANK_MAX_SCORE_GAP = float(os.getenv("RERANK_MAX_SCORE_GAP", "0.5"))
+
+# Constant of reciprocal rank fusion, dampening the weight of the top ranks
+RRF_K = 60
+
+# Threads searching the shards of the corpus concurrently
+SHARD_SEARCH_WORKERS = int(os.getenv("SHARD_SEARCH_WORKERS", "8"))
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[str]], k: int = RRF_K
+) -> List[str]:
+    """
+    Fuse several rankings of document ids into one, scoring each id by sum(1 / (k + rank)).
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking, start=1):
+            scores[id] = scores.get(id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def rankings_agree(
+    first: Sequence[str], second: Sequence[str], top: int, threshold: float
+) -> bool:
+    """
+    Whether the top results of two rankings overlap by at least `threshold`.
+    """
+    if not first or not second:
+        return False
+    overlap = len(set(first[:top]) & set(second[:top]))
+    return overlap / min(top, len(first), len(second)) >= threshold
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever that fuses dense vector search with BM25 keyword search using
+    reciprocal rank fusion.
+
+    When the top results of both searches largely agree, the candidate list is cut
+    to `k_on_agreement` documents, which shrinks the rerank call downstream.
+    """
+
+    vector_store: VectorStore
+    lexical_index: BM25Index
+    k: int = 10
+    k_on_agreement: int = 5
+    agreement_top: int = 5
+    agreement_threshold: float = 0.6
+
+    def _fuse(
+        self, dense: List[Document], lexical_ids: List[str]
+    ) -> tuple[List[str], Dict[str, Document]]:
+        documents = {document.id: document for document in dense}
+        dense_ids = [document.id for document in dense]
+        fused_ids = reciprocal_rank_fusion([dense_ids, lexical_ids])
+
+        k = self.k
+        if rankings_agree(
+            dense_ids, lexical_ids, self.agreement_top, self.agreement_threshold
+        ):
+            k = self.k_on_agreement
+        return fused_ids[:k], documents
+
+    def _with_lexical(self, query: str, dense: List[Document]) -> List[Document]:
+        metrics = get_metrics()
+        with metrics.timer(RETRIEVAL_SECONDS, stage="lexical"):
+            lexical_ids = [id for id, _ in self.lexical_index.search(query, k=self.k)]
+        fused_ids, documents = self._fuse(dense, lexical_ids)
+
+        missing_ids = [id for id in fused_ids if id not in documents]
+        if missing_ids:
+            with metrics.timer(RETRIEVAL_SECONDS, stage="fetch"):
+                for document in self.vector_store.get_by_ids(missing_ids):
+                    documents[document.id] = document
+        return [documents[id] for id in fused_ids if id in documents]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        with get_metrics().timer(RETRIEVAL_SECONDS, stage="dense"):
+            dense = self.vector_store.similarity_search(query, k=self.k)
+        return self._with_lexical(query, dense)
+
+    def search_many(self, queries: Sequence[str]) -> List[List[Document]]:
+        """
+        Search several queries, with a single dense scoring pass when the vector store
+        supports batched search.
+        """
+        with get_metrics().timer(RETRIEVAL_SECONDS, stage="dense"):
+            if hasattr(self.vector_store, "similarity_search_batch"):
+                dense_lists = self.vector_store.similarity_search_batch(
+                    queries, k=self.k
+                )
+            else:
+                dense_lists = [
+                    self.vector_store.similarity_search(query, k=self.k)
+                    for query in queries
+                ]
+        return [
+            self._with_lexical(query, dense)
+            for query, dense in zip(queries, dense_lists)
+        ]
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        metrics = get_metrics()
+        with metrics.timer(RETRIEVAL_SECONDS, stage="dense"):
+            dense = await self.vector_store.asimilarity_search(query, k=self.k)
+        with metrics.timer(RETRIEVAL_SECONDS, stage="lexical"):
+            lexical_ids = [id for id, _ in self.lexical_index.search(query, k=self.k)]
+        fused_ids, documents = self._fuse(dense, lexical_ids)
+
+        missing_ids = [id for id in fused_ids if id not in documents]
+        if missing_ids:
+            with metrics.timer(RETRIEVAL_SECONDS, stage="fetch"):
+                for document in await self.vector_store.aget_by_ids(missing_ids):
+                    documents[document.id] = document
+        return [documents[id] for id in fused_ids if id in documents]
+
+
+@lru_cache
+def _shard_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=SHARD_SEARCH_WORKERS, thread_name_prefix="shard-search"
+    )
+
+
+class ShardedRetriever(BaseRetriever):
+    """
+    Retriever that searches the shards of the corpus concurrently and fuses their
+    candidates with reciprocal rank fusion, keeping the best `k` for the rerank.
+
+    With a `router`, only the shards it picks for the query are searched. Every
+    candidate is tagged with its shard name and the metadata of its shard.
+    """
+
+    shards: Dict[str, BaseRetriever]
+    shard_metadata: Dict[str, Dict[str, Any]] = {}
+    router: Optional[Any] = None
+    k: int = 10
+
+    def _route(self, query: str) -> List[str]:
+        names = []
+        if self.router is not None:
+            names = [name for name in self.router.route(query) if name in self.shards]
+        return names or list(self.shards)
+
+    def _fuse(
+        self, names: Sequence[str], results: Sequence[Sequence[Document]]
+    ) -> List[Document]:
+        documents: Dict[str, Document] = {}
+        rankings: List[List[str]] = []
+        for name, candidates in zip(names, results):
+            ranking = []
+            for document in candidates:
+                document.metadata.update(self.shard_metadata.get(name, {}))
+                document.metadata["shard"] = name
+                key = _document_key(document)
+                documents.setdefault(key, document)
+                ranking.append(key)
+            rankings.append(ranking)
+        return [documents[key] for key in reciprocal_rank_fusion(rankings)[: self.k]]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        names = self._route(query)
+        config = {"callbacks": run_manager.get_child()}
+        if len(names) == 1:
+            results = [self.shards[names[0]].invoke(query, config=config)]
+        else:
+            results = list(
+                _shard_executor().map(
+                    lambda name: self.shards[name].invoke(query, config=config), names
+                )
+            )
+        return self._fuse(names, results)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        names = self._route(query)
+        config = {"callbacks": run_manager.get_child()}
+        results = await asyncio.gather(
+            *(self.shards[name].ainvoke(query, config=config) for name in names)
+        )
+        return self._fuse(names, results)
+
+    def _search_shard(self, name: str, queries: Sequence[str]) -> List[List[Document]]:
+        shard = self.shards[name]
+        if isinstance(shard, HybridRetriever):
+            return shard.search_many(queries)
+        return shard.batch(list(queries))
+
+    def search_many(self, queries: Sequence[str]) -> List[List[Document]]:
+        """
+        Search several queries, each shard once with all the queries routed to it.
+        """
+        routes = [self._route(query) for query in queries]
+        names = [name for name in self.shards if any(name in route for route in routes)]
+        shard_queries = {
+            name: [query for query, route in zip(queries, routes) if name in route]
+            for name in names
+        }
+        shard_results = dict(
+            zip(
+                names,
+                _shard_executor().map(
+                    lambda name: self._search_shard(name, shard_queries[name]), names
+                ),
+            )
+        )
+
+        results = []
+        for query, route in zip(queries, routes):
+            per_shard = [
+                shard_results[name][shard_queries[name].index(query)] for name in route
+            ]
+            results.append(self._fuse(route, per_shard))
+        return results
+
+
+class AdaptiveRerank(BaseDocumentCompressor):
+    """
+    Reranks all candidates and keeps a variable number of them: the list is cut at
+    the first chunk scoring below `min_score`, at the first relative score drop larger
+    than `max_score_gap`, or when `token_budget` is reached, whichever comes first.
+    At least `min_chunks` and at most `max_chunks` chunks are kept.
+    """
+
+    reranker: Any
+    min_score: float = RERANK_MIN_SCORE
+    max_score_gap: float = RERANK_MAX_SCORE_GAP
+    token_budget: int = RETRIEVAL_TOKEN_BUDGET
+    min_chunks: int = 1
+    max_chunks: int = RETRIEVAL_MAX_CHUNKS
+
+    def _rerank(self, documents: Sequence[Document], query: str) -> List[Document]:
+        # Ask for a score for every candidate rather than the reranker's fixed top_n
+        with get_metrics().timer(RETRIEVAL_SECONDS, stage="rerank"):
+            results = self.reranker.rerank(documents, query, top_n=len(documents))
+
+        reranked = []
+        for result in results:
+            document = Document(**documents[result["index"]].model_dump())
+            document.metadata["relevance_score"] = result["relevance_score"]
+            reranked.append(document)
+        return reranked
+
+    def _cut_reason(
+        self, kept: List[Document], tokens: int, document: Document
+    ) -> Optional[str]:
+        """
+        Why the list ends before `document`, or None to keep it.
+        """
+        if len(kept) >= self.max_chunks:
+            return "max_chunks"
+        if len(kept) < self.min_chunks:
+            return None
+        score = document.metadata["relevance_score"]
+        if score < self.min_score:
+            return "min_score"
+        previous_score = kept[-1].metadata["relevance_score"] if kept else None
+        gap = (previous_score - score) / previous_score if previous_score else 0
+        if gap > self.max_score_gap:
+            return "score_gap"
+        if tokens + estimate_tokens(document.page_content) > self.token_budget:
+            return "token_budget"
+        return None
+
+    def _cut(self, reranked: List[Document]) -> List[Document]:
+        kept: List[Document] = []
+        tokens = 0
+        reason = "exhausted"
+        for document in reranked:
+            cut = self._cut_reason(kept, tokens, document)
+            if cut is not None:
+                reason = cut
+                get_metrics().observe(
+                    RERANK_CUT_SCORE,
+                    document.metadata["relevance_score"],
+                    buckets=SCORE_BUCKETS,
+                    reason=reason,
+                )
+                break
+            kept.append(document)
+            tokens += estimate_tokens(document.page_content)
+
+        get_metrics().observe(
+            RERANK_KEPT_CHUNKS, len(kept), buckets=COUNT_BUCKETS, reason=reason
+        )
+        # Queries can hold personal data, so they stay out of the logs
+        logger.debug(
+            "Kept %d of %d reranked chunks (~%d tokens), cut by %s",
+            len(kept),
+            len(reranked),
+            tokens,
+            reason,
+        )
+        return kept
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        if not documents:
+            return []
+        return self._cut(self._rerank(documents, query))
+
+    async def acompress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        if not documents:
+            return []
+        reranked = await run_in_executor(None, self._rerank, documents, query)
+        return self._cut(reranked)
+
+
+def _document_key(document: Document) -> str:
+    return document.id or document.page_content
+
+
+def _merge_candidates(candidate_lists: Sequence[Sequence[Document]]) -> List[Document]:
+    """
+    Merge the candidates of several queries, dropping the chunks found more than once.
+    """
+    merged: Dict[str, Document] = {}
+    for candidates in candidate_lists:
+        for document in candidates:
+            merged.setdefault(_document_key(document), document)
+    return list(merged.values())
+
+
+def _group_by_query(
+    candidate_lists: Sequence[Sequence[Document]], kept: Sequence[Document]
+) -> List[List[Document]]:
+    # Attribute every kept chunk to the first query that retrieved it
+    first_query: Dict[str, int] = {}
+    for position, candidates in enumerate(candidate_lists):
+        for document in candidates:
+            first_query.setdefault(_document_key(document), position)
+
+    groups: List[List[Document]] = [[] for _ in candidate_lists]
+    for document in kept:
+        groups[first_query[_document_key(document)]].append(document)
+    return groups
+
+
+def multi_query_search(
+    retriever: BaseRetriever, queries: Sequence[str], rerank_query: str
+) -> List[List[Document]]:
+    """
+    Search several query variants with one reranking pass. The candidates of all
+    variants are retrieved concurrently, deduplicated, and reranked together against
+    `rerank_query`. Returns the kept chunks grouped by the variant that found them.
+
+    `retriever` is the contextual compression retriever built by `load_vector_store`.
+    """
+    base_retriever = retriever.base_retriever
+    if isinstance(base_retriever, (HybridRetriever, ShardedRetriever)):
+        candidate_lists = base_retriever.search_many(list(queries))
+    else:
+        candidate_lists = base_retriever.batch(list(queries))
+    kept = retriever.base_compressor.compress_documents(
+        _merge_candidates(candidate_lists), rerank_query
+    )
+    return _group_by_query(candidate_lists, kept)
+
+
+async def amulti_query_search(
+    retriever: BaseRetriever, queries: Sequence[str], rerank_query: str
+) -> List[List[Document]]:
+    """
+    Async variant of `multi_query_search`.
+    """
+    base_retriever = retriever.base_retriever
+    if isinstance(base_retriever, (HybridRetriever, ShardedRetriever)):
+        candidate_lists = await run_in_executor(
+            None, base_retriever.search_many, list(queries)
+        )
+    else:
+        candidate_lists = await base_retriever.abatch(list(queries))
+    kept = await retriever.base_compressor.acompress_documents(
+        _merge_candidates(candidate_lists), rerank_query
+    )
+    return _group_by_query(candidate_lists, kept)
@@ -0,0 +1,218 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from utils.corpus_version import get_corpus_version
+from utils.metrics import CacheStats, get_metrics
+
+# Store for reranked search results: "memory", "sqlite" (memory in front of a file
+# shared by all processes) or "none"
+RETRIEVAL_CACHE = os.getenv("RETRIEVAL_CACHE", "memory").lower()
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "1024"))
+RETRIEVAL_CACHE_TTL_SECONDS = float(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", "86400"))
+RETRIEVAL_CACHE_DATABASE_PATH = os.getenv(
+    "RETRIEVAL_CACHE_DATABASE_PATH", ".retrieval_cache.db"
+)
+
+# Serialized documents: id, text and metadata, which holds the rerank score
+_Entry = List[Dict[str, Any]]
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def _serialize(documents: List[Document]) -> _Entry:
+    return [
+        {
+            "id": document.id,
+            "page_content": document.page_content,
+            "metadata": dict(document.metadata),
+        }
+        for document in documents
+    ]
+
+
+def _deserialize(entry: _Entry) -> List[Document]:
+    # New documents on every hit, so callers cannot alter the cached ones
+    return [
+        Document(
+            id=item["id"],
+            page_content=item["page_content"],
+            metadata=dict(item["metadata"]),
+        )
+        for item in entry
+    ]
+
+
+class _DiskTier:
+    """
+    SQLite table of search results, shared by the processes serving the same corpus.
+    """
+
+    def __init__(self, database_path: str):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            database_path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS retrieval_cache (
+                key TEXT PRIMARY KEY,
+                corpus_version TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                documents TEXT NOT NULL
+            )
+            """)
+
+    def lookup(self, key: str, ttl_seconds: float) -> Optional[Tuple[_Entry, float]]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT documents, created_at FROM retrieval_cache WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None or time.time() - row[1] > ttl_seconds:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def store(self, key: str, corpus_version: str, entry: _Entry):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO retrieval_cache VALUES (?, ?, ?, ?)",
+                (key, corpus_version, time.time(), json.dumps(entry)),
+            )
+
+    def prune(self, corpus_version: str, ttl_seconds: float):
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM retrieval_cache WHERE corpus_version != ? "
+                "OR created_at < ?",
+                (corpus_version, time.time() - ttl_seconds),
+            )
+
+
+class RetrievalCache:
+    """
+    Cache of reranked search results, keyed by the normalized query, the corpus
+    version and the retrieval settings. A hit skips the query embedding, the vector
+    search and the rerank call.
+
+    Entries expire after `ttl_seconds`, the least recently used in-memory entries are
+    evicted beyond `max_entries`, and every entry is dropped once the corpus version
+    changes, which ingestion does whenever it adds or removes chunks.
+    """
+
+    def __init__(
+        self,
+        settings: str = "",
+        max_entries: int = RETRIEVAL_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = RETRIEVAL_CACHE_TTL_SECONDS,
+        database_path: Optional[str] = None,
+        corpus_version: Callable[[], str] = get_corpus_version,
+    ):
+        self.settings = settings
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.corpus_version = corpus_version
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, Tuple[_Entry, float]] = OrderedDict()
+        self._disk = _DiskTier(database_path) if database_path else None
+        self._version = corpus_version()
+        self.stats = CacheStats()
+
+    def _key(self, query: str, version: str) -> str:
+        return f"{version}\x00{self.settings}\x00{normalize_query(query)}"
+
+    def version(self) -> str:
+        """
+        Return the current corpus version, dropping the entries of an older one.
+
+        Searches capture it before they look up the cache and pass it on to `store`,
+        so results computed against a corpus that changed meanwhile are not cached.
+        """
+        version = self.corpus_version()
+        with self._lock:
+            if version == self._version:
+                return version
+            self._entries.clear()
+            self._version = version
+        if self._disk is not None:
+            self._disk.prune(version, self.ttl_seconds)
+        return version
+
+    def lookup(
+        self, query: str, version: Optional[str] = None
+    ) -> Optional[List[Document]]:
+        if version is None:
+            version = self.version()
+        key = self._key(query, version)
+
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and time.time() - cached[1] > self.ttl_seconds:
+                del self._entries[key]
+                cached = None
+            if cached is not None:
+                self._entries.move_to_end(key)
+
+        if cached is None and self._disk is not None:
+            cached = self._disk.lookup(key, self.ttl_seconds)
+            if cached is not None:
+                self._remember(key, cached)
+
+        self.stats.record(cached is not None)
+        return _deserialize(cached[0]) if cached is not None else None
+
+    def _remember(self, key: str, cached: Tuple[_Entry, float]):
+        with self._lock:
+            self._entries[key] = cached
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def store(self, query: str, documents: List[Document], version: str):
+        """
+        Cache the results of a search that started at corpus `version`, unless the
+        corpus has changed since.
+        """
+        if self.version() != version:
+            return
+        key = self._key(query, version)
+        entry = _serialize(documents)
+        self._remember(key, (entry, time.time()))
+        if self._disk is not None:
+            self._disk.store(key, version, entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+@lru_cache
+def get_retrieval_cache() -> Optional[RetrievalCache]:
+    """
+    Return the configured retrieval cache, or None when caching is disabled.
+    """
+    if RETRIEVAL_CACHE == "none":
+        return None
+    if RETRIEVAL_CACHE not in ("memory", "sqlite"):
+        raise ValueError(f"Unknown RETRIEVAL_CACHE store: {RETRIEVAL_CACHE!r}")
+
+    from utils.vector_store import retrieval_settings
+
+    cache = RetrievalCache(
+        settings=retrieval_settings(),
+        database_path=(
+            RETRIEVAL_CACHE_DATABASE_PATH if RETRIEVAL_CACHE == "sqlite" else None
+        ),
+    )
+    get_metrics().register_cache("retrieval", cache.stats)
+    return cache
@@ -0,0 +1,143 @@
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from pydantic import BaseModel
+
+# Named shards of the corpus, each ingested into its own collection. Without this
+# file the corpus is a single shard holding the bundled PDF
+CORPUS_SHARDS_PATH = os.getenv("CORPUS_SHARDS_PATH", "resources/corpus_shards.json")
+DEFAULT_SHARD = "pdf_documents"
+
+# Only search the shards whose centroid embedding is closest to the query: at most
+# `SHARD_ROUTING_MAX_SHARDS`, and only those within `SHARD_ROUTING_MARGIN` of the best
+SHARD_ROUTING = os.getenv("SHARD_ROUTING", "false").lower() == "true"
+SHARD_ROUTING_MAX_SHARDS = int(os.getenv("SHARD_ROUTING_MAX_SHARDS", "2"))
+SHARD_ROUTING_MARGIN = float(os.getenv("SHARD_ROUTING_MARGIN", "0.05"))
+
+SHARD_CENTROID_DIRECTORY = ".shard_centroids"
+
+# Embeddings read at once when averaging a Chroma collection
+_CENTROID_BATCH_SIZE = 1000
+
+
+class Shard(BaseModel):
+    """
+    Part of the corpus with its own collection, such as one manual or one topic.
+    `metadata` is copied onto every chunk retrieved from the shard.
+    """
+
+    name: str
+    paths: List[str] = []
+    description: str = ""
+    metadata: Dict[str, Any] = {}
+
+
+def load_shards(
+    default_paths: Sequence[str] = (), path: str = CORPUS_SHARDS_PATH
+) -> List[Shard]:
+    """
+    Read the shards of the corpus from `path`, a JSON file with a "shards" list, or
+    return the single default shard with `default_paths` when there is no such file.
+    """
+    if not os.path.exists(path):
+        return [Shard(name=DEFAULT_SHARD, paths=list(default_paths))]
+
+    with open(path, "r", encoding="utf-8") as f:
+        shards = [Shard.model_validate(item) for item in json.load(f)["shards"]]
+    names = [shard.name for shard in shards]
+    if not shards or len(set(names)) != len(names):
+        raise ValueError(f"{path} must list shards with distinct names")
+    return shards
+
+
+def _normalized(vectors: Any) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def shard_centroid(vector_store: VectorStore) -> Optional[np.ndarray]:
+    """
+    Mean of the normalized embeddings of a collection, or None when it is empty.
+    """
+    if hasattr(vector_store, "centroid"):
+        return vector_store.centroid()
+
+    total: Optional[np.ndarray] = None
+    count = 0
+    while True:
+        stored = vector_store.get(
+            include=["embeddings"], limit=_CENTROID_BATCH_SIZE, offset=count
+        )
+        embeddings = stored["embeddings"]
+        if embeddings is None or len(embeddings) == 0:
+            break
+        block = _normalized(embeddings).sum(axis=0)
+        total = block if total is None else total + block
+        count += len(embeddings)
+    return total / count if total is not None else None
+
+
+def centroid_path(name: str) -> str:
+    return os.path.join(SHARD_CENTROID_DIRECTORY, f"{name}.npy")
+
+
+def build_centroid(name: str, vector_store: VectorStore) -> Optional[np.ndarray]:
+    centroid = shard_centroid(vector_store)
+    path = centroid_path(name)
+    if centroid is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+    os.makedirs(SHARD_CENTROID_DIRECTORY, exist_ok=True)
+    np.save(path, centroid)
+    return centroid
+
+
+def load_centroid(name: str, vector_store: VectorStore) -> Optional[np.ndarray]:
+    path = centroid_path(name)
+    if os.path.exists(path):
+        return np.load(path)
+    return build_centroid(name, vector_store)
+
+
+class ShardRouter:
+    """
+    Picks the shards to search for a query by the similarity of the query embedding
+    to the centroid embedding of each shard, so a search only reaches a bounded number
+    of shards however many the corpus has.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        centroids: Dict[str, np.ndarray],
+        max_shards: int = SHARD_ROUTING_MAX_SHARDS,
+        margin: float = SHARD_ROUTING_MARGIN,
+    ):
+        self.embeddings = embeddings
+        self.names = list(centroids)
+        self.centroids = (
+            _normalized(np.stack([centroids[name] for name in self.names]))
+            if centroids
+            else None
+        )
+        self.max_shards = max_shards
+        self.margin = margin
+
+    def route(self, query: str) -> List[str]:
+        if self.centroids is None or len(self.names) <= 1:
+            return list(self.names)
+        vector = _normalized(self.embeddings.embed_query(query))
+        similarities = self.centroids @ vector
+        ranked = np.argsort(-similarities)[: self.max_shards]
+        best = similarities[ranked[0]]
+        return [
+            self.names[index]
+            for index in ranked
+            if similarities[index] >= best - self.margin
+        ]
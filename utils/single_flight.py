@@ -0,0 +1,60 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one: the first caller runs the
+    function, the others wait for and share its result or its error. Nothing is kept
+    once the call completes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._futures: Dict[Tuple[int, Hashable], asyncio.Future] = {}
+
+    def do(self, key: Hashable, function: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key: Hashable, function: Callable[[], Awaitable[T]]) -> T:
+        # Futures belong to an event loop, so calls only collapse within one loop
+        loop_key = (id(asyncio.get_running_loop()), key)
+        future = self._futures.get(loop_key)
+        if future is None:
+            future = asyncio.ensure_future(function())
+            self._futures[loop_key] = future
+            future.add_done_callback(lambda _: self._futures.pop(loop_key, None))
+        # A cancelled waiter must not cancel the call the others are waiting for
+        return await asyncio.shield(future)
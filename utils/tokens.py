@@ -0,0 +1,11 @@
+import math
+
+# Rough number of characters per token for English text
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate used for prompt budgets, without calling a tokenizer.
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
@@ -1,64 +1,222 @@
+import json
 import os
-from typing import List
+from typing import Dict, List, Sequence, Union
 from langchain_core.documents import Document
-from langchain_chroma import Chroma
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
 from langchain.retrievers.contextual_compression import ContextualCompressionRetriever
 
-from utils.aws_bedrock import embeddings, compressor
+from utils.aws_bedrock import (
+    get_compressor,
+    get_embeddings,
+    model_arn_rerank,
+    model_id_embeddings,
+)
+from utils.corpus_version import bump_corpus_version
+from utils.ingestion import ingest, iter_chunks, iter_pages, text_splitter
+from utils.lexical_index import BM25Index, lexical_index_path
+from utils.retrieval import (
+    HYBRID_RETRIEVAL,
+    RERANK_MAX_SCORE_GAP,
+    RERANK_MIN_SCORE,
+    RETRIEVAL_CANDIDATES,
+    RETRIEVAL_MAX_CHUNKS,
+    RETRIEVAL_TOKEN_BUDGET,
+    AdaptiveRerank,
+    HybridRetriever,
+    ShardedRetriever,
+)
+from utils.shards import (
+    DEFAULT_SHARD,
+    SHARD_ROUTING,
+    SHARD_ROUTING_MARGIN,
+    SHARD_ROUTING_MAX_SHARDS,
+    Shard,
+    ShardRouter,
+    build_centroid,
+    centroid_path,
+    load_centroid,
+    load_shards,
+)
 
-# Directory for persistent storage
-PERSIST_DIRECTORY = ".chroma_db"
+# Vector store backend: "chroma", or "numpy" for the in-process memory-mapped index
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "chroma").lower()
 
-text_splitter = RecursiveCharacterTextSplitter(
-    # Set a really small chunk size, just to show.
-    chunk_size=2048,
-    chunk_overlap=200,
-    length_function=len,
-    is_separator_regex=False,
-)
+# Directories for persistent storage
+PERSIST_DIRECTORY = ".chroma_db"
+NUMPY_PERSIST_DIRECTORY = ".vector_index"
+COLLECTION_NAME = DEFAULT_SHARD
 
 
 def load_pdf(file_path: str) -> List[Document]:
-    loader = PyPDFLoader(file_path)
-    pages: List[Document] = []
-    for page in loader.lazy_load():
-        pages.append(page)
+    return list(iter_chunks(iter_pages(file_path)))
 
-        # Pretty print the page content
-        print(f"Loading page {page.metadata['page']}: {page.page_content[:50]}...\n\n")
 
-    documents = text_splitter.create_documents([page.page_content for page in pages])
+def open_vector_store(collection_name: str = COLLECTION_NAME) -> VectorStore:
+    if VECTOR_STORE_BACKEND == "numpy":
+        from utils.numpy_store import NumpyVectorStore
 
-    return documents
+        return NumpyVectorStore(
+            embedding=get_embeddings(),
+            directory=os.path.join(NUMPY_PERSIST_DIRECTORY, collection_name),
+        )
 
+    from langchain_chroma import Chroma
 
-def load_vector_store(file_path: str) -> ContextualCompressionRetriever:
     # Create persist directory if it doesn't exist
     os.makedirs(PERSIST_DIRECTORY, exist_ok=True)
 
     # Initialize ChromaDB with persistence
-    vector_store = Chroma(
-        embedding_function=embeddings,
+    return Chroma(
+        embedding_function=get_embeddings(),
         persist_directory=PERSIST_DIRECTORY,
-        collection_name="pdf_documents",
+        collection_name=collection_name,
     )
 
-    # Check if the collection already has documents
-    if vector_store._collection.count() == 0:
-        print("Loading PDF and creating embeddings...")
-        documents = load_pdf(file_path)
-        vector_store.add_documents(documents)
-        print("Documents added to vector store")
-    else:
-        print("Vector store already contains documents")
 
-    print(f"Vector store loaded with {vector_store._collection.count()} documents")
+def retrieval_settings() -> str:
+    """
+    Describe the settings the search results depend on, so results cached under other
+    settings, such as by another process sharing the cache file, are not reused.
+    """
+    return json.dumps(
+        [
+            VECTOR_STORE_BACKEND,
+            [shard.name for shard in load_shards()],
+            SHARD_ROUTING,
+            SHARD_ROUTING_MAX_SHARDS,
+            SHARD_ROUTING_MARGIN,
+            model_id_embeddings,
+            model_arn_rerank,
+            HYBRID_RETRIEVAL,
+            RETRIEVAL_CANDIDATES,
+            RETRIEVAL_MAX_CHUNKS,
+            RETRIEVAL_TOKEN_BUDGET,
+            RERANK_MIN_SCORE,
+            RERANK_MAX_SCORE_GAP,
+        ]
+    )
+
+
+def document_count(vector_store: VectorStore) -> int:
+    if hasattr(vector_store, "count"):
+        return vector_store.count()
+    return vector_store._collection.count()
+
+
+def sync_vector_store(
+    vector_store: VectorStore,
+    paths: Union[str, Sequence[str]],
+    collection_name: str = COLLECTION_NAME,
+):
+    # Only embed new chunks and delete the ones that no longer exist in the PDFs
+    print(f"Loading PDFs and syncing embeddings of {collection_name}...")
+    result = ingest(vector_store, paths)
+    print(
+        f"Vector store synced: {result.added} added, "
+        f"{result.unchanged} unchanged, {result.deleted} deleted"
+    )
+    changed = result.added or result.deleted
+    if changed:
+        bump_corpus_version()
+    if changed or not os.path.exists(lexical_index_path(collection_name)):
+        build_lexical_index(vector_store, collection_name)
+    if changed or not os.path.exists(centroid_path(collection_name)):
+        build_centroid(collection_name, vector_store)
+
+
+def build_lexical_index(
+    vector_store: VectorStore, collection_name: str = COLLECTION_NAME
+) -> BM25Index:
+    """
+    Rebuild the BM25 index from all chunks in the collection and persist it.
+    """
+    stored = vector_store.get(include=["documents"])
+    lexical_index = BM25Index.build(stored["ids"], stored["documents"])
+    lexical_index.save(lexical_index_path(collection_name))
+    print(f"Lexical index built with {len(stored['ids'])} documents")
+    return lexical_index
+
+
+def load_lexical_index(
+    vector_store: VectorStore, collection_name: str = COLLECTION_NAME
+) -> BM25Index:
+    path = lexical_index_path(collection_name)
+    if os.path.exists(path):
+        return BM25Index.load(path)
+    return build_lexical_index(vector_store, collection_name)
+
+
+def _shard_retriever(shard: Shard, vector_store: VectorStore) -> BaseRetriever:
+    if HYBRID_RETRIEVAL:
+        return HybridRetriever(
+            vector_store=vector_store,
+            lexical_index=load_lexical_index(vector_store, shard.name),
+            k=RETRIEVAL_CANDIDATES,
+            k_on_agreement=RETRIEVAL_CANDIDATES // 2,
+        )
+    return vector_store.as_retriever(search_kwargs={"k": RETRIEVAL_CANDIDATES})
+
+
+def load_vector_store(
+    paths: Union[str, Sequence[str]],
+    sync: bool = True,
+) -> ContextualCompressionRetriever:
+    """
+    Open the vector store of every shard of the corpus and wrap them in a reranking
+    retriever. `paths` are the PDFs of the default shard, used when no shards are
+    configured.
+
+    With `sync=False` the PDFs of a shard are only ingested when its collection is
+    still empty; keeping it in sync is then left to the offline `ingest.py` command.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+
+    shards = load_shards(paths)
+    vector_stores: Dict[str, VectorStore] = {}
+    for shard in shards:
+        vector_store = open_vector_store(shard.name)
+        if sync or document_count(vector_store) == 0:
+            sync_vector_store(vector_store, shard.paths, shard.name)
+        print(
+            f"Vector store {shard.name} loaded with "
+            f"{document_count(vector_store)} documents"
+        )
+        vector_stores[shard.name] = vector_store
+
+    retrievers = {
+        shard.name: _shard_retriever(shard, vector_stores[shard.name])
+        for shard in shards
+    }
+    if len(shards) == 1 and not shards[0].metadata:
+        base_retriever = retrievers[shards[0].name]
+    else:
+        router = None
+        if SHARD_ROUTING:
+            centroids = {
+                name: load_centroid(name, vector_store)
+                for name, vector_store in vector_stores.items()
+            }
+            router = ShardRouter(
+                get_embeddings(),
+                {
+                    name: centroid
+                    for name, centroid in centroids.items()
+                    if centroid is not None
+                },
+            )
+        base_retriever = ShardedRetriever(
+            shards=retrievers,
+            shard_metadata={shard.name: shard.metadata for shard in shards},
+            router=router,
+            k=RETRIEVAL_CANDIDATES,
+        )
 
+    # Over-fetch candidates and let the rerank scores decide how many are kept
     compression_retriever = ContextualCompressionRetriever(
-        base_compressor=compressor,
-        base_retriever=vector_store.as_retriever(search_kwargs={"k": 10}),
+        base_compressor=AdaptiveRerank(reranker=get_compressor()),
+        base_retriever=base_retriever,
     )
 
     return compression_retriever
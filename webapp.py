@@ -0,0 +1,28 @@
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+from utils.metrics import get_metrics
+
+# Prometheus text exposition format
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+async def metrics(request: Request) -> PlainTextResponse:
+    return PlainTextResponse(
+        get_metrics().to_prometheus(), media_type=PROMETHEUS_CONTENT_TYPE
+    )
+
+
+async def metrics_json(request: Request) -> JSONResponse:
+    return JSONResponse(get_metrics().snapshot())
+
+
+# Served alongside the graph by the LangGraph server, see `http.app` in langgraph.json
+app = Starlette(
+    routes=[
+        Route("/metrics", metrics),
+        Route("/metrics.json", metrics_json),
+    ]
+)